@@ -0,0 +1,192 @@
+"""
+Benchmarks of the datatype codecs.
+
+Pack and unpack throughput is measured for every type, for typical method
+signatures and for bulk decoding of records. Machines differ in speed, so
+results are compared with the stored baseline relatively: every result is
+divided by the geometric mean of all the results of its run. A relative
+ratio below 1 means the codec got slower than the others since the baseline.
+The comparison is a report only, unless --check is given. Round-trip
+correctness is tested by tests/test_datatypes.py.
+
+:Example:
+    python benchmarks/datatypes.py            # compare to baseline
+    python benchmarks/datatypes.py --save     # store a new baseline
+    python benchmarks/datatypes.py --check --threshold .4
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import timeit
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+sys.path.insert(0, os.path.join(_ROOT, 'tests'))
+
+from stealthapi.core.columns import _count_struct, unpack_column, \
+    unpack_records
+from stealthapi.core.datatypes import *
+from stealthapi.core.scriptmethod import ScriptMethod
+
+from samples import pack_records, random_datetime
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+# typical values for throughput measurement
+SAMPLES = {
+    Bool: True, Char: b'x', Byte: -5, UByte: 200, Short: -1000,
+    UShort: 60000, Int: -100000, UInt: 0x40001234, Long: -2 ** 40,
+    ULong: 2 ** 60, Float: 1.5, Double: 123.456, Str: 'Hello, Stealth!',
+    Buffer: bytes(32), DateTime: datetime.datetime(2022, 2, 24, 4, 0),
+}
+
+# typical method signatures: name -> (argtypes, args, restype, result)
+SIGNATURES = {
+    'object_id->bool': ((UInt,), (0x40001234,), Bool, True),
+    'xyz->none': ((UShort, UShort, Byte), (1500, 2000, 10), None, None),
+    'id_color_container->uint': ((UShort, UShort, UInt), (0x0EED, 0xFFFF,
+                                                          0x40001234),
+                                 UInt, 0x40001234),
+    'text->none': ((Str,), ('Hello, Stealth!',), None, None),
+    'none->str': ((), (), Str, 'Hello, Stealth!'),
+    'none->datetime': ((), (), DateTime, SAMPLES[DateTime]),
+}
+
+# journal-like records decoded in bulk: time, object id, a short value
+RECORD_FIELDS = (DateTime, UInt, Short)
+RECORD_COUNT = 1000
+
+
+def _random_records(count: int) -> bytes:
+    rnd = random.Random(0)  # the same data for every run
+    records = [(random_datetime(rnd), rnd.randint(0, 2 ** 32 - 1),
+                rnd.randint(-2 ** 15, 2 ** 15 - 1)) for _ in range(count)]
+    return pack_records(RECORD_FIELDS, records)
+
+
+def _best(stmt, repeat: int) -> float:
+    """Return operations per second of the given callable, best of repeats."""
+    timer = timeit.Timer(stmt)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number))
+    return number / best
+
+
+def run_benchmarks(repeat: int) -> dict[str, float]:
+    """Measure the codecs throughput, operations per second."""
+    results = {}
+    for type_, value in SAMPLES.items():
+        data = type_(value).pack()
+        results[f'pack/{type_.__name__}'] = _best(
+            lambda: type_(value).pack(), repeat)
+        results[f'unpack/{type_.__name__}'] = _best(
+            lambda: type_.unpack_from(data).value, repeat)
+
+    for name, (argtypes, args, restype, result) in SIGNATURES.items():
+        method = ScriptMethod(0, list(argtypes), restype)
+        results[f'call_pack/{name}'] = _best(
+            lambda: method._form_packet(1, args), repeat)
+        if restype is not None:
+            data = restype(result).pack()
+            results[f'call_unpack/{name}'] = _best(
+                lambda: method._unpack_result(data, None), repeat)
+
+    # decoding of many records, one by one against the column decoders
+    data = _random_records(RECORD_COUNT)
+    record_size = sum(type_._struct.size for type_ in RECORD_FIELDS)
+    offsets = range(_count_struct.size, len(data), record_size)
+
+    def unpack_each() -> list[tuple]:
+        records = []
+        for offset in offsets:
+            record = []
+            for type_ in RECORD_FIELDS:
+                value = type_.unpack_from(data, offset)
+                offset += value.size
+                record.append(value.value)
+            records.append(tuple(record))
+        return records
+
+    name = f'records_x{RECORD_COUNT}'
+    results[f'unpack_each/{name}'] = _best(unpack_each, repeat)
+    results[f'unpack_records/{name}'] = _best(
+        lambda: unpack_records(data, RECORD_FIELDS), repeat)
+    results[f'unpack_records_epoch/{name}'] = _best(
+        lambda: unpack_records(data, RECORD_FIELDS)[0].epoch(), repeat)
+    dates = pack_records((DateTime,), [(SAMPLES[DateTime],)] * RECORD_COUNT)
+    results[f'unpack_column/datetime_x{RECORD_COUNT}'] = _best(
+        lambda: unpack_column(DateTime, dates), repeat)
+    return results
+
+
+def relative_ratios(results: dict[str, float],
+                    baseline: dict[str, float]) -> dict[str, float]:
+    """Compare the results with the baseline independently of the machine
+    speed: every result is taken relative to the geometric mean of the
+    results of its run, only the names present in both runs count.
+
+    :return: name -> relative ratio, > 1 - faster than in the baseline
+    """
+    names = [name for name in results if name in baseline]
+    if not names:
+        return {}
+
+    def geometric_mean(values: dict[str, float]) -> float:
+        return math.exp(sum(math.log(values[name]) for name in names)
+                        / len(names))
+
+    scale = geometric_mean(baseline) / geometric_mean(results)
+    return {name: results[name] / baseline[name] * scale for name in names}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--check', action='store_true',
+                        help='fail if a relative ratio is below the '
+                             'threshold')
+    parser.add_argument('--threshold', type=float, default=.5,
+                        help='allowed relative slowdown against the '
+                             'baseline')
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    results = run_benchmarks(options.repeat)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as file:
+            baseline = json.load(file)['results']
+    ratios = relative_ratios(results, baseline)
+
+    regressions = 0
+    for name, ops in results.items():
+        line = f'{name:40} {ops:14,.0f} ops/s'
+        if name in ratios:
+            line += f'  {ratios[name]:6.2f}x'
+            if options.check and ratios[name] < 1 - options.threshold:
+                line += '  REGRESSION'
+                regressions += 1
+        print(line)
+
+    if options.save:
+        with open(BASELINE_PATH, 'w') as file:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'results': results}, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f'baseline saved to {BASELINE_PATH}')
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
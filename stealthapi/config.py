@@ -12,7 +12,12 @@ put it in the __all__ list.
 False
 """
 
-__all__ = ['HOST', 'PORT', 'ENDIAN', 'STEALTH_CODEC', 'TIMER_RES', 'DEBUG']
+__all__ = ['HOST', 'PORT', 'ENDIAN', 'STEALTH_CODEC', 'TIMER_RES',
+           'REQUEST_TIMEOUT', 'RECONNECT_DELAY', 'RECONNECT_MAX_DELAY',
+           'RECONNECT_ATTEMPTS', 'TCP_NODELAY', 'FLUSH_MAX_PACKETS',
+           'FLUSH_MAX_BYTES', 'LOW_PRIORITY_LIMIT', 'CONCURRENCY_LIMIT',
+           'MAX_CONCURRENCY', 'ENGINE', 'SCRIPT_HOST_PORT',
+           'SCRIPT_HOST_WORKERS', 'PROXY_PATH', 'PROXY_PORT', 'DEBUG']
 
 import configparser
 import os
@@ -31,6 +36,30 @@ STEALTH_CODEC = 'UTF-16LE'  # unicode codec used by Stealth
 
 TIMER_RES = .005  # timer resolution (delay in loops, milliseconds)
 
+REQUEST_TIMEOUT = 30.  # default method response timeout (seconds, 0 - none)
+
+RECONNECT_DELAY = .5  # delay before the second reconnection attempt (seconds)
+RECONNECT_MAX_DELAY = 30.  # the delay doubles up to this value (seconds)
+RECONNECT_ATTEMPTS = 0  # give up after this count of attempts (0 - never)
+
+TCP_NODELAY = True  # disable Nagle's algorithm on the connection socket
+FLUSH_MAX_PACKETS = 64  # send queued packets when there are so many of them
+FLUSH_MAX_BYTES = 65536  # send queued packets when their size reaches it
+LOW_PRIORITY_LIMIT = 4  # max count of low priority requests in flight
+CONCURRENCY_LIMIT = 16  # initial adaptive requests in flight limit (0 - none)
+MAX_CONCURRENCY = 256  # the adaptive limit never grows above it
+
+# "asyncio" - event loop based connection, "socket" - plain blocking socket
+# without an event loop, the fastest one for sequential scripts
+ENGINE = 'asyncio'
+
+SCRIPT_HOST_PORT = 47610  # script host port if there are no Unix sockets
+SCRIPT_HOST_WORKERS = 4  # count of scripts the script host runs at once
+
+# connect through the stealthapi.proxy daemon sharing connections with Stealth
+PROXY_PATH = ''  # Unix socket path of the proxy ('' - do not use the proxy)
+PROXY_PORT = 0  # localhost port of the proxy if there are no Unix sockets
+
 DEBUG = False  # set to True if you want to see debug messages
 
 
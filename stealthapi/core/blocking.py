@@ -0,0 +1,319 @@
+"""
+This module provides a connection with Stealth over a plain blocking socket.
+
+It talks the same protocol as StealthConnection but needs no event loop: a
+method call sends the request and reads the socket until the response with
+the matching request id arrives. Events and other packets received on the way
+are handled: events are passed to their sinks or queued if there are none.
+It is used when the ENGINE config value is "socket".
+"""
+
+__all__ = ['BlockingConnection']
+
+import collections
+import logging
+import socket
+import struct
+import threading
+import time
+
+from stealthapi.config import DEBUG, ENDIAN, HOST, PROXY_PATH, PROXY_PORT, \
+    TCP_NODELAY
+from stealthapi.core.commands import EVENT_PROC, METHOD_RESPONSE, \
+    PAUSE_SCRIPT, SET_EVENT, TERMINATE_SCRIPT, UNSET_EVENT
+from stealthapi.core.eventdecoder import EventSink, dispatch_event
+from stealthapi.core.packet import lang_version_packet, pack_packet, \
+    packet_header_struct, packet_id_struct, packet_size_struct
+from stealthapi.core.protocol import MAX_REQUEST_ID
+from stealthapi.core.utils import format_packet, \
+    get_connection_port_blocking, get_proxy_token
+
+
+_BUFFER_SIZE = 65536  # initial size of the receive buffer
+_MAX_EVENTS = 4096  # the oldest events are dropped when there are more
+_TIMEOUT_SLACK = .01  # a read may wait this longer than its deadline, seconds
+_MIN_SEND_TIMEOUT = 1.  # shorter socket timeouts are not kept for sends
+
+_event_index_struct = struct.Struct(ENDIAN + 'B')
+
+
+class BlockingConnection:
+    """A connection with Stealth over a blocking socket."""
+
+    _sock: socket.socket
+    _buffer: bytearray  # reusable receive buffer
+    _view: memoryview  # view of the receive buffer
+    _start: int  # offset of the first not handled byte in the buffer
+    _end: int  # offset of the end of received data in the buffer
+    _timeout: float | None  # the timeout of the socket, seconds
+
+    _request_id: int  # the last request id given to a returning result method
+    _pause: bool  # pause script
+
+    # data of received event packets without sinks, see `receive_events`
+    events: collections.deque[bytes]
+    dropped_responses: int  # count of responses nobody waited for
+
+    event_sinks: dict[int, tuple[EventSink, ...]]  # event index -> consumers
+
+    _logger: logging.Logger
+
+    def __init__(self) -> None:
+        """Initiate class fields values and connect to Stealth."""
+        self._buffer = bytearray(_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = self._end = 0
+        self._request_id = 0
+        self._pause = False
+        self.events = collections.deque(maxlen=_MAX_EVENTS)
+        self.dropped_responses = 0
+        self.event_sinks = {}
+        # init logger
+        thread = threading.current_thread()
+        logger_name = f'{self.__class__.__name__}-{thread.ident}'
+        self._logger = logging.getLogger(logger_name)
+
+        if PROXY_PATH and hasattr(socket, 'AF_UNIX'):
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(PROXY_PATH)
+        else:
+            token = b''
+            if PROXY_PORT:
+                token = get_proxy_token()
+                address = 'localhost', PROXY_PORT
+            else:
+                address = HOST, get_connection_port_blocking()
+            self._sock = socket.create_connection(address)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                                  int(TCP_NODELAY))
+            if token:
+                self._sock.sendall(token)  # the proxy expects it first
+        self._timeout = self._sock.gettimeout()
+        self.send(lang_version_packet)
+        self._logger.debug('connected')
+
+    def close(self) -> None:
+        """Close the socket."""
+        self._sock.close()
+        self._logger.debug('connection closed')
+
+    @property
+    def request_id(self) -> int:
+        """A unique request id for methods returning result."""
+        # start from 1 again if greater than unsigned short max value
+        self._request_id = self._request_id % MAX_REQUEST_ID + 1
+        return self._request_id
+
+    @property
+    def pause(self) -> bool:
+        """True if the current script is on pause."""
+        return self._pause
+
+    def send(self, data: bytes | bytearray) -> None:
+        """Send the given data to Stealth."""
+        # keep the timeout of reads unless it is too short to send the data
+        if self._timeout is not None and self._timeout < _MIN_SEND_TIMEOUT:
+            self._set_timeout(None)
+        self._sock.sendall(data)
+        if DEBUG:
+            self._logger.debug(f'data sent: {format_packet(data)}')
+
+    def wait_unpaused(self, deadline: float | None = None) -> None:
+        """Handle incoming packets until the script is unpaused.
+
+        :param deadline: time.monotonic() value to give up at, None - never
+        :raises TimeoutError: if the deadline is reached
+        """
+        while self._pause:
+            self._handle_packet(0, deadline)
+
+    def wait_response(self, request_id: int,
+                      deadline: float | None = None) -> bytes:
+        """Handle incoming packets until the response for the given request.
+
+        :param request_id: the request id
+        :param deadline: time.monotonic() value to give up at, None - never
+        :return: the response data
+        :raises TimeoutError: if the deadline is reached
+        """
+        while 42:
+            data = self._handle_packet(request_id, deadline)
+            if data is not None:
+                return data
+
+    def add_event_sink(self, index: int, sink: EventSink) -> None:
+        """Add a consumer of events with the given index.
+
+        Stealth is asked to send the events when the first consumer appears.
+        The sinks are fed while the socket is read, by method calls or by
+        `receive_events`.
+        """
+        sinks = self.event_sinks.get(index, ())
+        self.event_sinks[index] = sinks + (sink,)
+        if not sinks:
+            self.send(pack_packet(SET_EVENT, 0,
+                                  _event_index_struct.pack(index)))
+
+    def remove_event_sink(self, index: int, sink: EventSink) -> None:
+        """Remove a consumer of events with the given index.
+
+        Stealth is asked to stop sending the events when the last consumer
+        leaves.
+        """
+        sinks = list(self.event_sinks.get(index, ()))
+        if sink not in sinks:
+            return
+        sinks.remove(sink)
+        if sinks:
+            self.event_sinks[index] = tuple(sinks)
+        else:
+            del self.event_sinks[index]
+            self.send(pack_packet(UNSET_EVENT, 0,
+                                  _event_index_struct.pack(index)))
+
+    def restore_event_sinks(self,
+                            event_sinks: dict[int, tuple[EventSink, ...]]
+                            ) -> None:
+        """Take over the event consumers of a closed connection, Stealth is
+        asked to send their events again."""
+        for index, sinks in event_sinks.items():
+            for sink in sinks:
+                self.add_event_sink(index, sink)
+
+    def receive_events(self, timeout: float = 0.) -> list[bytes]:
+        """Handle the packets received within the timeout and return the data
+        of the queued events. The queue is emptied.
+
+        Events are handled only while the socket is read, by method calls or
+        by this method. Events with sinks are passed to them, the others are
+        queued. At most the last 4096 events are kept.
+
+        :param timeout: seconds to wait for packets, 0 - handle only the
+            packets which are received already
+        :return: data of the events, the oldest first
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while 42:
+                self._handle_packet(0, deadline)
+        except TimeoutError:
+            pass
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def _handle_packet(self, request_id: int,
+                       deadline: float | None) -> bytes | None:
+        """
+        Receive and handle one packet. Return its data if it is the response
+        for the request with the given id.
+        """
+        size, cmd = self._read_header(deadline)
+        start = self._start + packet_header_struct.size
+        end = self._start + packet_size_struct.size + size
+        self._start = end
+
+        # method response
+        if cmd == METHOD_RESPONSE:
+            response_id, = packet_id_struct.unpack_from(self._buffer, start)
+            start += packet_id_struct.size
+            if response_id == request_id:
+                return bytes(self._view[start:end])
+            self.dropped_responses += 1
+            self._logger.debug(f'response dropped: {response_id}')
+
+        # event
+        elif cmd == EVENT_PROC:
+            sinks = self.event_sinks.get(self._buffer[start]) \
+                if start < end else None
+            if sinks:
+                dispatch_event(bytes(self._view[start:end]), sinks,
+                               self._logger)
+            else:
+                self.events.append(bytes(self._view[start:end]))
+
+        # pause script
+        elif cmd == PAUSE_SCRIPT:
+            self._pause = not self._pause
+
+        # terminate script
+        elif cmd == TERMINATE_SCRIPT:
+            exit()
+
+        # other
+        else:
+            self._logger.warning(f'Unknown packet type: {cmd}')
+        return None
+
+    def _read_header(self, deadline: float | None) -> tuple[int, int]:
+        """
+        Receive data until there is a whole packet in the buffer and return
+        its size and command.
+        """
+        while 42:
+            available = self._end - self._start
+            if available >= packet_header_struct.size:
+                size, cmd = packet_header_struct.unpack_from(
+                    self._buffer, self._start)
+                if available >= packet_size_struct.size + size:
+                    return size, cmd
+                self._reserve(packet_size_struct.size + size)
+            self._receive(deadline)
+
+    def _reserve(self, size: int) -> None:
+        """Make room for a packet of the given size in the buffer."""
+        if self._start + size <= len(self._buffer):
+            return
+
+        # move not handled data to the beginning of the buffer
+        available = self._end - self._start
+        if size > len(self._buffer):
+            buffer = bytearray(size)
+            buffer[:available] = self._view[self._start:self._end]
+            self._view.release()
+            self._buffer = buffer
+            self._view = memoryview(self._buffer)
+        else:
+            data = bytes(self._view[self._start:self._end])
+            self._buffer[:available] = data
+        self._start, self._end = 0, available
+
+    def _receive(self, deadline: float | None) -> None:
+        """Receive available data into the buffer."""
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            self._reserve(len(self._buffer))
+
+        # every settimeout is a system call, the timeout is changed only if it
+        # would wait past the deadline, or after a shorter one has expired
+        if deadline is None:
+            if self._timeout is not None:
+                self._set_timeout(None)
+        else:
+            # read the data received already even if the deadline is reached
+            remaining = max(deadline - time.monotonic(), 0.)
+            if self._timeout is None or \
+                    self._timeout > remaining + _TIMEOUT_SLACK:
+                self._set_timeout(remaining)
+
+        while 42:
+            try:
+                received = self._sock.recv_into(self._view[self._end:])
+                break
+            except (socket.timeout, BlockingIOError):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('Stealth has not answered in '
+                                       'time.') from None
+                self._set_timeout(remaining)
+        if not received:
+            raise ConnectionResetError('The connection with Stealth was lost.')
+        if DEBUG:
+            data = self._view[self._end:self._end + received]
+            self._logger.debug(f'data received: {format_packet(data)}')
+        self._end += received
+
+    def _set_timeout(self, timeout: float | None) -> None:
+        self._sock.settimeout(timeout)
+        self._timeout = timeout
@@ -0,0 +1,172 @@
+"""
+This module provides bulk decoders of packed runs of numbers and dates.
+
+Decoding many values one by one creates a data type instance for every value,
+and a datetime for every date. The decoders here turn a run of values into a
+compact column instead: an `array.array` of numbers, or a DateTimeColumn
+keeping Delphi dates as doubles and creating datetime objects only when asked.
+Records of several fixed size fields are decoded into a column per field.
+
+:Example:
+>>> from stealthapi.core.columns import unpack_records
+>>> from stealthapi.core.datatypes import DateTime, UInt
+>>> times, ids = unpack_records(data, (DateTime, UInt))
+>>> times.epoch()  # array('d') of Unix timestamps
+>>> times[0]  # a datetime
+"""
+
+__all__ = ['DELPHI_UNIX_EPOCH', 'DateTimeColumn', 'Column', 'unpack_column',
+           'unpack_records']
+
+import array
+import datetime
+import struct
+import sys
+from typing import Iterator
+
+from stealthapi.config import ENDIAN
+from stealthapi.core.datatypes import *
+
+DELPHI_UNIX_EPOCH = 25569.  # days from the Delphi epoch to the Unix epoch
+
+_SECONDS_PER_DAY = 86400.
+_DELPHI_EPOCH = datetime.datetime(1899, 12, 30)
+
+_count_struct = struct.Struct(ENDIAN + 'I')  # count of values before a run
+
+# ENDIAN is native if it is "=" or matches the byte order of the machine
+_SWAP = ENDIAN != '=' and (ENDIAN == '<') != (sys.byteorder == 'little')
+
+
+def _array_typecode(fmt: str) -> str:
+    """Return the array typecode of items of the same size as the format."""
+    size = struct.calcsize(fmt)
+    if fmt in 'fd':
+        return fmt
+    if fmt in '?c':
+        return 'B'
+    candidates = 'bhilq' if fmt.islower() else 'BHILQ'
+    for typecode in candidates:
+        if array.array(typecode).itemsize == size:
+            return typecode
+    raise TypeError(f'There is no array type for the "{fmt}" format.')
+
+
+class DateTimeColumn:
+    """A column of dates kept as Delphi doubles (days since 1899-12-30).
+
+    Indexing and iteration create datetime objects, `days` and `epoch` do
+    not.
+    """
+
+    __slots__ = ('days',)
+
+    days: array.array  # array('d') of Delphi dates
+
+    def __init__(self, days: array.array) -> None:
+        self.days = days
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __getitem__(self, index: int) -> datetime.datetime:
+        return _DELPHI_EPOCH + datetime.timedelta(days=self.days[index])
+
+    def __iter__(self) -> Iterator[datetime.datetime]:
+        epoch = _DELPHI_EPOCH
+        timedelta = datetime.timedelta
+        return (epoch + timedelta(days=days) for days in self.days)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({len(self)} dates)'
+
+    def epoch(self) -> array.array:
+        """Return the dates as array('d') of Unix timestamps.
+
+        Stealth dates have no time zone, they are taken as UTC ones.
+        """
+        offset = DELPHI_UNIX_EPOCH
+        return array.array('d', ((days - offset) * _SECONDS_PER_DAY
+                                 for days in self.days))
+
+    def datetimes(self) -> list[datetime.datetime]:
+        """Return the dates as a list of datetime objects."""
+        return list(self)
+
+
+Column = array.array | DateTimeColumn
+
+
+def _column(type_: type[DataTypeBase], values: array.array) -> Column:
+    return DateTimeColumn(values) if type_ is DateTime else values
+
+
+def _fixed_fmt(type_: type[DataTypeBase]) -> str:
+    fmt = getattr(type_, '_fmt', None)
+    if not isinstance(fmt, str):  # a property of variable size types
+        raise TypeError(f'{type_.__name__} values have no fixed size.')
+    return fmt
+
+
+def unpack_column(type_: type[DataTypeBase], buffer: bytes | bytearray,
+                  offset: int = 0, count: int | None = None
+                  ) -> tuple[Column, int]:
+    """Decode a run of values of one fixed size type. Bool and Char values
+    are decoded as numbers.
+
+    :param type_: a numeric data type or DateTime
+    :param buffer: bytes sequence
+    :param offset: the position of the run in the sequence
+    :param count: count of values, None - read it as a UInt before the run
+    :return: the column and the offset after the run
+    :raises TypeError: if the values of the type have no fixed size
+    :raises ValueError: if the buffer is too short
+    """
+    fmt = _fixed_fmt(type_)
+    if count is None:
+        count, = _count_struct.unpack_from(buffer, offset)
+        offset += _count_struct.size
+
+    end = offset + count * struct.calcsize(fmt)
+    if end > len(buffer):
+        raise ValueError(f'Not enough data for {count} {type_.__name__} '
+                         f'values: {len(buffer) - offset} bytes')
+    values = array.array(_array_typecode(fmt))
+    values.frombytes(buffer[offset:end])
+    if _SWAP:
+        values.byteswap()
+    return _column(type_, values), end
+
+
+def unpack_records(buffer: bytes | bytearray,
+                   fields: tuple[type[DataTypeBase], ...], offset: int = 0,
+                   count: int | None = None) -> tuple[Column, ...]:
+    """Decode a run of records of fixed size fields into a column per field.
+
+    :param buffer: bytes sequence
+    :param fields: data types of the record fields, numeric or DateTime
+    :param offset: the position of the run in the sequence
+    :param count: count of records, None - read it as a UInt before the run
+    :return: columns in the order of the fields
+    :raises TypeError: if the values of a field type have no fixed size
+    :raises ValueError: if the buffer is too short
+    """
+    fmts = [_fixed_fmt(type_) for type_ in fields]
+    # chars are decoded as numbers like by unpack_column
+    record = struct.Struct(ENDIAN + ''.join('B' if fmt == 'c' else fmt
+                                            for fmt in fmts))
+    if count is None:
+        count, = _count_struct.unpack_from(buffer, offset)
+        offset += _count_struct.size
+
+    end = offset + count * record.size
+    if end > len(buffer):
+        raise ValueError(f'Not enough data for {count} records: '
+                         f'{len(buffer) - offset} bytes')
+    if not count:
+        return tuple(_column(type_, array.array(_array_typecode(fmt)))
+                     for type_, fmt in zip(fields, fmts))
+
+    rows = record.iter_unpack(memoryview(buffer)[offset:end])
+    return tuple(_column(type_, array.array(_array_typecode(fmt), values))
+                 for type_, fmt, values in zip(fields, fmts, zip(*rows)))
@@ -1,4 +1,9 @@
-"""This module provides script command values."""
+"""This module provides script command values and the Stealth methods table."""
+
+from typing import NamedTuple
+
+from stealthapi.core.datatypes import *
+from stealthapi.core.scheduler import Priority
 
 # languages indexes for language version packet
 PYTHON_LANG = 1
@@ -22,3 +27,27 @@ ADD_TO_SYSTEM_JOURNAL = 10
 SET_EVENT = 11
 
 CLEAR_SYSTEM_JOURNAL = 346
+
+
+class MethodSpec(NamedTuple):
+    """A declaration of a Stealth method."""
+    index: int
+    argtypes: tuple[type[AnyArgType], ...] = ()
+    restype: type[AnyArgType] | None = None
+    idempotent: bool = False  # True if the method may be called again safely
+    priority: Priority = Priority.NORMAL  # the default priority of calls
+
+
+# the Stealth methods, bindings are created by the methods module on demand.
+# Only the methods used by the package are declared so far: the rest of the
+# Stealth method set is not described in this package yet. A method is made
+# available by adding its row with the index and the types from the Stealth
+# protocol.
+METHODS: dict[str, MethodSpec] = {
+    'unset_event': MethodSpec(UNSET_EVENT, (UByte,)),
+    'get_profile_name': MethodSpec(GET_PROFILE_NAME, (), Str, True),
+    'get_connected_status': MethodSpec(GET_CONNECTED_STATUS, (), Bool, True),
+    'add_to_system_journal': MethodSpec(ADD_TO_SYSTEM_JOURNAL, (Str,)),
+    'set_event': MethodSpec(SET_EVENT, (UByte,)),
+    'clear_system_journal': MethodSpec(CLEAR_SYSTEM_JOURNAL),
+}
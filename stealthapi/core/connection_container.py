@@ -1,22 +1,43 @@
-"""This module provides stuff to store StealthConnection instances."""
+"""
+This module provides stuff to store StealthConnection instances.
 
-__all__ = ['get_connection']
+A StealthConnection belongs to the event loop it was made in, so there is one
+per thread and event loop: a script calling `asyncio.run` gets a new one
+instead of the connection of the loop of its thread.
+"""
 
+__all__ = ['get_connection', 'find_connection', 'get_blocking_connection',
+           'drop_blocking_connection']
+
+import asyncio
 import threading
 import types
 
-from stealthapi.config import HOST
+from stealthapi.core.blocking import BlockingConnection
+from stealthapi.core.eventdecoder import EventSink
 from stealthapi.core.protocol import StealthConnection
-from stealthapi.core.utils import get_connection_port, get_event_loop
+from stealthapi.core.utils import get_event_loop
+
+_Key = tuple[int, asyncio.AbstractEventLoop]  # thread id and event loop
 
 _lock = threading.Lock()
-_connections: dict[int, StealthConnection] = {}
+_connections: dict[_Key, StealthConnection] = {}
+_blocking_connections: dict[int, BlockingConnection] = {}
+# thread id -> event sinks of its dropped blocking connection
+_dropped_sinks: dict[int, dict[int, tuple[EventSink, ...]]] = {}
 
 
 def _disconnect(thread_id: int) -> None:
-    """Close connection with Stealth for the thread with the specified id."""
+    """Close the connections with Stealth of the thread with the given id."""
     with _lock:
-        del _connections[thread_id]
+        connections = [_connections.pop(key) for key in list(_connections)
+                       if key[0] == thread_id]
+        blocking_connection = _blocking_connections.pop(thread_id, None)
+        _dropped_sinks.pop(thread_id, None)
+    for connection in connections:
+        connection.close()
+    if blocking_connection is not None:
+        blocking_connection.close()
 
 
 def _join(self: threading.Thread, timeout: float | None = None) -> None:
@@ -27,25 +48,86 @@ def _join(self: threading.Thread, timeout: float | None = None) -> None:
 
 async def _create_connection() -> StealthConnection:
     """Create a new connection with Stealth and return it."""
-    port = await get_connection_port()
-    loop = get_event_loop()
-    _, protocol = await loop.create_connection(StealthConnection, HOST, port)
-    # noinspection PyTypeChecker
+    protocol = StealthConnection()
+    await protocol.connect()
     return protocol
 
 
 async def get_connection() -> StealthConnection:
     """
-    Get a connections with Stealth for the current thread. Create a new one,
-    if there is no StealthConnection instance for the current thread.
+    Get a connections with Stealth for the current thread and the running
+    event loop. Create a new one, if there is no StealthConnection instance
+    for them or it is closed for good, e.g. all the reconnection attempts have
+    failed.
     """
     thread = threading.current_thread()
+    key = thread.ident, asyncio.get_running_loop()
     with _lock:
-        if thread.ident not in _connections:
+        connection = _connections.get(key)
+        if connection is None or connection.closed:
+            _forget_closed_loops(thread.ident)
             protocol = await _create_connection()
-            _connections[thread.ident] = protocol
+            _connections[key] = protocol
+
+            # replace the join method for the current thread
+            thread.join = types.MethodType(_join, thread)
+
+        return _connections[key]
+
+
+def _forget_closed_loops(thread_id: int) -> None:
+    """Close the connections of the thread left by closed event loops, e.g.
+    by finished `asyncio.run` calls. The lock must be held."""
+    for key in list(_connections):
+        if key[0] == thread_id and key[1].is_closed():
+            _connections.pop(key).close()
+
+
+def find_connection() -> StealthConnection | None:
+    """
+    Return the connection with Stealth of the current thread and event loop
+    or None if there is none or it is closed for good. A new one is not
+    created, so it may be called from coroutines of a running event loop.
+    """
+    key = threading.get_ident(), get_event_loop()
+    with _lock:
+        connection = _connections.get(key)
+    if connection is None or connection.closed:
+        return None
+    return connection
+
+
+def get_blocking_connection() -> BlockingConnection:
+    """
+    Get a blocking connection with Stealth for the current thread. Create a new
+    one, if there is no BlockingConnection instance for the current thread.
+    A new connection takes over the event sinks of the dropped one.
+    """
+    thread = threading.current_thread()
+    with _lock:
+        if thread.ident not in _blocking_connections:
+            connection = BlockingConnection()
+            _blocking_connections[thread.ident] = connection
+            sinks = _dropped_sinks.pop(thread.ident, None)
+            if sinks:
+                connection.restore_event_sinks(sinks)
 
             # replace the join method for the current thread
             thread.join = types.MethodType(_join, thread)
 
-        return _connections[thread.ident]
+        return _blocking_connections[thread.ident]
+
+
+def drop_blocking_connection() -> None:
+    """Close the blocking connection of the current thread after an error.
+
+    A new one will be created by the next `get_blocking_connection` call, the
+    event sinks of the dropped connection are set on it again.
+    """
+    thread_id = threading.get_ident()
+    with _lock:
+        connection = _blocking_connections.pop(thread_id, None)
+        if connection is not None and connection.event_sinks:
+            _dropped_sinks[thread_id] = connection.event_sinks
+    if connection is not None:
+        connection.close()
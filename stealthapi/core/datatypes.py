@@ -10,8 +10,6 @@ import struct
 
 from stealthapi.config import ENDIAN, STEALTH_CODEC
 
-_unicode_length = len('c'.encode(STEALTH_CODEC))
-
 NumberType = int | float
 
 
@@ -154,8 +152,10 @@ class Str(DataTypeBase):
 
     @property
     def _fmt(self) -> str:
-        chars_len = len(self._value) * _unicode_length
-        return self._size_struct.format + f'{chars_len}s'
+        # size of the encoded string, not count of chars: chars out of the BMP
+        # take two UTF-16 code units
+        data_len = len(self._value.encode(STEALTH_CODEC))
+        return self._size_struct.format + f'{data_len}s'
 
     @property
     def size(self) -> int:
@@ -169,11 +169,11 @@ class Str(DataTypeBase):
     def unpack_from(cls, buffer: bytes, offset: int = 0) -> 'Str':
         size, = cls._size_struct.unpack_from(buffer, offset)
         offset += cls._size_struct.size
-        return cls(buffer[offset: offset + size].decode(STEALTH_CODEC))
+        return cls(str(buffer[offset: offset + size], STEALTH_CODEC))
 
     def pack(self) -> bytes:
         data = self._value.encode(STEALTH_CODEC)
-        return struct.pack(self._fmt, len(self._value) * _unicode_length, data)
+        return self._size_struct.pack(len(data)) + data
 
 
 class Buffer(DataTypeBase):
@@ -219,9 +219,7 @@ class DateTime(DataTypeBase, metaclass=DataTypeMeta):
 
     def pack(self) -> bytes:
         delta = self._value - self._delphi_epoch
-        seconds = delta.seconds + delta.microseconds / 1_000_000
-        days = delta.days + seconds / 3600 / 24
-        return self._struct.pack(days)
+        return self._struct.pack(delta.total_seconds() / 86400)
 
 
 AnyArgType = Bool | Char | Byte | UByte | Short | UShort | Int | UInt | Float \
@@ -0,0 +1,184 @@
+"""
+This module provides the event packets decoder and event sinks.
+
+An event packet data is the event index, the count of arguments and the
+arguments, each of them is prefixed with its type code. Arguments are decoded
+only if there is a sink for the event index whose filter accepts the event.
+Filters given as expected argument values are checked against the raw
+argument bytes, so rejected events cost neither decoding nor objects.
+"""
+
+__all__ = ['EVENT_ARG_TYPES', 'EventSink', 'event_index', 'scan_event_args',
+           'decode_event_args', 'dispatch_event']
+
+import logging
+import struct
+from typing import Callable
+
+from stealthapi.config import ENDIAN, STEALTH_CODEC
+from stealthapi.core.datatypes import *
+from stealthapi.core.datatypes import _NumberBase
+from stealthapi.core.utils import format_packet
+
+# event argument type code -> data type
+EVENT_ARG_TYPES: dict[int, type[DataTypeBase]] = {
+    1: Str,
+    2: Int,
+    3: UInt,
+    4: UShort,
+    5: UByte,
+    6: Bool,
+}
+
+_event_header_struct = struct.Struct(ENDIAN + '2B')  # event index, args count
+_str_size_struct = struct.Struct(ENDIAN + 'I')  # size of a string argument
+
+_EventFilter = Callable[..., bool]
+# type code, offsets of the first byte and after the last byte of the value
+_ArgSpan = tuple[int, int, int]
+
+_DECODE_ERRORS = (KeyError, IndexError, struct.error, UnicodeDecodeError)
+
+
+class EventSink:
+    """A consumer of events with one index.
+
+    :param factory: creates an event object from the arguments
+    :param callback: receives accepted event objects
+    :param filter: called with the event arguments, the event is dropped if
+        it returns False
+    :param match: pairs of an argument position and its expected value, the
+        event is dropped if an argument differs, checked before decoding
+    """
+
+    __slots__ = ('factory', 'callback', 'filter', 'match', '_raw')
+
+    factory: Callable[[tuple], object]
+    callback: Callable[[object], None]
+    filter: _EventFilter | None
+    match: tuple[tuple[int, object], ...]
+    # (position, type code) -> the packed expected value, None if the value
+    # can not be packed with the type
+    _raw: dict[tuple[int, int], bytes | None]
+
+    def __init__(self, factory: Callable[[tuple], object],
+                 callback: Callable[[object], None],
+                 filter: _EventFilter | None = None,
+                 match: tuple[tuple[int, object], ...] = ()) -> None:
+        self.factory = factory
+        self.callback = callback
+        self.filter = filter
+        self.match = match
+        self._raw = {}
+
+    def accepts(self, data: bytes | bytearray,
+                spans: list[_ArgSpan]) -> bool:
+        """Check the raw arguments against the expected values."""
+        for position, value in self.match:
+            if position >= len(spans):
+                return False
+            code, start, end = spans[position]
+            key = position, code
+            if key not in self._raw:
+                self._raw[key] = _pack_arg(code, value)
+            raw = self._raw[key]
+            if raw is None or end - start != len(raw) or \
+                    not data.startswith(raw, start):
+                return False
+        return True
+
+    def feed(self, args: tuple) -> None:
+        """Pass the event to the callback if the filter accepts it."""
+        if self.filter is None or self.filter(*args):
+            self.callback(self.factory(args))
+
+
+def _pack_arg(code: int, value: object) -> bytes | None:
+    """Pack the value as it is sent in event packets, without the size of
+    strings."""
+    type_ = EVENT_ARG_TYPES.get(code)
+    if type_ is None or type_ is not Str and \
+            not isinstance(value, (int, float)):
+        return None
+    try:
+        data = type_(value).pack()
+    except (TypeError, AttributeError, struct.error):
+        return None
+    return data[_str_size_struct.size:] if type_ is Str else data
+
+
+def event_index(data: bytes | bytearray | memoryview) -> int:
+    """Return the event index of the event packet data."""
+    return data[0]
+
+
+def scan_event_args(data: bytes | bytearray) -> list[_ArgSpan]:
+    """Find the arguments of the event packet data without decoding them.
+
+    :return: the type code and the offsets of the value of every argument,
+        string values start after their size
+    :raises KeyError: if there is an argument of unknown type
+    """
+    _, count = _event_header_struct.unpack_from(data)
+    offset = _event_header_struct.size
+    spans = []
+    for _ in range(count):
+        code = data[offset]
+        type_ = EVENT_ARG_TYPES[code]
+        offset += 1
+        if type_ is Str:
+            size, = _str_size_struct.unpack_from(data, offset)
+            offset += _str_size_struct.size
+        else:
+            size = type_._struct.size
+        if offset + size > len(data):
+            raise IndexError('The event packet data is too short.')
+        spans.append((code, offset, offset + size))
+        offset += size
+    return spans
+
+
+def decode_event_args(data: bytes | bytearray,
+                      spans: list[_ArgSpan] | None = None) -> tuple:
+    """Decode the arguments of the event packet data.
+
+    :param data: the event packet data
+    :param spans: the result of `scan_event_args` if it is known already
+    :raises KeyError: if there is an argument of unknown type
+    """
+    if spans is None:
+        spans = scan_event_args(data)
+    args = []
+    for code, start, end in spans:
+        type_ = EVENT_ARG_TYPES[code]
+        if type_ is Str:
+            args.append(str(data[start:end], STEALTH_CODEC))
+        elif issubclass(type_, _NumberBase):
+            args.append(type_._struct.unpack_from(data, start)[0])
+        else:
+            args.append(type_.unpack_from(data, start).value)
+    return tuple(args)
+
+
+def dispatch_event(data: bytes | bytearray, sinks: tuple[EventSink, ...],
+                   logger: logging.Logger) -> None:
+    """Decode the event for the sinks accepting its arguments and feed them.
+
+    Errors of decoding and of the sinks are logged.
+    """
+    try:
+        spans = scan_event_args(data)
+        accepted = [sink for sink in sinks if sink.accepts(data, spans)]
+        if not accepted:
+            return  # nobody needs it - do not decode
+        args = decode_event_args(data, spans)
+    except _DECODE_ERRORS as e:
+        logger.warning(f'Can not decode event: {e!r}, '
+                       f'data: {format_packet(data)}')
+        return
+
+    for sink in accepted:
+        try:
+            sink.feed(args)
+        except Exception:
+            logger.exception('Event handling failed')
@@ -0,0 +1,140 @@
+"""
+This module provides a chain of interceptors called around every script method
+call. An interceptor is notified before the arguments are packed, after the
+packet is sent, when the response is received and when the call fails.
+
+:Example:
+>>> from stealthapi.core.interceptors import Interceptor, add_interceptor
+>>> class Printer(Interceptor):
+...     def on_response(self, call):
+...         print(call.index, call.round_trip)
+>>> add_interceptor(Printer())
+"""
+
+__all__ = ['CallInfo', 'Interceptor', 'add_interceptor', 'remove_interceptor',
+           'get_interceptors', 'before_pack', 'after_send', 'on_response',
+           'on_error']
+
+import threading
+import time
+
+
+class CallInfo:
+    """Information about a script method call passed to interceptors."""
+
+    __slots__ = ('index', 'args', 'request_id', 'started', 'sent', 'finished',
+                 'request_size', 'response_size', 'result', 'data')
+
+    index: int  # the method index
+    args: tuple  # the method arguments, may be replaced by before_pack
+    request_id: int  # 0 if the method returns nothing
+    started: float  # time.perf_counter() values of the call stages
+    sent: float | None
+    finished: float | None
+    request_size: int  # sent packet size in bytes
+    response_size: int  # received response data size in bytes
+    result: object  # the method result
+    data: dict  # a storage for interceptors' own data
+
+    def __init__(self, index: int, args: tuple) -> None:
+        self.index = index
+        self.args = args
+        self.request_id = 0
+        self.started = time.perf_counter()
+        self.sent = self.finished = None
+        self.request_size = self.response_size = 0
+        self.result = None
+        self.data = {}
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds from the call start to its finish or to now."""
+        end = self.finished if self.finished is not None \
+            else time.perf_counter()
+        return end - self.started
+
+    @property
+    def round_trip(self) -> float | None:
+        """Seconds from sending the request to receiving the response."""
+        if self.sent is None or self.finished is None:
+            return None
+        return self.finished - self.sent
+
+
+class Interceptor:
+    """A base class for interceptors. Override the hooks you need."""
+
+    def before_pack(self, call: CallInfo) -> None:
+        """Called before the arguments are packed, may replace call.args."""
+        pass
+
+    def after_send(self, call: CallInfo) -> None:
+        """Called after the request packet is sent."""
+        pass
+
+    def on_response(self, call: CallInfo) -> None:
+        """Called when the call completed successfully."""
+        pass
+
+    def on_error(self, call: CallInfo, error: BaseException) -> None:
+        """Called when the call failed or timed out."""
+        pass
+
+
+_lock = threading.Lock()
+# the chain is replaced, never changed, so it may be iterated without a lock
+_interceptors: tuple[Interceptor, ...] = ()
+
+
+def add_interceptor(interceptor: Interceptor) -> None:
+    """Add the given interceptor to the end of the chain."""
+    global _interceptors
+    with _lock:
+        _interceptors = _interceptors + (interceptor,)
+
+
+def remove_interceptor(interceptor: Interceptor) -> None:
+    """Remove the given interceptor from the chain.
+
+    :raises ValueError: if the interceptor is not in the chain
+    """
+    global _interceptors
+    with _lock:
+        chain = list(_interceptors)
+        chain.remove(interceptor)
+        _interceptors = tuple(chain)
+
+
+def get_interceptors() -> tuple[Interceptor, ...]:
+    """Return the current chain of interceptors."""
+    return _interceptors
+
+
+def before_pack(call: CallInfo) -> None:
+    """Notify the chain that the call is about to pack its arguments."""
+    for interceptor in _interceptors:
+        interceptor.before_pack(call)
+
+
+def after_send(call: CallInfo, packet_size: int) -> None:
+    """Notify the chain that the request packet is sent."""
+    call.sent = time.perf_counter()
+    call.request_size = packet_size
+    for interceptor in _interceptors:
+        interceptor.after_send(call)
+
+
+def on_response(call: CallInfo, response_size: int, result: object) -> None:
+    """Notify the chain that the call completed successfully."""
+    call.finished = time.perf_counter()
+    call.response_size = response_size
+    call.result = result
+    for interceptor in _interceptors:
+        interceptor.on_response(call)
+
+
+def on_error(call: CallInfo, error: BaseException) -> None:
+    """Notify the chain that the call failed."""
+    call.finished = time.perf_counter()
+    for interceptor in _interceptors:
+        interceptor.on_error(call, error)
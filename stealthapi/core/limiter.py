@@ -0,0 +1,221 @@
+"""
+This module provides a client-side limiter of requests sent to Stealth.
+
+The count of requests in flight is limited per connection. The limit is
+adjusted with the AIMD rule from the measured round-trip latency: it grows
+slowly while the latency stays close to the lowest one observed and is cut
+when the latency rises or a request times out. Optionally a static token
+bucket limits the rate of calls of a method.
+"""
+
+__all__ = ['LimitExceededError', 'TokenBucket', 'ConcurrencyLimiter']
+
+import asyncio
+import collections
+import time
+
+from stealthapi.core.scheduler import Priority
+
+_TOLERANCE = 2.  # latency more than baseline * tolerance means overload
+_BACKOFF = .9  # the limit multiplier on overload
+_BASELINE_DRIFT = 1.001  # lets the baseline latency grow slowly
+_SMOOTHING = .1  # weight of a new sample in the smoothed latency
+
+
+class LimitExceededError(Exception):
+    """Raised when there are too many requests waiting to be sent."""
+    pass
+
+
+class TokenBucket:
+    """A token bucket rate limit.
+
+    :param rate: tokens added per second
+    :param burst: the max count of tokens
+    """
+
+    rate: float
+    burst: float
+    _tokens: float
+    _updated: float  # time.monotonic() value of the last tokens update
+
+    def __init__(self, rate: float, burst: float = 1.) -> None:
+        if rate <= 0 or burst < 1:
+            raise ValueError('The rate must be greater than 0 and the burst '
+                             'must be at least 1.')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token and return seconds to wait until it is available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return -self._tokens / self.rate if self._tokens < 0 else 0.
+
+
+class ConcurrencyLimiter:
+    """Limits requests in flight of a connection adapting to the latency.
+
+    :param limit: the initial limit, 0 - do not limit
+    :param max_limit: the limit never grows above it
+    :param min_limit: the limit never falls below it
+    :param max_waiting: requests waiting for a place above this count are
+        rejected with LimitExceededError
+    """
+
+    limit: float
+    min_limit: int
+    max_limit: int
+    max_waiting: int
+
+    rate_limits: dict[int, TokenBucket]  # method index -> rate limit
+
+    baseline_rtt: float | None  # the lowest latency observed, seconds
+    smoothed_rtt: float | None  # exponentially smoothed latency, seconds
+    rejected: int  # count of rejected requests
+    throttled: int  # count of requests delayed by rate limits
+
+    _in_flight: int
+    _last_decrease: float  # time.monotonic() value of the last limit cut
+    _waiters: list[collections.deque[asyncio.Future]]  # priority -> waiters
+
+    def __init__(self, limit: int, max_limit: int, min_limit: int = 1,
+                 max_waiting: int = 65535) -> None:
+        self.limit = limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_waiting = max_waiting
+        self.rate_limits = {}
+        self.baseline_rtt = None
+        self.smoothed_rtt = None
+        self.rejected = 0
+        self.throttled = 0
+        self._in_flight = 0
+        self._last_decrease = 0.
+        self._waiters = [collections.deque() for _ in Priority]
+
+    @property
+    def enabled(self) -> bool:
+        return self.limit > 0
+
+    @property
+    def waiting(self) -> int:
+        """Count of requests waiting for a place."""
+        return sum(len(waiters) for waiters in self._waiters)
+
+    def set_rate_limit(self, index: int, rate: float | None,
+                       burst: float = 1.) -> None:
+        """Limit calls of the method with the given index per second.
+
+        :param index: the method index
+        :param rate: calls per second, None - remove the limit
+        :param burst: count of calls allowed at once
+        """
+        if rate is None:
+            self.rate_limits.pop(index, None)
+        else:
+            self.rate_limits[index] = TokenBucket(rate, burst)
+
+    async def acquire(self, index: int,
+                      priority: Priority = Priority.NORMAL) -> None:
+        """Wait until a request of the method with the given index may be sent.
+
+        Every acquired request must be released with `release`.
+
+        :raises LimitExceededError: if too many requests are waiting
+        """
+        bucket = self.rate_limits.get(index)
+        if bucket is not None:
+            delay = bucket.reserve()
+            if delay:
+                self.throttled += 1
+                await asyncio.sleep(delay)
+
+        if not self.enabled:
+            return
+        if self._in_flight < self.limit and not self.waiting:
+            self._in_flight += 1
+            return
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise LimitExceededError(f'There are {self.waiting} requests '
+                                     f'waiting to be sent already.')
+
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[priority]
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # the place was given, but nobody will use it
+                self.release()
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+
+    def release(self, rtt: float | None = None, dropped: bool = False) -> None:
+        """Release a request acquired with `acquire` and adjust the limit.
+
+        :param rtt: the round-trip latency of the request if it was answered
+        :param dropped: True if the request timed out or was cancelled
+        """
+        if not self.enabled:
+            return
+        self._in_flight -= 1
+
+        if dropped:
+            self._decrease()
+        elif rtt is not None:
+            self._add_sample(rtt)
+
+        # give places to the waiting requests, higher priority first
+        for waiters in self._waiters:
+            while waiters and self._in_flight < self.limit:
+                future = waiters.popleft()
+                if not future.done():
+                    self._in_flight += 1
+                    future.set_result(None)
+
+    def _add_sample(self, rtt: float) -> None:
+        if self.baseline_rtt is None:
+            self.baseline_rtt = self.smoothed_rtt = rtt
+        else:
+            self.baseline_rtt = min(rtt, self.baseline_rtt * _BASELINE_DRIFT)
+            self.smoothed_rtt += (rtt - self.smoothed_rtt) * _SMOOTHING
+
+        # the smoothed latency ignores single slow samples, the sample itself
+        # ignores a smoothed latency still going down from slower samples,
+        # e.g. from the first ones of a cold connection
+        threshold = self.baseline_rtt * _TOLERANCE
+        if self.smoothed_rtt > threshold and rtt > threshold:
+            self._decrease()
+        elif self._in_flight + 1 >= self.limit:
+            # the limit is really used - additive increase
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self) -> None:
+        # cut the limit once per round trip, the requests sent before the cut
+        # are still answered slowly
+        now = time.monotonic()
+        if now - self._last_decrease < (self.smoothed_rtt or 0.):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * _BACKOFF)
+
+    def stats(self) -> dict[str, float | int | None]:
+        """Return the current limit and counters."""
+        return {
+            'limit': self.limit,
+            'in_flight': self._in_flight,
+            'waiting': self.waiting,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'baseline_rtt': self.baseline_rtt,
+            'smoothed_rtt': self.smoothed_rtt,
+        }
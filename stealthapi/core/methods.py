@@ -0,0 +1,34 @@
+"""
+This module provides typed bindings for all the methods declared in the
+METHODS table of the commands module. A binding is a ScriptMethod instance
+created on the first access to the module attribute with the method name, so
+only the methods used by a script cost anything.
+
+:Example:
+>>> from stealthapi.core import methods
+>>> methods.add_to_system_journal('hello')
+>>> print(methods.get_profile_name())
+"""
+
+from stealthapi.core.commands import METHODS
+from stealthapi.core.scriptmethod import ScriptMethod
+
+__all__ = sorted(METHODS)
+
+
+def __getattr__(name: str) -> ScriptMethod:
+    """Create a binding for the method with the given name and cache it."""
+    try:
+        spec = METHODS[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute '
+                             f'{name!r}') from None
+
+    method = ScriptMethod(spec.index, list(spec.argtypes), spec.restype,
+                          spec.idempotent, spec.priority)
+    globals()[name] = method
+    return method
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(METHODS))
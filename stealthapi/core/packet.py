@@ -1,105 +1,45 @@
-"""This module provides the Packet class."""
+"""
+This module provides the packet layout of the Stealth protocol.
 
-__all__ = ['IncomingPacketCmdEnum', 'Packet', 'PacketParseError',
-           'packet_size_struct', 'packet_cmd_struct', 'packet_id_struct']
+Incoming packets are parsed in place by the connections, see
+StealthConnection.data_received.
+"""
+
+__all__ = ['packet_size_struct', 'packet_cmd_struct', 'packet_id_struct',
+           'packet_header_struct', 'pack_packet', 'PROTOCOL_VERSION',
+           'lang_version_packet']
 
-import enum
-import logging
 import struct
 
 from stealthapi.core.commands import \
-    METHOD_RESPONSE, \
-    PAUSE_SCRIPT, \
-    EVENT_PROC, \
-    TERMINATE_SCRIPT
+    LANG_VERSION, \
+    PYTHON_LANG
 from stealthapi.config import ENDIAN
 
 
-@enum.unique
-class IncomingPacketCmdEnum(enum.Enum):
-    RESPONSE = METHOD_RESPONSE
-    PAUSE = PAUSE_SCRIPT
-    EVENT = EVENT_PROC
-    TERMINATE = TERMINATE_SCRIPT
-
-
 packet_size_struct = struct.Struct(ENDIAN + 'I')
 packet_cmd_struct = struct.Struct(ENDIAN + 'H')
 packet_id_struct = struct.Struct(ENDIAN + 'H')
+# the size and the command of a packet unpacked at once
+packet_header_struct = struct.Struct(ENDIAN + 'IH')
 
+PROTOCOL_VERSION = 2, 4, 0, 0
 
-class PacketParseError(Exception):
-    """Raised when the data sequence length is not enough to unpack packet."""
-    pass
-
-
-class Packet:
-    """This class represents a data packet incoming from Stealth."""
-
-    _cmd: IncomingPacketCmdEnum
-    _size: int
-    _data: bytes | bytearray
-    _request_id: int | None
-
-    def __init__(self, cmd: IncomingPacketCmdEnum, size: int,
-                 data: bytes | bytearray, request_id: int = None) -> None:
-        self._cmd = cmd
-        self._size = size
-        self._data = data
-        self._request_id = request_id
-
-    @property
-    def cmd(self) -> IncomingPacketCmdEnum:
-        return self._cmd
-
-    @property
-    def size(self) -> int:
-        return self._size
-
-    @property
-    def data(self) -> bytes | bytearray:
-        return self._data
-
-    @property
-    def request_id(self) -> int | None:
-        return self._request_id
-
-    @classmethod
-    def unpack_from(cls, buffer: bytes | bytearray) -> 'Packet':
-        """Try to parse packet from the given bytes sequence.
-
-        :Example:
-        >>> import struct
-        >>> from stealthapi.core.packet import Packet, PacketParseError
-        >>> buf = struct.pack('<IHHI', 8, 14, 0x12345678)  # GetSelfId response
-        >>> try: packet = Packet.unpack_from()
-        >>> except PacketParseError: pass
-
-        :param buffer: bytes sequence
-        :return: a Packet-class instance
-        :raises PacketParseError: if there is not enough bytes in the given data
-        """
-        # try to parse packet size first
-        try:
-            size, = packet_size_struct.unpack_from(buffer)
-            offset = packet_size_struct.size
-            data = buffer[offset:offset + size]
-        except struct.error:
-            msg = f'Not enough data to unpack size: {len(buffer)}'
-            _logger.debug(msg)
-            raise PacketParseError(msg)
+# SC_LANG_VERSION packet, the first packet sent to a new connection
+_lang_ver_packet_data = struct.pack(ENDIAN + '2H5B', LANG_VERSION, 0,
+                                    PYTHON_LANG, *PROTOCOL_VERSION)
+lang_version_packet = packet_size_struct.pack(len(_lang_ver_packet_data)) \
+    + _lang_ver_packet_data
 
-        # parse header of the packet
-        offset = 0
-        request_id = None
-        cmd, = packet_cmd_struct.unpack_from(data)
-        offset += packet_cmd_struct.size
 
-        # if method response - also parse request id
-        if cmd == IncomingPacketCmdEnum.RESPONSE:
-            request_id = packet_id_struct.unpack_from(data, offset)
-            offset += packet_id_struct.size
-        return cls(cmd, size + 4, data[offset:], request_id)
+def pack_packet(cmd: int, request_id: int, data: bytes = b'') -> bytes:
+    """Form a packet to be sent to Stealth.
 
+    :param cmd: a method index
+    :param request_id: a request id or 0 if the method returns nothing
+    :param data: packed method arguments
+    :return: the packet bytes, size prefix included
+    """
+    header = packet_cmd_struct.pack(cmd) + packet_id_struct.pack(request_id)
+    return packet_size_struct.pack(len(header) + len(data)) + header + data
 
-_logger = logging.getLogger(Packet.__class__.__name__)
@@ -1,118 +1,577 @@
 """This module provides class needed to exchange data with Stealth."""
 
-__all__ = ['PROTOCOL_VERSION', 'StealthConnection']
+__all__ = ['PROTOCOL_VERSION', 'MAX_REQUEST_ID', 'StealthConnection']
 
 import asyncio
-import ctypes
 import logging
+import socket
 import struct
 import threading
-import time
+from typing import Callable
 
-from stealthapi.config import ENDIAN, TIMER_RES
-from stealthapi.core.commands import PYTHON_LANG, LANG_VERSION
-from stealthapi.core.packet import IncomingPacketCmdEnum, Packet, \
-    PacketParseError, packet_size_struct
-from stealthapi.core.utils import format_packet
+from stealthapi.config import CONCURRENCY_LIMIT, DEBUG, ENDIAN, \
+    FLUSH_MAX_BYTES, FLUSH_MAX_PACKETS, HOST, LOW_PRIORITY_LIMIT, \
+    MAX_CONCURRENCY, PROXY_PATH, PROXY_PORT, RECONNECT_ATTEMPTS, \
+    RECONNECT_DELAY, RECONNECT_MAX_DELAY, TCP_NODELAY
+from stealthapi.core.commands import EVENT_PROC, METHOD_RESPONSE, \
+    PAUSE_SCRIPT, SET_EVENT, TERMINATE_SCRIPT, UNSET_EVENT
+from stealthapi.core.eventdecoder import EventSink, dispatch_event, \
+    event_index
+from stealthapi.core.limiter import ConcurrencyLimiter
+from stealthapi.core.packet import PROTOCOL_VERSION, lang_version_packet, \
+    pack_packet, packet_header_struct, packet_id_struct, packet_size_struct
+from stealthapi.core.scheduler import Priority, SendScheduler
+from stealthapi.core.utils import format_packet, get_connection_port, \
+    get_event_loop, get_proxy_token
 
-PROTOCOL_VERSION = 2, 4, 0, 0
+MAX_REQUEST_ID = 0xFFFF  # request id is an unsigned short, 0 - no response
+# released request ids kept for late responses, the oldest ones are reused
+_MAX_CANCELLED = MAX_REQUEST_ID // 2
 
-# SC_LANG_VERSION packet
-_lang_ver_packet_data = struct.pack(ENDIAN + '2H5B', LANG_VERSION, 0,
-                                    PYTHON_LANG, *PROTOCOL_VERSION)
-_lang_ver_packet_size = packet_size_struct.pack(len(_lang_ver_packet_data))
-_lang_ver_packet = _lang_ver_packet_size + _lang_ver_packet_data
+_event_index_struct = struct.Struct(ENDIAN + 'B')
+
+# incoming packet command -> name of the StealthConnection handler method
+_PACKET_HANDLERS = {
+    METHOD_RESPONSE: '_handle_response',
+    EVENT_PROC: '_handle_event',
+    PAUSE_SCRIPT: '_handle_pause',
+    TERMINATE_SCRIPT: '_handle_terminate',
+}
+
+_PacketHandler = Callable[[bytes | bytearray, int, int], None]
+
+
+class _Request:
+    """A method request waiting for a response."""
+
+    __slots__ = ('future', 'idempotent', 'packet', 'sent')
+
+    future: asyncio.Future  # resolved with the response data
+    idempotent: bool  # True if it is safe to send the request again
+    packet: bytes | None  # the request packet, needed to replay it
+    sent: bool  # True if the packet was written to the current transport
+
+    def __init__(self, future: asyncio.Future, idempotent: bool) -> None:
+        self.future = future
+        self.idempotent = idempotent
+        self.packet = None
+        self.sent = False
 
 
 class StealthConnection(asyncio.Protocol):
-    """TODO"""
+    """A connection with Stealth.
+
+    If the connection is lost, it is restored with an exponential backoff.
+    Requests already sent to Stealth are replayed if they are idempotent and
+    failed with ConnectionResetError otherwise. Data sent while the connection
+    is down is kept and sent after reconnection, event subscriptions are
+    restored too.
+
+    Outgoing packets are queued and all the packets queued within one loop
+    iteration are written with a single `writelines` call, higher priority
+    packets first. The queue is flushed earlier if it exceeds
+    FLUSH_MAX_PACKETS packets or FLUSH_MAX_BYTES bytes.
+    """
+
+    _transport: asyncio.Transport | None  # socket transport
+    _proxy_token: bytes  # sent first to the proxy on a TCP port, see connect
+    _buffer: bytearray  # the received data of incomplete packets
+    # packet command -> handler of the packet data between the given offsets
+    _handlers: list['_PacketHandler | None']
+    _backlog: list[tuple[bytes, '_Request | None']]  # sent while disconnected
+    # priority -> packets waiting for a flush
+    _outgoing: list[list[tuple[bytes, '_Request | None']]]
+    _outgoing_count: int  # count of the outgoing packets
+    _outgoing_size: int  # size of the outgoing data in bytes
+    _flush_handle: asyncio.Handle | None  # scheduled flush
 
-    _transport: asyncio.Transport  # socket transport
-    _buffer: bytes  # storage for data parts
+    _loop: asyncio.AbstractEventLoop
+    _ready: asyncio.Event  # set when connected or closed for good
+    _closed: bool  # True if closed by user or reconnection failed
+    _reconnect_task: asyncio.Task | None
 
-    _request_id: int  # a unique ident for every returning result method
+    _request_id: int  # the last request id given to a returning result method
     _pause: bool  # pause script
 
-    methods_responses: dict[int, bytes]
+    _requests: dict[int, _Request]  # request id -> request waiting a response
+    # ids of requests nobody waits a response for, the oldest first
+    _cancelled: dict[int, None]
+    _replay: list[int]  # ids of requests to send again after reconnection
+    dropped_responses: int  # count of responses nobody waited for
+
+    flush_count: int  # count of writes to the transport
+    flushed_packets: int  # count of packets written to the transport
+
+    scheduler: SendScheduler  # admits requests by priority
+    limiter: ConcurrencyLimiter  # limits requests in flight by latency
+
+    subscriptions: set[int]  # indexes of events set in Stealth
+    event_sinks: dict[int, tuple[EventSink, ...]]  # event index -> consumers
 
     _logger: logging.Logger
 
     def __init__(self) -> None:
         """Initiate class fields values."""
-        self._buffer = bytes()
+        self._transport = None
+        self._proxy_token = b''
+        self._buffer = bytearray()
+        self._handlers = [None] * (max(_PACKET_HANDLERS) + 1)
+        for cmd, name in _PACKET_HANDLERS.items():
+            self._handlers[cmd] = getattr(self, name)
+        self._backlog = []
+        self._outgoing = [[] for _ in Priority]
+        self._outgoing_count = 0
+        self._outgoing_size = 0
+        self._flush_handle = None
+        self._loop = get_event_loop()
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._reconnect_task = None
         self._pause = False
         self._request_id = 0
-        self.methods_responses = {}
+        self._requests = {}
+        self._cancelled = {}
+        self._replay = []
+        self.dropped_responses = 0
+        self.flush_count = 0
+        self.flushed_packets = 0
+        self.scheduler = SendScheduler(LOW_PRIORITY_LIMIT)
+        self.limiter = ConcurrencyLimiter(CONCURRENCY_LIMIT, MAX_CONCURRENCY)
+        self.subscriptions = set()
+        self.event_sinks = {}
         # init logger
         thread = threading.current_thread()
         logger_name = f'{self.__class__.__name__}-{thread.ident}'
         self._logger = logging.getLogger(logger_name)
         self._logger.debug('initialized')
 
-    def __del__(self) -> None:
-        """Close socket before destroy the current instance."""
-        self._transport.close()
-        while self._transport.is_closing():
-            time.sleep(TIMER_RES)
-        self._logger.debug('connection closed')
+    async def connect(self) -> None:
+        """Connect to the proxy if it is configured, otherwise request a port
+        from Stealth and connect to it."""
+        if PROXY_PATH and hasattr(socket, 'AF_UNIX'):
+            await self._loop.create_unix_connection(lambda: self, PROXY_PATH)
+        elif PROXY_PORT:
+            # the port is open to other users, the token proves who we are
+            self._proxy_token = get_proxy_token()
+            await self._loop.create_connection(lambda: self, 'localhost',
+                                               PROXY_PORT)
+        else:
+            await self._connect_stealth()
+
+    async def _connect_stealth(self) -> None:
+        """Request a port from Stealth and connect to it."""
+        port = await get_connection_port()
+        await self._loop.create_connection(lambda: self, HOST, port)
+
+    def close(self) -> None:
+        """Close the connection and do not restore it anymore."""
+        self._closed = True
+        if self._loop.is_closed():
+            # e.g. asyncio.run has returned, the loop can not close the
+            # transport, so at least end the connection
+            if self._transport is not None:
+                try:
+                    self._transport.get_extra_info('socket').shutdown(
+                        socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            return
+        self._ready.set()
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._transport is not None:
+            self._transport.close()
+
+    async def wait_connected(self) -> None:
+        """Wait until the connection is established.
+
+        :raises ConnectionError: if the connection is closed for good
+        """
+        await self._ready.wait()
+        if self._closed:
+            raise ConnectionError('The connection with Stealth is closed.')
+
+    def register_request(self, idempotent: bool = False
+                         ) -> tuple[int, asyncio.Future]:
+        """Reserve a unique request id for a method returning result.
+
+        Ids of requests which are still waiting for a response are skipped,
+        as well as ids of released requests whose late response may still
+        come. Only the latest released ids are kept for late responses, and
+        the oldest of them is reused if there are no other free ids. Every
+        registered request must be released with `release_request`.
+
+        :param idempotent: True if the request may be sent again after
+            reconnection, otherwise it fails if the connection is lost
+        :return: the request id and a future resolved with the response data
+        :raises RuntimeError: if all the request ids are in use
+        """
+        for _ in range(MAX_REQUEST_ID):
+            # start from 1 again if greater than unsigned short max value
+            self._request_id = self._request_id % MAX_REQUEST_ID + 1
+            if self._request_id not in self._requests \
+                    and self._request_id not in self._cancelled:
+                break
+        else:
+            if not self._cancelled:
+                raise RuntimeError('There are no free request ids.')
+            # a response that late is not expected anymore
+            self._request_id = next(iter(self._cancelled))
+            del self._cancelled[self._request_id]
+
+        request_id = self._request_id
+        future = self._loop.create_future()
+        self._requests[request_id] = _Request(future, idempotent)
+        return request_id, future
+
+    def release_request(self, request_id: int) -> None:
+        """Stop waiting for a response for the request with the given id.
+
+        If the response has not been received yet (timeout or cancellation),
+        it will be dropped when it comes.
+        """
+        request = self._requests.pop(request_id, None)
+        if request is None:
+            return
+        future = request.future
+        if future.cancelled() or not future.done():
+            future.cancel()
+            self._cancelled[request_id] = None
+            if len(self._cancelled) > _MAX_CANCELLED:
+                # forget the oldest one, its response is not expected anymore
+                del self._cancelled[next(iter(self._cancelled))]
+
+    @property
+    def pending_requests(self) -> int:
+        """Count of requests waiting for a response."""
+        return len(self._requests)
 
     @property
-    def request_id(self) -> int:
-        """A unique request id for methods returning result."""
-        self._request_id += 1
-        if self._request_id >= ctypes.sizeof(ctypes.c_ushort) - 1:
-            # reset value if greater than unsigned short max value
-            self._request_id = 1
-        return self._request_id
+    def packets_per_flush(self) -> float:
+        """Average count of packets written to the transport at once."""
+        if not self.flush_count:
+            return 0.
+        return self.flushed_packets / self.flush_count
 
     @property
     def pause(self) -> bool:
         """True if the current script is on pause."""
         return self._pause
 
+    @property
+    def closed(self) -> bool:
+        """True if the connection is closed by user or reconnection failed."""
+        return self._closed
+
+    @property
+    def tasks(self) -> set[asyncio.Task]:
+        """The running tasks of the connection itself."""
+        task = self._reconnect_task
+        return {task} if task is not None and not task.done() else set()
+
+    @property
+    def connected(self) -> bool:
+        """True if the connection is established."""
+        return self._transport is not None and not self._transport.is_closing()
+
+    def subscribe_event(self, index: int) -> None:
+        """Ask Stealth to send events with the given index.
+
+        If the connection is down, the subscription is sent on reconnection.
+        """
+        self.subscriptions.add(index)
+        if self.connected:
+            self.send(self._event_packet(SET_EVENT, index))
+
+    def unsubscribe_event(self, index: int) -> None:
+        """Ask Stealth to stop sending events with the given index."""
+        self.subscriptions.discard(index)
+        if self.connected:
+            self.send(self._event_packet(UNSET_EVENT, index))
+
+    def add_event_sink(self, index: int, sink: EventSink) -> None:
+        """Add a consumer of events with the given index.
+
+        Stealth is asked to send the events when the first consumer appears.
+        """
+        sinks = self.event_sinks.get(index, ())
+        # the tuple is replaced, not changed, so sinks may be added or removed
+        # while an event is dispatched
+        self.event_sinks[index] = sinks + (sink,)
+        if not sinks:
+            self.subscribe_event(index)
+
+    def remove_event_sink(self, index: int, sink: EventSink) -> None:
+        """Remove a consumer of events with the given index.
+
+        Stealth is asked to stop sending the events when the last consumer
+        leaves.
+        """
+        sinks = list(self.event_sinks.get(index, ()))
+        if sink not in sinks:
+            return
+        sinks.remove(sink)
+        if sinks:
+            self.event_sinks[index] = tuple(sinks)
+        else:
+            del self.event_sinks[index]
+            self.unsubscribe_event(index)
+
+    def _dispatch_event(self, data: bytes) -> None:
+        """Decode the event and pass it to the event consumers."""
+        sinks = self.event_sinks.get(event_index(data))
+        if sinks:
+            dispatch_event(data, sinks, self._logger)
+
+    @staticmethod
+    def _event_packet(cmd: int, index: int) -> bytes:
+        return pack_packet(cmd, 0, _event_index_struct.pack(index))
+
     def connection_made(self, transport: asyncio.Transport) -> None:
         """
         Save the given transport to the class instance and send the language
-        version package.
+        version package. If it is a reconnection - restore subscriptions,
+        replay requests and send data sent while disconnected.
         """
         self._transport = transport
-        self.send(_lang_ver_packet)
+        self._set_nodelay()
+        self._transport.write(self._proxy_token + lang_version_packet)
+
+        for index in self.subscriptions:
+            self._write(self._event_packet(SET_EVENT, index), None)
 
-    def send(self, data: bytes | bytearray) -> None:
-        """Send the given data to Stealth."""
-        self._transport.write(data)
-        self._logger.debug(f'data sent: {format_packet(data)}')
+        for request_id in self._replay:
+            request = self._requests.get(request_id)
+            if request is None:
+                # released while disconnected, no response will come
+                self._cancelled.pop(request_id, None)
+            elif request.packet is not None:
+                self._write(request.packet, request)
+        self._replay.clear()
+
+        for data, request in self._backlog:
+            if request is not None and request.future.done():
+                # nobody waits for it anymore, e.g. it has timed out: do not
+                # run the action the caller has given up on
+                request_id, = packet_id_struct.unpack_from(
+                    data, packet_header_struct.size)
+                self._cancelled.pop(request_id, None)
+                continue
+            self._write(data, request)
+        self._backlog.clear()
+        self.flush()
+
+        self._ready.set()
+        self._logger.debug('connected')
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        """Fail or keep for replaying sent requests and start reconnection."""
+        self._transport = None
+        self._buffer = bytearray()
+        self._pause = False
+        self._ready.clear()
+        # late responses never come through a new connection
+        self._cancelled.clear()
+
+        # not flushed data was not sent - keep it to send after reconnection
+        self._backlog[:0] = [item for queue in self._outgoing
+                             for item in queue]
+        for queue in self._outgoing:
+            queue.clear()
+        self._outgoing_count = self._outgoing_size = 0
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        for request_id, request in self._requests.items():
+            if not request.sent:
+                continue  # it is in the backlog
+            request.sent = False
+            if request.idempotent and not self._closed:
+                self._replay.append(request_id)
+            elif not request.future.done():
+                request.future.set_exception(ConnectionResetError(
+                    'The connection with Stealth was lost.'))
+
+        if self._closed:
+            self._ready.set()
+            self._logger.debug('connection closed')
+            return
+
+        self._logger.warning(f'connection lost: {exc}')
+        self._reconnect_task = self._loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """Try to connect again until succeeded with an exponential backoff."""
+        delay = RECONNECT_DELAY
+        attempt = 0
+        while not self._closed:
+            attempt += 1
+            try:
+                await self.connect()
+                self._logger.info(f'reconnected, attempt {attempt}')
+                return
+            except OSError as e:
+                if RECONNECT_ATTEMPTS and attempt >= RECONNECT_ATTEMPTS:
+                    self._logger.error(f'reconnection failed: {e}')
+                    break
+                self._logger.debug(f'reconnection attempt {attempt} failed, '
+                                   f'next one in {delay} seconds: {e}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+        # give up - fail everybody waiting
+        self._closed = True
+        self._ready.set()
+        for request in self._requests.values():
+            if not request.future.done():
+                request.future.set_exception(ConnectionError(
+                    'The connection with Stealth is closed.'))
+        self._replay.clear()
+        self._backlog.clear()
+
+    def send(self, data: bytes | bytearray, request_id: int = 0,
+             priority: Priority = Priority.NORMAL) -> None:
+        """Send the given data to Stealth.
+
+        If the connection is down, the data will be sent after reconnection.
+
+        :param data: a packet
+        :param request_id: the id of the request if the packet is a method
+            request returning result, the packet is kept to replay it
+        :param priority: packets of higher priority queued in the same loop
+            iteration are sent first
+        """
+        request = self._requests.get(request_id) if request_id else None
+        if request is not None:
+            request.packet = data
+
+        if not self.connected:
+            self._backlog.append((data, request))
+            if DEBUG:
+                self._logger.debug(f'data delayed: {format_packet(data)}')
+            return
+        self._write(data, request, priority)
+
+    def _write(self, data: bytes | bytearray, request: _Request | None,
+               priority: Priority = Priority.NORMAL) -> None:
+        """Queue the data to be written to the transport."""
+        self._outgoing[priority].append((data, request))
+        self._outgoing_count += 1
+        self._outgoing_size += len(data)
+        if DEBUG:
+            self._logger.debug(f'data queued: {format_packet(data)}')
+
+        if self._outgoing_count >= FLUSH_MAX_PACKETS \
+                or self._outgoing_size >= FLUSH_MAX_BYTES \
+                or not self._loop.is_running():
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_soon(self.flush)
+
+    def flush(self) -> None:
+        """Write all the queued data to the transport at once."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._outgoing_count or self._transport is None:
+            return
+
+        packets = [item for queue in self._outgoing for item in queue]
+        self._transport.writelines([data for data, _ in packets])
+        for _, request in packets:
+            if request is not None:
+                request.sent = True
+
+        self.flush_count += 1
+        self.flushed_packets += self._outgoing_count
+        if DEBUG:
+            self._logger.debug(f'{self._outgoing_count} packets sent, '
+                               f'{self._outgoing_size} bytes')
+        for queue in self._outgoing:
+            queue.clear()
+        self._outgoing_count = self._outgoing_size = 0
+
+    def _set_nodelay(self) -> None:
+        """Apply the TCP_NODELAY config value to the socket."""
+        sock = self._transport.get_extra_info('socket')
+        if sock is None or sock.family == getattr(socket, 'AF_UNIX', None):
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
+                            int(TCP_NODELAY))
+        except OSError as e:
+            self._logger.warning(f'Can not set TCP_NODELAY: {e}')
+
+    def _resolve_request(self, request_id: int, data: bytes) -> None:
+        """Pass the response data to the request waiting for it."""
+        request = self._requests.pop(request_id, None)
+        if request is not None and not request.future.done():
+            request.future.set_result(data)
+            return
+
+        # nobody waits for this response - drop it
+        self.dropped_responses += 1
+        if request_id in self._cancelled:
+            del self._cancelled[request_id]
+            self._logger.debug(f'late response dropped: {request_id}')
+        else:
+            self._logger.warning(f'unexpected response dropped: {request_id}')
 
     def data_received(self, data: bytes) -> None:
         """Handle the received data."""
-        self._logger.debug(f'data received: {format_packet(data)}')
-        # parse packet
-        self._buffer += data
-        while 42:
-            try:
-                packet = Packet.unpack_from(self._buffer)
-            except PacketParseError:
-                break
+        if DEBUG:
+            self._logger.debug(f'data received: {format_packet(data)}')
+        # parse the received data in place if there is nothing buffered
+        buffer = data
+        if self._buffer:
+            self._buffer += data
+            buffer = self._buffer
+
+        handlers = self._handlers
+        header_size = packet_header_struct.size
+        unpack_header = packet_header_struct.unpack_from
+        end = len(buffer)
+        offset = 0
+        while end - offset >= header_size:
+            size, cmd = unpack_header(buffer, offset)
+            packet_end = offset + packet_size_struct.size + size
+            if packet_end > end:
+                break  # the packet is not received completely yet
 
-            match packet.cmd:
-                # method response
-                case IncomingPacketCmdEnum.RESPONSE:
-                    self.methods_responses[packet.request_id] = packet.data
+            handler = handlers[cmd] if cmd < len(handlers) else None
+            if handler is not None:
+                handler(buffer, offset + header_size, packet_end)
+            else:
+                self._logger.warning(f'Unknown packet type: {cmd}')
+            offset = packet_end
 
-                # event
-                case IncomingPacketCmdEnum.EVENT:
-                    pass  # TODO: events handling
+        # keep the rest of the data till the next call
+        if buffer is self._buffer:
+            del self._buffer[:offset]
+        elif offset < end:
+            self._buffer = bytearray(buffer[offset:])
 
-                # pause script
-                case IncomingPacketCmdEnum.PAUSE:
-                    self._pause = not self._pause
+    def _handle_response(self, buffer: bytes | bytearray, start: int,
+                         end: int) -> None:
+        """Handle a method response packet."""
+        request_id, = packet_id_struct.unpack_from(buffer, start)
+        start += packet_id_struct.size
+        self._resolve_request(request_id, bytes(buffer[start:end]))
 
-                # terminate script
-                case IncomingPacketCmdEnum.TERMINATE:
-                    exit()
+    def _handle_event(self, buffer: bytes | bytearray, start: int,
+                      end: int) -> None:
+        """Handle an event packet."""
+        # do not even copy the data if nobody needs the event
+        if start < end and buffer[start] in self.event_sinks:
+            self._dispatch_event(bytes(buffer[start:end]))
 
-                # other
-                case _:
-                    self._logger.warning(f'Unknown packet type: {packet.cmd}')
+    def _handle_pause(self, buffer: bytes | bytearray, start: int,
+                      end: int) -> None:
+        """Handle a pause script packet."""
+        self._pause = not self._pause
 
-            self._buffer = self._buffer[packet.size:]
+    def _handle_terminate(self, buffer: bytes | bytearray, start: int,
+                          end: int) -> None:
+        """Handle a terminate script packet."""
+        exit()
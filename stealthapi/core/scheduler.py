@@ -0,0 +1,107 @@
+"""
+This module provides the priority-aware admission of requests to a connection.
+
+Requests of high and normal priority are admitted immediately. Only a limited
+count of low priority requests may wait for a response at the same time, the
+others wait in a queue, so a large batch of low priority queries never stands
+in front of urgent calls. Packets queued within one loop iteration are written
+in priority order too, see StealthConnection.
+"""
+
+__all__ = ['Priority', 'SendScheduler']
+
+import asyncio
+import collections
+import enum
+import time
+
+
+@enum.unique
+class Priority(enum.IntEnum):
+    HIGH = 0  # time-critical actions
+    NORMAL = 1
+    LOW = 2  # bulk queries like inventory scans or journal dumps
+
+
+class SendScheduler:
+    """Admits requests to a connection according to their priority.
+
+    :param low_limit: the max count of low priority requests in flight
+    """
+
+    low_limit: int
+    _low_inflight: int  # admitted low priority requests not released yet
+    _low_waiters: collections.deque[asyncio.Future]
+
+    _requests: list[int]  # priority -> count of admitted requests
+    _delay: list[float]  # priority -> total queueing delay, seconds
+    _max_delay: list[float]  # priority -> max queueing delay, seconds
+
+    def __init__(self, low_limit: int) -> None:
+        self.low_limit = low_limit
+        self._low_inflight = 0
+        self._low_waiters = collections.deque()
+        self._requests = [0] * len(Priority)
+        self._delay = [0.] * len(Priority)
+        self._max_delay = [0.] * len(Priority)
+
+    async def acquire(self, priority: Priority) -> None:
+        """Wait until a request of the given priority may be sent.
+
+        Every acquired request must be released with `release`.
+        """
+        start = time.perf_counter()
+        if priority is Priority.LOW:
+            if self._low_inflight < self.low_limit and not self._low_waiters:
+                self._low_inflight += 1
+            else:
+                await self._wait_low()
+
+        delay = time.perf_counter() - start
+        self._requests[priority] += 1
+        self._delay[priority] += delay
+        if delay > self._max_delay[priority]:
+            self._max_delay[priority] = delay
+
+    async def _wait_low(self) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._low_waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                # the place was given, but nobody will use it
+                self.release(Priority.LOW)
+            elif future in self._low_waiters:
+                # release() skips and drops cancelled waiters itself
+                self._low_waiters.remove(future)
+            raise
+
+    def release(self, priority: Priority) -> None:
+        """Release a request acquired with `acquire`."""
+        if priority is not Priority.LOW:
+            return
+
+        self._low_inflight -= 1
+        # give the place to the first waiting request
+        while self._low_waiters:
+            future = self._low_waiters.popleft()
+            if not future.done():
+                self._low_inflight += 1
+                future.set_result(None)
+                break
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Return count of requests and queueing delays for every priority."""
+        stats = {}
+        for priority in Priority:
+            requests = self._requests[priority]
+            delay = self._delay[priority]
+            stats[priority.name.lower()] = {
+                'requests': requests,
+                'mean_delay': delay / requests if requests else 0.,
+                'max_delay': self._max_delay[priority],
+            }
+        stats['low']['in_flight'] = self._low_inflight
+        stats['low']['waiting'] = len(self._low_waiters)
+        return stats
@@ -1,16 +1,69 @@
 """This module provides a base class for all script methods."""
 
-__all__ = ['ScriptMethod']
+__all__ = ['ScriptMethod', 'MethodTimeoutError']
 
-from stealthapi.config import TIMER_RES
-from stealthapi.core.connection_container import get_connection
-from stealthapi.core.datatypes import AnyArgType
-from stealthapi.core.packet import packet_cmd_struct, packet_id_struct, \
-    packet_size_struct
+import asyncio
+import struct
+import time
+from typing import Callable
+
+from stealthapi.config import ENDIAN, ENGINE, REQUEST_TIMEOUT, TIMER_RES
+from stealthapi.core.connection_container import drop_blocking_connection, \
+    get_blocking_connection, get_connection
+from stealthapi.core import interceptors
+from stealthapi.core.datatypes import AnyArgType, _NumberBase
+from stealthapi.core.interceptors import CallInfo
+from stealthapi.core.packet import pack_packet
+from stealthapi.core.protocol import StealthConnection
+from stealthapi.core.scheduler import Priority
 from stealthapi.core.utils import get_event_loop, sleep
 
 _AnyArgType = type[AnyArgType]
 _AnyArgArray = list[_AnyArgType] | tuple[_AnyArgType]
+_Packer = Callable[[tuple], bytes]
+_Unpacker = Callable[[bytes], object]
+
+
+def _compile_packer(argtypes: _AnyArgArray) -> _Packer:
+    """Return a function packing method arguments of the given types.
+
+    Arguments of numeric types are packed with a single struct.Struct.
+    """
+    argtypes = tuple(argtypes)
+    if not argtypes:
+        return lambda args: b''
+
+    if not all(issubclass(t, _NumberBase) for t in argtypes):
+        return lambda args: b''.join(t(v).pack()
+                                     for t, v in zip(argtypes, args))
+
+    struct_ = struct.Struct(ENDIAN + ''.join(t._fmt for t in argtypes))
+    # unsigned values < 0 are set to max value, like _NumberBase.pack does
+    unsigned = [(i, 2 ** (t._struct.size * 8) - 1)
+                for i, t in enumerate(argtypes) if t._fmt.isupper()]
+    if not unsigned:
+        return lambda args: struct_.pack(*args)
+
+    def pack(args: tuple) -> bytes:
+        args = list(args)
+        for i, max_value in unsigned:
+            if args[i] < 0:
+                args[i] = max_value
+        return struct_.pack(*args)
+    return pack
+
+
+def _compile_unpacker(restype: _AnyArgType) -> _Unpacker:
+    """Return a function unpacking a method result of the given type."""
+    if issubclass(restype, _NumberBase):
+        unpack_from = restype._struct.unpack_from
+        return lambda data: unpack_from(data)[0]
+    return lambda data: restype.unpack_from(data).value
+
+
+class MethodTimeoutError(TimeoutError):
+    """Raised when Stealth does not answer a method call in time."""
+    pass
 
 
 class ScriptMethod:
@@ -24,63 +77,215 @@ class ScriptMethod:
     """
 
     index: int
-    restype: AnyArgType
-    argtypes: _AnyArgArray
+    _restype: _AnyArgType | None
+    _argtypes: _AnyArgArray
+    idempotent: bool  # True if the call may be replayed after reconnection
+    priority: Priority  # the default priority of calls
+
+    # codecs are compiled on the first call
+    _packer: _Packer | None
+    _unpacker: _Unpacker | None
 
     def __init__(self, index: int,
                  argtypes: _AnyArgArray = None,
-                 restype: _AnyArgType = None) -> None:
+                 restype: _AnyArgType = None,
+                 idempotent: bool = False,
+                 priority: Priority = Priority.NORMAL) -> None:
         self.index = index
-        self.argtypes = argtypes
+        self.argtypes = argtypes if argtypes is not None else []
         self.restype = restype
+        self.idempotent = idempotent
+        self.priority = priority
+
+    @property
+    def argtypes(self) -> _AnyArgArray:
+        return self._argtypes
+
+    @argtypes.setter
+    def argtypes(self, value: _AnyArgArray) -> None:
+        self._argtypes = value
+        self._packer = None
+
+    @property
+    def restype(self) -> _AnyArgType | None:
+        return self._restype
 
-    def __call__(self, *args: AnyArgType) -> AnyArgType:
+    @restype.setter
+    def restype(self, value: _AnyArgType | None) -> None:
+        self._restype = value
+        self._unpacker = None
+
+    def __call__(self, *args: AnyArgType, timeout: float | None = None,
+                 priority: Priority | None = None) -> AnyArgType:
+        """Call the method and block until its result is received.
+
+        :param args: the method arguments
+        :param timeout: seconds to wait for the result, the REQUEST_TIMEOUT
+            config value is used if None, 0 - wait forever
+        :param priority: the call priority, the method default one is used
+            if None, it makes no difference for the "socket" engine
+        :return: the method result or None if the method returns nothing
+        :raises MethodTimeoutError: if the result is not received in time
+        """
+        if ENGINE == 'socket':
+            return self._call_blocking(args, timeout)
         loop = get_event_loop()
-        loop.run_until_complete(self._call(args))
+        return loop.run_until_complete(self.call(*args, timeout=timeout,
+                                                 priority=priority))
+
+    async def call(self, *args: AnyArgType, timeout: float | None = None,
+                   priority: Priority | None = None) -> AnyArgType:
+        """The coroutine version of the method call. See `__call__`."""
+        if timeout is None:
+            timeout = REQUEST_TIMEOUT
+        if priority is None:
+            priority = self.priority
+        call = None
+        if interceptors.get_interceptors():
+            # notify the chain in the task of the caller: asyncio.wait_for
+            # runs the call in a new task, so the stack of the script making
+            # the call is not seen from there
+            call = CallInfo(self.index, args)
+            interceptors.before_pack(call)
+            args = call.args
 
-    async def _call(self, args: tuple[AnyArgType]) -> AnyArgType:
+        coro = self._call(args, call, priority)
+        try:
+            if timeout:
+                coro = asyncio.wait_for(coro, timeout)
+            return await coro
+        except asyncio.TimeoutError:
+            error = self._timeout_error(timeout)
+            if call is not None:
+                interceptors.on_error(call, error)
+            raise error from None
+        except Exception as e:
+            if call is not None:
+                interceptors.on_error(call, e)
+            raise
+
+    async def _call(self, args: tuple[AnyArgType], call: CallInfo | None,
+                    priority: Priority) -> AnyArgType:
         """
         Check pause, form packet, send it to Stealth, wait for response and
         return it.
         """
-        # check pause script
+        # wait for reconnection and check pause script
         connection = await get_connection()
+        await connection.wait_connected()
         while connection.pause:
             await sleep(TIMER_RES)
 
-        # form packet
-        data = bytes()
+        # wait for the turn of the priority class and for a place allowed by
+        # the concurrency limiter
+        await connection.scheduler.acquire(priority)
+        try:
+            await connection.limiter.acquire(self.index, priority)
+            start = time.perf_counter()
+            rtt = None
+            dropped = False
+            try:
+                result = await self._send(connection, args, call, priority)
+                if self.restype is not None:
+                    rtt = time.perf_counter() - start
+                return result
+            except asyncio.CancelledError:
+                dropped = True  # timed out
+                raise
+            finally:
+                connection.limiter.release(rtt, dropped)
+        finally:
+            connection.scheduler.release(priority)
+
+    async def _send(self, connection: StealthConnection,
+                    args: tuple[AnyArgType], call: CallInfo | None,
+                    priority: Priority) -> AnyArgType:
+        """Form packet, send it to Stealth, wait for response and return it."""
+        # nothing to wait for - just send
+        if self.restype is None:
+            packet = self._form_packet(0, args)
+            connection.send(packet, priority=priority)
+            if call is not None:
+                interceptors.after_send(call, len(packet))
+                interceptors.on_response(call, 0, None)
+            return None
 
-        # serialize arguments
-        for t, v in zip(self.argtypes, args):
-            data += t(v).pack()
+        # make packet, send to Stealth and wait for a result, the request id
+        # is released even if the call was cancelled or timed out
+        request_id, response = connection.register_request(self.idempotent)
+        try:
+            packet = self._form_packet(request_id, args)
+            connection.send(packet, request_id, priority)
+            if call is not None:
+                call.request_id = request_id
+                interceptors.after_send(call, len(packet))
+            data = await response
+        finally:
+            connection.release_request(request_id)
 
-        # make packet and send to Stealth
-        request_id = connection.request_id if self.restype else 0
-        packet = await self._form_packet(request_id, args)
-        connection.send(packet)
+        return self._unpack_result(data, call)
 
-        # wait for a result
-        while self.restype is not None:
-            try:
-                resp = connection.methods_responses.pop(request_id)
-                result = self.restype.unpack_from(resp)
-                return result.value
-            except KeyError:
-                await sleep(TIMER_RES)
-
-    async def _form_packet(self, req_id: int, args: tuple[AnyArgType]) -> bytes:
-        # packet header
-        index = packet_cmd_struct.pack(self.index)
-        request_id = packet_id_struct.pack(req_id)
-
-        # method arguments
-        packed_args = bytes()
-        for cls, value in zip(self.argtypes, args):
-            packed_args += cls(value).pack()
-
-        # form packet
-        data = index + request_id + packed_args  # packet data (header + args)
-        size = packet_size_struct.pack(len(data))  # packet size
-
-        return size + data
+    def _call_blocking(self, args: tuple[AnyArgType],
+                       timeout: float | None) -> AnyArgType:
+        """The same as `call`, but over a blocking socket without a loop."""
+        if timeout is None:
+            timeout = REQUEST_TIMEOUT
+        deadline = time.monotonic() + timeout if timeout else None
+        call = None
+        if interceptors.get_interceptors():
+            call = CallInfo(self.index, args)
+            interceptors.before_pack(call)
+            args = call.args
+
+        connection = get_blocking_connection()
+        try:
+            # check pause script
+            connection.wait_unpaused(deadline)
+
+            # nothing to wait for - just send
+            if self.restype is None:
+                packet = self._form_packet(0, args)
+                connection.send(packet)
+                if call is not None:
+                    interceptors.after_send(call, len(packet))
+                    interceptors.on_response(call, 0, None)
+                return None
+
+            request_id = connection.request_id
+            packet = self._form_packet(request_id, args)
+            connection.send(packet)
+            if call is not None:
+                call.request_id = request_id
+                interceptors.after_send(call, len(packet))
+            data = connection.wait_response(request_id, deadline)
+        except TimeoutError:
+            error = self._timeout_error(timeout)
+            if call is not None:
+                interceptors.on_error(call, error)
+            raise error from None
+        except Exception as e:
+            if isinstance(e, OSError):
+                # the connection is broken, a new one will be made next call
+                drop_blocking_connection()
+            if call is not None:
+                interceptors.on_error(call, e)
+            raise
+
+        return self._unpack_result(data, call)
+
+    def _unpack_result(self, data: bytes, call: CallInfo | None) -> AnyArgType:
+        if self._unpacker is None:
+            self._unpacker = _compile_unpacker(self.restype)
+        result = self._unpacker(data)
+        if call is not None:
+            interceptors.on_response(call, len(data), result)
+        return result
+
+    def _timeout_error(self, timeout: float) -> MethodTimeoutError:
+        return MethodTimeoutError(f'Method {self.index} has not been '
+                                  f'answered in {timeout} seconds.')
+
+    def _form_packet(self, req_id: int, args: tuple[AnyArgType]) -> bytes:
+        if self._packer is None:
+            self._packer = _compile_packer(self.argtypes)
+        return pack_packet(self.index, req_id, self._packer(args))
@@ -1,16 +1,32 @@
 """This module provides some useful utilities."""
 
-__all__ = ['sleep', 'get_connection_port', 'get_event_loop', 'format_packet']
+__all__ = ['sleep', 'get_connection_port', 'get_connection_port_blocking',
+           'get_proxy_token', 'get_event_loop', 'format_packet']
 import asyncio
+import json
 import logging
+import os
 import platform
+import socket
 import struct
+import threading
 from typing import Iterable
 
 from stealthapi.config import ENDIAN, HOST, PORT
-from stealthapi.core.winmm import set_timer_resolution
+from stealthapi.submit import _runtime_dir
 
 _IS_WIN = platform.system() == 'Windows'
+if _IS_WIN:
+    # winmm.dll exists on Windows only
+    from stealthapi.core.winmm import set_timer_resolution
+
+_local = threading.local()  # keeps an event loop for every thread
+
+# the file with the TCP port and token of the proxy, see stealthapi.proxy
+_PROXY_ADDRESS_NAME = 'proxy.json'
+
+_get_port_packet = struct.pack(ENDIAN + 'HI', 4, 0xDEADBEEF)
+_get_port_response_struct = struct.Struct(ENDIAN + '2H')
 
 
 async def sleep(msec: int) -> None:
@@ -30,8 +46,6 @@ async def get_connection_port() -> int:
     :return: A port number
     """
     logger = logging.getLogger('get_port')
-    get_port_packet = struct.pack(ENDIAN + 'HI', 4, 0xDEADBEEF)
-    get_port_packet_response_struct = struct.Struct(ENDIAN + '2H')
 
     # connect to port provider server
     logger.debug(f'connecting to {HOST}:{PORT}')
@@ -42,17 +56,20 @@ async def get_connection_port() -> int:
         raise
 
     # send the request port data
-    writer.write(get_port_packet)
-    logger.debug(f'data sent: {format_packet(get_port_packet)}')
+    writer.write(_get_port_packet)
+    logger.debug(f'data sent: {format_packet(_get_port_packet)}')
 
     # receive port from Stealth
     _buffer = bytes()
     while 42:
-        data = await reader.read(get_port_packet_response_struct.size)
+        data = await reader.read(_get_port_response_struct.size)
+        if not data:
+            writer.close()
+            raise ConnectionResetError('Port provider closed connection.')
         logger.debug(f'data received: {format_packet(data)}')
         _buffer += data
         try:
-            _, port = get_port_packet_response_struct.unpack(_buffer)
+            _, port = _get_port_response_struct.unpack(_buffer)
             logger.debug(f'port: {port}')
 
             # close connection
@@ -64,15 +81,72 @@ async def get_connection_port() -> int:
             pass
 
 
+def get_connection_port_blocking() -> int:
+    """The blocking version of `get_connection_port`.
+
+    :return: A port number
+    """
+    logger = logging.getLogger('get_port')
+
+    # connect to port provider server
+    logger.debug(f'connecting to {HOST}:{PORT}')
+    try:
+        sock = socket.create_connection((HOST, PORT))
+    except (ConnectionError, ConnectionRefusedError):
+        logger.error("Can't connect to Stealth")
+        raise
+
+    with sock:
+        # send the request port data
+        sock.sendall(_get_port_packet)
+        logger.debug(f'data sent: {format_packet(_get_port_packet)}')
+
+        # receive port from Stealth
+        _buffer = bytes()
+        while len(_buffer) < _get_port_response_struct.size:
+            data = sock.recv(_get_port_response_struct.size - len(_buffer))
+            if not data:
+                raise ConnectionResetError('Port provider closed connection.')
+            logger.debug(f'data received: {format_packet(data)}')
+            _buffer += data
+
+    _, port = _get_port_response_struct.unpack(_buffer)
+    logger.debug(f'port: {port}')
+    return port
+
+
+def get_proxy_token() -> bytes:
+    """Return the secret token the proxy listening on a localhost port
+    expects from its clients before any packet.
+
+    :raises ConnectionRefusedError: if the proxy is not running
+    """
+    path = os.path.join(_runtime_dir(), _PROXY_ADDRESS_NAME)
+    try:
+        with open(path) as file:
+            return json.load(file)['token'].encode()
+    except FileNotFoundError:
+        raise ConnectionRefusedError('The proxy is not running.') from None
+
+
 def get_event_loop() -> asyncio.AbstractEventLoop:
-    """Return the running event loop or create a new one.
+    """Return the running event loop or the event loop of the current thread.
+
+    The loop of the thread is created on the first call and reused later, so
+    connections and futures made inside it stay usable between script calls.
 
     :return: an event loop
     """
     try:
         return asyncio.get_running_loop()
     except RuntimeError:
-        return asyncio.new_event_loop()
+        pass
+
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    return loop
 
 
 def format_packet(data: bytes | bytearray | Iterable[int], ) -> str:
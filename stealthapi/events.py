@@ -1,39 +1,252 @@
 """
 This module provides tools for handling events.
+
+Stealth sends events of a kind only while somebody in the script consumes
+them: the event is set when the first handler or stream appears and unset when
+the last one leaves. Filters are checked before event objects are created,
+filters given as a mapping even before the event arguments are decoded.
+
+With the "socket" engine there is no event loop: handlers are called while
+the script waits for method results or calls `receive_events` of the
+connection, and streams are not available.
+
+:Example:
+>>> from stealthapi import events
+>>> async def print_speech():
+...     async with events.stream(events.Speech,
+...                              filter={'sender_name': 'Bob'}) as speech:
+...         async for ev in speech:
+...             print(ev.text)
 """
 
-__all__ = []
+__all__ = ['ItemInfoEvent', 'ItemDeleted', 'Speech', 'EventStream', 'stream']
 
-from typing import Callable
+import asyncio
+from typing import Callable, Mapping
 
-from stealthapi.core.commands import SET_EVENT, UNSET_EVENT
-from stealthapi.core.scriptmethod import ScriptMethod
+from stealthapi.config import ENGINE
+from stealthapi.core.blocking import BlockingConnection
+from stealthapi.core.connection_container import find_connection, \
+    get_blocking_connection, get_connection
+from stealthapi.core.eventdecoder import EventSink
+from stealthapi.core.protocol import StealthConnection
+from stealthapi.core.utils import get_event_loop
 
-_set_event = ScriptMethod(SET_EVENT)
-_unset_event = ScriptMethod(UNSET_EVENT)
+_Filter = Callable[..., bool] | Mapping[str, object] | None
 
 
 class _Event:
+    """A base class for events. An instance keeps the event arguments."""
+
+    __slots__ = ('args',)
+
     _index: int
-    handler: Callable
+    _fields: tuple[str, ...] = ()  # names of the event arguments
+
+    args: tuple
+
+    def __init__(self, args: tuple) -> None:
+        self.args = args
+
+    def __getattr__(self, name: str) -> object:
+        try:
+            return self.args[self._fields.index(name)]
+        except (ValueError, IndexError):
+            raise AttributeError(f'{self.__class__.__name__!r} object has no '
+                                 f'attribute {name!r}') from None
+
+    def __repr__(self) -> str:
+        args = ', '.join(f'{name}={value!r}'
+                         for name, value in zip(self._fields, self.args))
+        return f'{self.__class__.__name__}({args})'
+
+    @classmethod
+    def _sink(cls, callback: Callable[['_Event'], None],
+              filter: _Filter) -> EventSink:
+        """Make a sink of events of this kind. A mapping filter is turned
+        into expected values of the arguments checked before decoding."""
+        if filter is None or callable(filter):
+            return EventSink(cls, callback, filter)
+        match = tuple((cls._fields.index(name), value)
+                      for name, value in filter.items())
+        return EventSink(cls, callback, match=match)
+
+    @classmethod
+    def set(cls, handler: Callable[['_Event'], None],
+            filter: _Filter = None) -> None:
+        """Call the handler for every event of this kind.
+
+        In a coroutine it uses the connection of the running event loop, if
+        there is none yet, await `set_async` instead.
+
+        :param handler: receives event objects
+        :param filter: a function called with the event arguments or a
+            mapping of argument names to expected values
+        :raises RuntimeError: if called from a coroutine before the thread
+            has connected to Stealth
+        """
+        sink = cls._sink(handler, filter)
+        _get_connection().add_event_sink(cls._index, sink)
+
+    @classmethod
+    def unset(cls, handler: Callable[['_Event'], None]) -> None:
+        """Stop calling the handler set with `set`."""
+        cls._unset(_get_connection(), handler)
+
+    @classmethod
+    async def set_async(cls, handler: Callable[['_Event'], None],
+                        filter: _Filter = None) -> None:
+        """The coroutine version of `set`, connects to Stealth if needed."""
+        sink = cls._sink(handler, filter)
+        connection = await _get_connection_async()
+        connection.add_event_sink(cls._index, sink)
+
+    @classmethod
+    async def unset_async(cls, handler: Callable[['_Event'], None]) -> None:
+        """The coroutine version of `unset`."""
+        cls._unset(await _get_connection_async(), handler)
+
+    @classmethod
+    def _unset(cls, connection: StealthConnection | BlockingConnection,
+               handler: Callable[['_Event'], None]) -> None:
+        for sink in connection.event_sinks.get(cls._index, ()):
+            if sink.callback == handler:
+                connection.remove_event_sink(cls._index, sink)
+                break
+
+
+def _get_connection() -> StealthConnection | BlockingConnection:
+    """Return the connection of the current thread for the engine.
 
-    def set(self):
-        pass
-        # _set_event(self._index)
+    :raises RuntimeError: if the event loop is running and there is no
+        connection to use yet: the loop can not wait for a new one
+    """
+    if ENGINE == 'socket':
+        return get_blocking_connection()
+    loop = get_event_loop()
+    if not loop.is_running():
+        return loop.run_until_complete(get_connection())
+    connection = find_connection()
+    if connection is None:
+        raise RuntimeError('There is no connection with Stealth in the '
+                           'running event loop yet, await `set_async` or '
+                           '`unset_async` instead.')
+    return connection
 
-    def unset(self):
-        pass
-        # _unset_event(self._index)
+
+async def _get_connection_async() -> StealthConnection | BlockingConnection:
+    """The coroutine version of `_get_connection`."""
+    if ENGINE == 'socket':
+        return get_blocking_connection()
+    return await get_connection()
 
 
 class ItemInfoEvent(_Event):
+    __slots__ = ()
     _index = 0
-    handler: Callable
+    _fields = ('item_id',)
 
 
 class ItemDeleted(_Event):
+    __slots__ = ()
     _index = 1
+    _fields = ('item_id',)
 
 
 class Speech(_Event):
+    __slots__ = ()
     _index = 2
+    _fields = ('text', 'sender_name', 'sender_id')
+
+
+class EventStream:
+    """An async iterator over events of one kind. Use `stream` to create it.
+
+    Events are consumed from the moment the stream is opened (by `async with`
+    or the first iteration) until it is closed.
+    """
+
+    event: type[_Event]
+    maxsize: int
+    dropped: int  # count of events dropped because the queue was full
+
+    _sink: EventSink
+    _queue: asyncio.Queue | None
+    _connection: StealthConnection | None
+    _closed: bool
+
+    def __init__(self, event: type[_Event], filter: _Filter = None,
+                 maxsize: int = 0) -> None:
+        self.event = event
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._sink = event._sink(self._put, filter)
+        self._queue = None
+        self._connection = None
+        self._closed = False
+
+    async def __aenter__(self) -> 'EventStream':
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def __aiter__(self) -> 'EventStream':
+        return self
+
+    async def __anext__(self) -> _Event:
+        if self._connection is None:
+            await self.open()
+        if self._closed:
+            raise StopAsyncIteration
+        event = await self._queue.get()
+        if event is None:  # closed while waiting
+            raise StopAsyncIteration
+        return event
+
+    async def open(self) -> None:
+        """Start consuming events.
+
+        :raises RuntimeError: if the ENGINE config value is "socket"
+        """
+        if self._connection is not None or self._closed:
+            return
+        if ENGINE == 'socket':
+            raise RuntimeError('Event streams need the "asyncio" engine, set '
+                               'event handlers with the "socket" one.')
+        self._queue = asyncio.Queue(self.maxsize)
+        self._connection = await get_connection()
+        self._connection.add_event_sink(self.event._index, self._sink)
+
+    def close(self) -> None:
+        """Stop consuming events, the iteration stops."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._connection is not None:
+            self._connection.remove_event_sink(self.event._index, self._sink)
+            # wake up the waiting consumer, it does not wait if it is full
+            try:
+                self._queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    def _put(self, event: _Event) -> None:
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+def stream(event: type[_Event], filter: _Filter = None,
+           maxsize: int = 0) -> EventStream:
+    """Return an async iterator over events of the given kind.
+
+    :param event: an event class, e.g. Speech
+    :param filter: a function called with the event arguments or a mapping of
+        argument names to expected values, other events are dropped
+    :param maxsize: the max count of not consumed events, newer events are
+        dropped when it is reached, 0 - no limit
+    """
+    return EventStream(event, filter, maxsize)
@@ -0,0 +1,403 @@
+"""
+This module provides the script host daemon, a long-lived process running
+scripts submitted to it by stealthapi.submit.
+
+A script run by a new interpreter pays for the interpreter startup, imports,
+the config load and the handshake with Stealth before its first call. The
+host pays for all of it once: modules stay imported, and every worker thread
+keeps its connection with Stealth open between scripts, so a script starts
+within milliseconds.
+
+Scripts run in worker threads by default. A script run this way shares the
+process with others: it must not rely on the current directory, and it gets
+its arguments from `script_args()` instead of sys.argv. Its output is sent to
+the client which submitted it. A script running an event loop of its own,
+e.g. by `asyncio.run`, gets a new connection for that loop. On POSIX the host
+can fork a child process for every script instead: scripts are isolated, but
+every child makes a new connection with Stealth.
+
+The host runs code with the rights of its user, so only that user may
+submit scripts. On POSIX the host listens on a Unix socket accessible by the
+user only. Where there are no Unix sockets it listens on a localhost port and
+runs only requests with a secret token, which it writes to a file readable
+by the user.
+
+:Example:
+    python -m stealthapi.host serve --workers 8
+    python path/to/stealthapi/submit.py my_script.py arg1 arg2
+"""
+
+__all__ = ['ScriptHost', 'script_args', 'submit']
+
+import argparse
+import asyncio
+import builtins
+import concurrent.futures
+import hmac
+import io
+import json
+import logging
+import os
+import secrets
+import socket
+import sys
+import threading
+import time
+import traceback
+import types
+
+from stealthapi import config
+from stealthapi.core.connection_container import get_blocking_connection, \
+    get_connection
+from stealthapi.core.utils import get_event_loop
+from stealthapi.submit import _ADDRESS_NAME, _SOCKET_NAME, _receive_message, \
+    _runtime_dir, _send_message, submit
+
+_LOCALHOST = '127.0.0.1'
+
+_local = threading.local()  # script_args, stdout and stderr of the script
+
+_code_lock = threading.Lock()
+# script filepath -> modification time and compiled code of the script
+_code_cache: dict[str, tuple[float, types.CodeType]] = {}
+
+
+def script_args() -> list[str]:
+    """Return the arguments of the current script, the script path first.
+
+    Works both in scripts run by the host and in scripts run as usual.
+    """
+    return getattr(_local, 'args', sys.argv)
+
+
+class _ClientStream(io.TextIOBase):
+    """A text stream sending the written text to the client."""
+
+    def __init__(self, sock: socket.socket, name: str) -> None:
+        self._sock = sock
+        self._name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            _send_message(self._sock, {self._name: text})
+        return len(text)
+
+
+class _ThreadStream(io.TextIOBase):
+    """A text stream writing to the stream of the current script if the
+    current thread runs one, otherwise to the default stream."""
+
+    def __init__(self, name: str, default: io.TextIOBase) -> None:
+        self._name = name
+        self._default = default
+
+    def _stream(self) -> io.TextIOBase:
+        return getattr(_local, self._name, None) or self._default
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        return self._stream().write(text)
+
+    def flush(self) -> None:
+        self._stream().flush()
+
+
+def _compile_script(path: str) -> types.CodeType:
+    """Return the compiled code of the script, compile it once per change."""
+    mtime = os.stat(path).st_mtime
+    with _code_lock:
+        cached = _code_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, 'rb') as file:
+        code = compile(file.read(), path, 'exec')
+    with _code_lock:
+        _code_cache[path] = mtime, code
+    return code
+
+
+class ScriptHost:
+    """The script host daemon.
+
+    :param port: the localhost port to listen on where there are no Unix
+        sockets
+    :param workers: the max count of scripts run at once
+    :param fork: run every script in a forked child process (POSIX only)
+    """
+
+    port: int
+    workers: int
+    fork: bool
+
+    _server: socket.socket | None
+    _path: str | None  # the socket file, or the file with the port and token
+    _token: str | None  # the secret token of requests, None - not needed
+    _executor: concurrent.futures.ThreadPoolExecutor | None
+    _logger: logging.Logger
+
+    def __init__(self, port: int = config.SCRIPT_HOST_PORT,
+                 workers: int = config.SCRIPT_HOST_WORKERS,
+                 fork: bool = False) -> None:
+        if fork and not hasattr(os, 'fork'):
+            raise OSError('Forked workers are not supported on this platform.')
+        self.port = port
+        self.workers = workers
+        self.fork = fork
+        self._server = None
+        self._path = None
+        self._token = None
+        self._executor = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def serve_forever(self) -> None:
+        """Accept and run scripts until interrupted."""
+        self._listen()
+        if not self.fork:
+            sys.stdout = _ThreadStream('stdout', sys.stdout)
+            sys.stderr = _ThreadStream('stderr', sys.stderr)
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix='script')
+            self._warm_up()
+
+        try:
+            while 42:
+                client, _ = self._server.accept()
+                if self.fork:
+                    self._reap()
+                    self._fork(client)
+                else:
+                    self._executor.submit(self._handle, client)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop accepting scripts."""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._path is not None:
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+            self._path = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if isinstance(sys.stdout, _ThreadStream):
+            sys.stdout = sys.stdout._default
+        if isinstance(sys.stderr, _ThreadStream):
+            sys.stderr = sys.stderr._default
+
+    def _listen(self) -> None:
+        """Listen on a Unix socket in the user directory, or on a localhost
+        port where there are no Unix sockets."""
+        directory = _runtime_dir(create=True)
+        if hasattr(socket, 'AF_UNIX'):
+            path = os.path.join(directory, _SOCKET_NAME)
+            if os.path.exists(path):
+                os.unlink(path)  # left by a previous run
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._server.bind(path)
+            os.chmod(path, 0o600)
+            self._server.listen()
+            self._path = path
+            self._logger.info(f'listening on {path}')
+            return
+
+        self._server = socket.create_server((_LOCALHOST, self.port))
+        port = self._server.getsockname()[1]
+        self._token = secrets.token_hex(16)
+        self._path = os.path.join(directory, _ADDRESS_NAME)
+        fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as file:
+            json.dump({'port': port, 'token': self._token}, file)
+        self._logger.info(f'listening on {_LOCALHOST}:{port}')
+
+    def _warm_up(self) -> None:
+        """Connect every worker thread with Stealth."""
+        barrier = threading.Barrier(self.workers)
+
+        def connect() -> None:
+            barrier.wait()  # make every thread of the pool take one call
+            try:
+                _connect()
+            except OSError as e:
+                self._logger.warning(f'Can not connect a worker: {e}')
+
+        for _ in range(self.workers):
+            self._executor.submit(connect)
+
+    def _fork(self, client: socket.socket) -> None:
+        pid = os.fork()
+        if pid:
+            client.close()
+            return
+
+        # the child process
+        self._server.close()
+        code = 1
+        try:
+            code = self._handle(client, forked=True)
+        finally:
+            os._exit(code)
+
+    @staticmethod
+    def _reap() -> None:
+        """Collect exit statuses of finished children."""
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except ChildProcessError:
+            pass  # no children left
+
+    def _handle(self, client: socket.socket, forked: bool = False) -> int:
+        """Run the script requested by the client and return its exit code.
+        """
+        with client, client.makefile('rb') as file:
+            try:
+                request = _receive_message(file)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict) or 'path' not in request:
+                _send_message(client, {'stderr': 'Bad request.\n', 'exit': 2})
+                return 2
+            if self._token is not None and not hmac.compare_digest(
+                    str(request.get('token')).encode(), self._token.encode()):
+                self._logger.warning('a request with a wrong token')
+                _send_message(client, {'stderr': 'Access denied.\n',
+                                       'exit': 2})
+                return 2
+
+            start = time.perf_counter()
+            code = self._run(client, request, forked)
+            elapsed = time.perf_counter() - start
+            self._logger.debug(f'{request["path"]} exited with {code} in '
+                               f'{elapsed:.3f}s')
+            try:
+                _send_message(client, {'exit': code})
+            except OSError:
+                pass  # the client has gone
+            return code
+
+    def _run(self, client: socket.socket, request: dict, forked: bool) -> int:
+        path = request['path']
+        args = [path] + list(request.get('args', ()))
+        _local.args = args
+        stdout = _local.stdout = _ClientStream(client, 'stdout')
+        stderr = _local.stderr = _ClientStream(client, 'stderr')
+        if forked:
+            # a forked child owns the process and may change it
+            sys.argv = args
+            sys.stdout, sys.stderr = stdout, stderr
+            if request.get('cwd'):
+                os.chdir(request['cwd'])
+        else:
+            tasks = _tasks()
+
+        try:
+            # runpy would replace sys.argv[0] and the __main__ module of the
+            # whole process, it can not be used by concurrent scripts
+            code = _compile_script(path)
+            exec(code, {'__name__': '__main__', '__file__': path,
+                        '__builtins__': builtins})
+            return 0
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            stderr.write(f'{e.code}\n')
+            return 1
+        except BaseException:
+            stderr.write(traceback.format_exc())
+            return 1
+        finally:
+            _local.args = _local.stdout = _local.stderr = None
+            if not forked:
+                try:
+                    _reset_connection(tasks)
+                except Exception as e:
+                    self._logger.warning(f'Can not reset a worker: {e!r}')
+
+
+def _connect() -> None:
+    """Connect the current thread with Stealth."""
+    if config.ENGINE == 'socket':
+        get_blocking_connection()
+    else:
+        loop = get_event_loop()
+        connection = loop.run_until_complete(get_connection())
+        loop.run_until_complete(connection.wait_connected())
+
+
+def _tasks() -> set[asyncio.Task]:
+    """Return the tasks of the event loop of the thread."""
+    if config.ENGINE == 'socket':
+        return set()
+    return asyncio.all_tasks(get_event_loop())
+
+
+def _reset_connection(tasks: set[asyncio.Task]) -> None:
+    """Forget the state left by a script on the connection of the thread.
+
+    :param tasks: the tasks of the event loop before the script started
+    """
+    if config.ENGINE == 'socket':
+        connection = get_blocking_connection()
+        connection.events.clear()
+        for index, sinks in list(connection.event_sinks.items()):
+            for sink in sinks:
+                connection.remove_event_sink(index, sink)
+        return
+
+    loop = get_event_loop()
+    connection = loop.run_until_complete(get_connection())
+    # cancel the tasks of the script only, the connection keeps its own
+    tasks = asyncio.all_tasks(loop) - tasks - connection.tasks
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks,
+                                               return_exceptions=True))
+
+    for index, sinks in list(connection.event_sinks.items()):
+        for sink in sinks:
+            connection.remove_event_sink(index, sink)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the host')
+    serve.add_argument('--port', type=int, default=config.SCRIPT_HOST_PORT,
+                       help='the localhost port to listen on if there are no '
+                            'Unix sockets')
+    serve.add_argument('--workers', type=int,
+                       default=config.SCRIPT_HOST_WORKERS,
+                       help='the max count of scripts run at once')
+    serve.add_argument('--fork', action='store_true',
+                       help='run every script in a forked process')
+    run = commands.add_parser('submit', help='run a script by the host')
+    run.add_argument('path', help='the script filepath')
+    run.add_argument('args', nargs=argparse.REMAINDER,
+                     help='the script arguments')
+    options = parser.parse_args()
+
+    if options.command == 'submit':
+        return submit(options.path, options.args)
+
+    logging.basicConfig(level=logging.DEBUG if config.DEBUG else logging.INFO)
+    host = ScriptHost(options.port, options.workers, options.fork)
+    try:
+        host.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
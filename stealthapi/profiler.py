@@ -0,0 +1,156 @@
+"""
+This module provides a sampling profiler of script method calls. It attributes
+the wall time of sampled calls to the script lines making them and to the
+Stealth methods, and dumps the result as collapsed stacks which can be turned
+into a flame graph (flamegraph.pl, speedscope, etc.).
+
+:Example:
+>>> from stealthapi.profiler import SamplingProfiler
+>>> with SamplingProfiler(rate=.1) as profiler:
+...     run_my_script()
+>>> profiler.dump('script.collapsed')
+>>> print(profiler.report())
+"""
+
+__all__ = ['SamplingProfiler']
+
+import asyncio
+import collections
+import os
+import random
+import sys
+import threading
+
+from stealthapi.core.commands import METHODS
+from stealthapi.core.interceptors import CallInfo, Interceptor, \
+    add_interceptor, remove_interceptor
+
+# frames of these directories are not a part of script stacks
+_SKIP_DIRS = (os.path.dirname(os.path.abspath(__file__)) + os.sep,
+              os.path.dirname(os.path.abspath(asyncio.__file__)) + os.sep)
+
+_method_names = {spec.index: name for name, spec in METHODS.items()}
+
+
+def _method_name(index: int) -> str:
+    return _method_names.get(index, f'method_{index}')
+
+
+class SamplingProfiler(Interceptor):
+    """Profiles a part of script method calls chosen randomly.
+
+    :param rate: the part of calls to sample, from 0 to 1
+    :param max_depth: the max count of script frames kept for a call
+    """
+
+    rate: float
+    max_depth: int
+
+    calls: int  # count of sampled calls
+    methods: collections.Counter  # method name -> wall time, seconds
+    method_calls: collections.Counter  # method name -> sampled calls
+    lines: collections.Counter  # "file:line" -> wall time, seconds
+    stacks: collections.Counter  # collapsed stack -> wall time, seconds
+
+    _lock: threading.Lock
+
+    def __init__(self, rate: float = 1., max_depth: int = 64) -> None:
+        if not 0 < rate <= 1:
+            raise ValueError('The rate must be greater than 0 and not greater '
+                             'than 1.')
+        self.rate = rate
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __enter__(self) -> 'SamplingProfiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Start profiling script method calls."""
+        add_interceptor(self)
+
+    def stop(self) -> None:
+        """Stop profiling script method calls."""
+        remove_interceptor(self)
+
+    def clear(self) -> None:
+        """Forget all the collected samples."""
+        self.calls = 0
+        self.methods = collections.Counter()
+        self.method_calls = collections.Counter()
+        self.lines = collections.Counter()
+        self.stacks = collections.Counter()
+
+    def before_pack(self, call: CallInfo) -> None:
+        if self.rate < 1 and random.random() >= self.rate:
+            return
+        call.data[self] = self._script_stack()
+
+    def on_response(self, call: CallInfo) -> None:
+        self._add_sample(call)
+
+    def on_error(self, call: CallInfo, error: BaseException) -> None:
+        self._add_sample(call)
+
+    def _script_stack(self) -> tuple[str, ...]:
+        """Return the frames of the script code making the call, root first."""
+        stack = []
+        frame = sys._getframe(2)
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            if not code.co_filename.startswith(_SKIP_DIRS):
+                filename = os.path.basename(code.co_filename)
+                stack.append(f'{code.co_name} ({filename}:{frame.f_lineno})')
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _add_sample(self, call: CallInfo) -> None:
+        stack = call.data.pop(self, None)
+        if stack is None:
+            return  # not sampled
+
+        elapsed = call.elapsed
+        method = _method_name(call.index)
+        collapsed = ';'.join(stack + (method,))
+        with self._lock:
+            self.calls += 1
+            self.methods[method] += elapsed
+            self.method_calls[method] += 1
+            if stack:
+                # "func (file:line)" -> "file:line"
+                self.lines[stack[-1].rsplit('(', 1)[1][:-1]] += elapsed
+            self.stacks[collapsed] += elapsed
+
+    def dump(self, path: str) -> None:
+        """Save the samples as collapsed stacks, values are in microseconds.
+
+        :param path: the filepath of the output file
+        """
+        with self._lock:
+            stacks = list(self.stacks.items())
+        with open(path, 'w') as file:
+            for stack, elapsed in stacks:
+                file.write(f'{stack} {round(elapsed * 1_000_000)}\n')
+
+    def report(self, limit: int = 10) -> str:
+        """Return the methods and script lines taking the most time.
+
+        :param limit: the max count of rows in every table
+        """
+        with self._lock:
+            methods = self.methods.most_common(limit)
+            lines = self.lines.most_common(limit)
+            calls = dict(self.method_calls)
+
+        rows = [f'sampled calls: {self.calls}', '', 'methods:']
+        rows += [f'{elapsed:10.6f}s {calls[name]:8} calls  {name}'
+                 for name, elapsed in methods]
+        rows += ['', 'script lines:']
+        rows += [f'{elapsed:10.6f}s  {line}' for line, elapsed in lines]
+        return '\n'.join(rows)
@@ -0,0 +1,386 @@
+"""
+This module provides the proxy daemon sharing a few connections with Stealth
+between many script processes.
+
+Scripts connect to the proxy over a Unix socket, or over a localhost TCP port
+where there are no Unix sockets, and talk the usual Stealth protocol: set
+PROXY_PATH (or PROXY_PORT) in the config of the scripts. The proxy talks to
+Stealth with the rights of its user, so only that user may connect: the Unix
+socket is accessible by the user only and lies in the directory of the script
+host by default. On a TCP port every client sends a secret token first, the
+proxy writes it to a file readable by the user on start. Every script is
+bound to one of the upstream connections with Stealth, the least loaded one.
+Request ids of scripts are replaced with ids unique within the upstream
+connection and restored in responses. Event subscriptions of the scripts are
+counted: Stealth is asked for an event while at least one script of the
+connection wants it, and every event is sent to the subscribed scripts only.
+Pause and terminate packets are sent to all the scripts of the connection,
+and a script joining a paused connection is paused at once.
+
+If an upstream connection is lost, its scripts are disconnected, so they
+restore their state on reconnection as if they talked to Stealth directly.
+
+:Example:
+    python -m stealthapi.proxy --upstreams 2
+"""
+
+__all__ = ['StealthProxy']
+
+import argparse
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import secrets
+import socket
+import sys
+
+from stealthapi import config
+from stealthapi.core.commands import LANG_VERSION, METHOD_RESPONSE, \
+    PAUSE_SCRIPT, SET_EVENT, TERMINATE_SCRIPT, UNSET_EVENT
+from stealthapi.core.packet import pack_packet, packet_cmd_struct, \
+    packet_header_struct, packet_id_struct, packet_size_struct
+from stealthapi.core.protocol import StealthConnection
+from stealthapi.core.utils import _PROXY_ADDRESS_NAME, get_event_loop
+from stealthapi.submit import _runtime_dir
+
+_SOCKET_NAME = 'proxy.sock'  # the Unix socket file in the runtime directory
+_DEFAULT_PORT = 47611
+
+# the size of the packet header with the request id
+_REQUEST_HEADER_SIZE = packet_header_struct.size + packet_id_struct.size
+
+
+class _Upstream(StealthConnection):
+    """A connection with Stealth shared by proxy clients."""
+
+    clients: set['_ProxyClient']
+    subscribers: dict[int, set['_ProxyClient']]  # event index -> clients
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.clients = set()
+        self.subscribers = {}
+
+    async def connect(self) -> None:
+        # always connect to Stealth, even if the proxy itself is configured
+        await self._connect_stealth()
+
+    def subscribe(self, client: '_ProxyClient', index: int) -> None:
+        """Send events with the given index to the client."""
+        clients = self.subscribers.setdefault(index, set())
+        if not clients:
+            self.subscribe_event(index)
+        clients.add(client)
+
+    def unsubscribe(self, client: '_ProxyClient', index: int) -> None:
+        """Stop sending events with the given index to the client."""
+        clients = self.subscribers.get(index)
+        if not clients or client not in clients:
+            return
+        clients.discard(client)
+        if not clients:
+            del self.subscribers[index]
+            self.unsubscribe_event(index)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        super().connection_lost(exc)
+        # the clients restore their requests and subscriptions themselves
+        for client in list(self.clients):
+            client.close()
+
+    def _handle_event(self, buffer: bytes | bytearray, start: int,
+                      end: int) -> None:
+        """Send the event packet to the subscribed clients."""
+        if start >= end:
+            return
+        clients = self.subscribers.get(buffer[start])
+        if not clients:
+            return
+        packet = bytes(buffer[start - packet_header_struct.size:end])
+        for client in clients:
+            client.write(packet)
+
+    def _handle_pause(self, buffer: bytes | bytearray, start: int,
+                      end: int) -> None:
+        super()._handle_pause(buffer, start, end)
+        self._broadcast(PAUSE_SCRIPT)
+
+    def _handle_terminate(self, buffer: bytes | bytearray, start: int,
+                          end: int) -> None:
+        # the proxy keeps running, the scripts are terminated
+        self._broadcast(TERMINATE_SCRIPT)
+
+    def _broadcast(self, cmd: int) -> None:
+        packet = _command_packet(cmd)
+        for client in self.clients:
+            client.write(packet)
+
+
+def _command_packet(cmd: int) -> bytes:
+    """Form a packet of a command without data, e.g. a pause one."""
+    data = packet_cmd_struct.pack(cmd)
+    return packet_size_struct.pack(len(data)) + data
+
+
+class _ProxyClient(asyncio.Protocol):
+    """A script connected to the proxy."""
+
+    _upstream: _Upstream
+    _transport: asyncio.Transport | None
+    _token: bytes | None  # the token expected first, None - received
+    _buffer: bytearray  # the received data of incomplete packets
+    _requests: dict[int, int]  # upstream request id -> client request id
+    _subscriptions: set[int]  # indexes of events the client wants
+    _logger: logging.Logger
+
+    def __init__(self, upstream: _Upstream, token: bytes | None) -> None:
+        self._upstream = upstream
+        self._transport = None
+        self._token = token
+        self._buffer = bytearray()
+        self._requests = {}
+        self._subscriptions = set()
+        self._logger = logging.getLogger(self.__class__.__name__)
+        # count the client at once, so clients connecting together are
+        # spread over the upstream connections
+        upstream.clients.add(self)
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        self._logger.debug(f'client connected, '
+                           f'{len(self._upstream.clients)} clients')
+        if self._token is None:
+            self._join()
+
+    def _join(self) -> None:
+        """Start talking to the client."""
+        if self._upstream.pause:
+            # the pause packet has been sent before the client joined
+            self.write(_command_packet(PAUSE_SCRIPT))
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._transport = None
+        upstream = self._upstream
+        upstream.clients.discard(self)
+        for index in self._subscriptions:
+            upstream.unsubscribe(self, index)
+        self._subscriptions.clear()
+        # drop the responses nobody waits for anymore
+        for request_id in self._requests:
+            upstream.release_request(request_id)
+        self._requests.clear()
+        self._logger.debug('client disconnected')
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def write(self, data: bytes | bytearray) -> None:
+        if self._transport is not None and self._token is None:
+            self._transport.write(data)
+
+    def data_received(self, data: bytes) -> None:
+        self._buffer += data
+        buffer = self._buffer
+        end = len(buffer)
+        offset = 0
+        if self._token is not None:
+            size = len(self._token)
+            if end < size:
+                return
+            if not hmac.compare_digest(bytes(buffer[:size]), self._token):
+                self._logger.warning('a client with a wrong token')
+                buffer.clear()
+                self.close()
+                return
+            self._token = None
+            offset = size
+            self._join()
+        while end - offset >= _REQUEST_HEADER_SIZE:
+            size, cmd = packet_header_struct.unpack_from(buffer, offset)
+            packet_end = offset + packet_size_struct.size + size
+            if packet_end > end:
+                break  # the packet is not received completely yet
+            self._handle_packet(cmd, buffer, offset, packet_end)
+            offset = packet_end
+        del buffer[:offset]
+
+    def _handle_packet(self, cmd: int, buffer: bytearray, offset: int,
+                       end: int) -> None:
+        upstream = self._upstream
+        start = offset + _REQUEST_HEADER_SIZE
+
+        # the upstream connection has sent its own version already
+        if cmd == LANG_VERSION:
+            return
+
+        # event subscriptions are counted for all the clients
+        if cmd == SET_EVENT or cmd == UNSET_EVENT:
+            if start >= end:
+                return
+            index = buffer[start]
+            if cmd == SET_EVENT:
+                self._subscriptions.add(index)
+                upstream.subscribe(self, index)
+            else:
+                self._subscriptions.discard(index)
+                upstream.unsubscribe(self, index)
+            return
+
+        packet = bytearray(buffer[offset:end])
+        client_id, = packet_id_struct.unpack_from(buffer,
+                                                  packet_header_struct.size
+                                                  + offset)
+        if not client_id:
+            upstream.send(packet)  # no response expected
+            return
+
+        # replace the request id with an upstream one
+        try:
+            request_id, future = upstream.register_request()
+        except RuntimeError as e:
+            self._logger.error(f'Can not forward the request: {e}')
+            self.close()
+            return
+        packet_id_struct.pack_into(packet, packet_header_struct.size,
+                                   request_id)
+        self._requests[request_id] = client_id
+        future.add_done_callback(functools.partial(self._respond, request_id))
+        upstream.send(packet, request_id)
+
+    def _respond(self, request_id: int, future: asyncio.Future) -> None:
+        client_id = self._requests.pop(request_id, None)
+        if client_id is None or future.cancelled():
+            return  # the client has gone
+        self._upstream.release_request(request_id)
+        if future.exception() is not None:
+            # the request is lost, let the client handle it as a reconnection
+            self.close()
+            return
+        self.write(pack_packet(METHOD_RESPONSE, client_id, future.result()))
+
+
+class StealthProxy:
+    """The proxy daemon.
+
+    :param path: the Unix socket path to listen on, the one in the user
+        runtime directory if empty
+    :param port: the localhost port to listen on if there are no Unix sockets
+    :param upstreams: the count of connections with Stealth
+    """
+
+    path: str
+    port: int
+    upstream_count: int
+    upstreams: list[_Upstream]  # created by `start` in the loop thread
+
+    _server: asyncio.AbstractServer | None
+    _address_path: str | None  # the file with the port and token
+    _token: bytes | None  # the secret token of clients, None - not needed
+    _logger: logging.Logger
+
+    def __init__(self, path: str = config.PROXY_PATH,
+                 port: int = config.PROXY_PORT or _DEFAULT_PORT,
+                 upstreams: int = 2) -> None:
+        if upstreams < 1:
+            raise ValueError('There must be at least one upstream connection.')
+        self.path = path
+        self.port = port
+        self.upstream_count = upstreams
+        self.upstreams = []
+        self._server = None
+        self._address_path = None
+        self._token = None
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    async def start(self) -> None:
+        """Connect to Stealth and start accepting scripts."""
+        self.upstreams = [_Upstream() for _ in range(self.upstream_count)]
+        await asyncio.gather(*(upstream.connect()
+                               for upstream in self.upstreams))
+        loop = asyncio.get_running_loop()
+        directory = _runtime_dir(create=True)
+        if hasattr(socket, 'AF_UNIX'):
+            if not self.path:
+                self.path = os.path.join(directory, _SOCKET_NAME)
+            if os.path.exists(self.path):
+                os.unlink(self.path)  # left by a previous run
+            self._server = await loop.create_unix_server(self._accept,
+                                                         self.path)
+            os.chmod(self.path, 0o600)
+            self._logger.info(f'listening on {self.path}')
+            return
+
+        self._server = await loop.create_server(self._accept, 'localhost',
+                                                self.port)
+        port = self._server.sockets[0].getsockname()[1]
+        token = secrets.token_hex(16)
+        self._token = token.encode()
+        self._address_path = os.path.join(directory, _PROXY_ADDRESS_NAME)
+        fd = os.open(self._address_path,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as file:
+            json.dump({'port': port, 'token': token}, file)
+        self._logger.info(f'listening on localhost:{port}')
+
+    async def serve_forever(self) -> None:
+        """Run the proxy until cancelled."""
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Stop accepting scripts and disconnect from Stealth."""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if hasattr(socket, 'AF_UNIX') and os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._address_path is not None:
+            try:
+                os.unlink(self._address_path)
+            except FileNotFoundError:
+                pass
+            self._address_path = None
+        for upstream in self.upstreams:
+            upstream.close()
+
+    def _accept(self) -> _ProxyClient:
+        # bind the client to the upstream connection with the fewest clients,
+        # skip the lost ones: their clients wait until they reconnect
+        upstreams = [upstream for upstream in self.upstreams
+                     if upstream.connected] or self.upstreams
+        upstream = min(upstreams, key=lambda upstream: len(upstream.clients))
+        return _ProxyClient(upstream, self._token)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--path', default=config.PROXY_PATH,
+                        help='the Unix socket path to listen on, a file in '
+                             'the user runtime directory by default')
+    parser.add_argument('--port', type=int,
+                        default=config.PROXY_PORT or _DEFAULT_PORT,
+                        help='the localhost port to listen on if there are '
+                             'no Unix sockets')
+    parser.add_argument('--upstreams', type=int, default=2,
+                        help='the count of connections with Stealth')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if config.DEBUG else logging.INFO)
+    proxy = StealthProxy(options.path, options.port, options.upstreams)
+    try:
+        get_event_loop().run_until_complete(proxy.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
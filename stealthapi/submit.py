@@ -0,0 +1,138 @@
+"""
+This module provides the client of the script host daemon, see
+stealthapi.host.
+
+The module uses the standard library only and does not import the package,
+so run it by its filepath to start a script as fast as possible: importing
+the package takes longer than running most scripts by the host.
+
+On POSIX the host listens on a Unix socket in a directory accessible by the
+user only. Where there are no Unix sockets it listens on a localhost port and
+accepts requests with the secret token only: the host writes its port and
+token to a file in that directory on start.
+
+:Example:
+    python path/to/stealthapi/submit.py my_script.py arg1 arg2
+"""
+
+__all__ = ['submit', 'main']
+
+import io
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+
+_SOCKET_NAME = 'host.sock'  # the Unix socket file of the host
+_ADDRESS_NAME = 'host.json'  # the file with the TCP port and token of the host
+
+
+def _runtime_dir(create: bool = False) -> str:
+    """Return the directory of the host socket, private to the user.
+
+    :param create: create the directory if it does not exist
+    :raises PermissionError: if other users have access to the directory
+    """
+    if hasattr(os, 'getuid'):
+        name = f'stealthapi-{os.getuid()}'
+        root = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    else:
+        # the temporary directory of Windows belongs to the user already
+        name = 'stealthapi'
+        root = tempfile.gettempdir()
+    path = os.path.join(root, name)
+    if create:
+        os.makedirs(path, 0o700, exist_ok=True)
+
+    if hasattr(os, 'getuid') and os.path.exists(path):
+        # somebody else may have created it to catch the requests
+        info = os.lstat(path)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+                info.st_mode & 0o077:
+            raise PermissionError(f'{path} must be a directory accessible by '
+                                  f'its owner only.')
+    return path
+
+
+def _send_message(sock: socket.socket, message: dict) -> None:
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+
+def _receive_message(file: io.BufferedReader) -> dict | None:
+    line = file.readline()
+    return json.loads(line) if line else None
+
+
+def _connect() -> tuple[socket.socket, str | None]:
+    """Connect to the host.
+
+    :return: the socket and the token to send with the request
+    :raises ConnectionRefusedError: if the host is not running
+    """
+    directory = _runtime_dir()
+    if hasattr(socket, 'AF_UNIX'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(os.path.join(directory, _SOCKET_NAME))
+        except FileNotFoundError:
+            sock.close()
+            raise ConnectionRefusedError('The script host is not running.')
+        except OSError:
+            sock.close()
+            raise
+        return sock, None
+
+    try:
+        with open(os.path.join(directory, _ADDRESS_NAME)) as file:
+            address = json.load(file)
+    except FileNotFoundError:
+        raise ConnectionRefusedError('The script host is not running.')
+    sock = socket.create_connection(('127.0.0.1', address['port']))
+    return sock, address['token']
+
+
+def submit(path: str, args: list[str] | tuple[str, ...] = ()) -> int:
+    """Run the script by the host, print its output and return its exit code.
+
+    :param path: the script filepath
+    :param args: the script arguments
+    :raises ConnectionRefusedError: if the host is not running
+    """
+    request = {'path': os.path.abspath(path), 'args': list(args),
+               'cwd': os.getcwd()}
+    sock, token = _connect()
+    if token is not None:
+        request['token'] = token
+    with sock, sock.makefile('rb') as file:
+        _send_message(sock, request)
+        while 42:
+            message = _receive_message(file)
+            if message is None:
+                raise ConnectionResetError('The host has closed the '
+                                           'connection.')
+            if 'stdout' in message:
+                sys.stdout.write(message['stdout'])
+            if 'stderr' in message:
+                sys.stderr.write(message['stderr'])
+            if 'exit' in message:
+                sys.stdout.flush()
+                return message['exit']
+
+
+def main() -> int:
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        sys.stderr.write(f'usage: {os.path.basename(sys.argv[0])} '
+                         f'path [args ...]\n\n'
+                         f'Run a script by the stealthapi script host.\n')
+        return 2
+    try:
+        return submit(sys.argv[1], sys.argv[2:])
+    except ConnectionRefusedError as e:
+        sys.stderr.write(f'{e}\n')
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
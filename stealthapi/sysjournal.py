@@ -11,15 +11,7 @@ clear() -> None
 
 __all__ = ['add', 'clear']
 
-from stealthapi.core.commands import ADD_TO_SYSTEM_JOURNAL, \
-    CLEAR_SYSTEM_JOURNAL
-from stealthapi.core.scriptmethod import ScriptMethod
-from stealthapi.core.datatypes import *
-
-_add_to_system_journal = ScriptMethod(ADD_TO_SYSTEM_JOURNAL)
-_add_to_system_journal.argtypes = [Str]
-
-_clear_system_journal = ScriptMethod(CLEAR_SYSTEM_JOURNAL)
+from stealthapi.core import methods
 
 
 def add(*args: any, sep: str = ', ', **kwargs: any) -> None:
@@ -36,7 +28,8 @@ def add(*args: any, sep: str = ', ', **kwargs: any) -> None:
     """
     args_ = sep.join((str(arg) for arg in args))
     kwargs_ = sep.join((f'{key}={value}' for key, value in kwargs.items()))
-    _add_to_system_journal(args_ + (sep if args_ and kwargs_ else '') + kwargs_)
+    text = args_ + (sep if args_ and kwargs_ else '') + kwargs_
+    methods.add_to_system_journal(text)
 
 
 def clear() -> None:
@@ -46,4 +39,4 @@ def clear() -> None:
     >>> from stealthapi import sysjournal
     >>> sysjournal.clear()
     """
-    _clear_system_journal()
+    methods.clear_system_journal()
@@ -0,0 +1,403 @@
+"""
+This module provides an optional client-side mirror of the world objects.
+
+Scripts fill the mirror with object properties they have got from Stealth,
+and then read them locally instead of asking Stealth again. The mirror
+listens to events: ItemInfoEvent marks an object as stale, because its
+properties have changed since the last update, and ItemDeleted evicts it.
+Every object has the `fresh` flag telling whether it is in sync with the
+events or needs a refresh call.
+
+Objects are indexed by id, type and container. Objects lying on the ground
+are indexed by a grid of coordinates too, for range and nearest-neighbour
+queries. Distances are measured as in UO: max(|dx|, |dy|).
+
+:Example:
+>>> from stealthapi.world import World
+>>> with World(refresh=get_item_properties) as world:
+...     world.update(item_id, type=0x0EED, container=backpack_id)
+...     gold = world.by_type(0x0EED)
+...     ore = world.nearest(x, y, type=0x19B9, max_distance=10)
+"""
+
+__all__ = ['WorldObject', 'World']
+
+import itertools
+import time
+from typing import Callable, Iterator, Mapping
+
+from stealthapi.events import ItemDeleted, ItemInfoEvent
+
+# the properties kept as attributes of WorldObject and used by the indexes
+_INDEXED = ('type', 'container', 'x', 'y', 'z')
+
+_Refresh = Callable[[int], Mapping[str, object] | None]
+_Cell = tuple[int, int]  # grid cell X and Y
+
+
+class WorldObject:
+    """A mirrored object. Properties other than the indexed ones are kept in
+    `props`."""
+
+    __slots__ = ('id', 'type', 'container', 'x', 'y', 'z', 'props', 'fresh',
+                 'updated')
+
+    id: int
+    type: int | None
+    container: int | None  # the id of the container, 0 - lies on the ground
+    x: int | None
+    y: int | None
+    z: int | None
+    props: dict[str, object]
+    fresh: bool  # False if the object has changed since the last update
+    updated: float  # time.monotonic() value of the last update
+
+    def __init__(self, id: int) -> None:
+        self.id = id
+        self.type = self.container = self.x = self.y = self.z = None
+        self.props = {}
+        self.fresh = False
+        self.updated = 0.
+
+    def __repr__(self) -> str:
+        state = 'fresh' if self.fresh else 'stale'
+        return (f'{self.__class__.__name__}(id={self.id:#x}, '
+                f'type={self.type}, container={self.container}, '
+                f'x={self.x}, y={self.y}, {state})')
+
+    @property
+    def on_ground(self) -> bool:
+        return not self.container and self.x is not None and \
+            self.y is not None
+
+
+class World:
+    """A mirror of the world objects maintained from events.
+
+    :param refresh: called with an object id when a stale object is read,
+        returns a mapping of the object properties or None if there is no
+        such object anymore
+    :param cell_size: the side of a spatial grid cell in tiles
+    """
+
+    refresh: _Refresh | None
+    cell_size: int
+
+    hits: int  # count of reads served by fresh objects
+    misses: int  # count of reads of stale or unknown objects
+
+    _objects: dict[int, WorldObject]  # id -> object
+    _by_type: dict[int, set[int]]  # type -> ids
+    _by_container: dict[int, set[int]]  # container id -> ids
+    _grid: dict[tuple[int, int], set[int]]  # cell -> ids of ground objects
+    # min and max X and Y of the occupied cells, None - not known
+    _bounds: tuple[int, int, int, int] | None
+    _started: bool
+
+    def __init__(self, refresh: _Refresh | None = None,
+                 cell_size: int = 16) -> None:
+        if cell_size < 1:
+            raise ValueError('The cell size must be at least 1.')
+        self.refresh = refresh
+        self.cell_size = cell_size
+        self.hits = self.misses = 0
+        self._objects = {}
+        self._by_type = {}
+        self._by_container = {}
+        self._grid = {}
+        self._bounds = None
+        self._started = False
+
+    def __enter__(self) -> 'World':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._objects
+
+    def __iter__(self) -> Iterator[WorldObject]:
+        return iter(list(self._objects.values()))
+
+    def start(self) -> None:
+        """Start following the item events.
+
+        In a coroutine the connection of the running event loop must exist
+        already, e.g. after a method call.
+        """
+        if self._started:
+            return
+        ItemInfoEvent.set(self._on_item_info)
+        ItemDeleted.set(self._on_item_deleted)
+        self._started = True
+
+    def stop(self) -> None:
+        """Stop following the item events. The objects become stale."""
+        if not self._started:
+            return
+        ItemInfoEvent.unset(self._on_item_info)
+        ItemDeleted.unset(self._on_item_deleted)
+        self._started = False
+        for obj in self._objects.values():
+            obj.fresh = False
+
+    def clear(self) -> None:
+        """Forget all the objects."""
+        self._objects.clear()
+        self._by_type.clear()
+        self._by_container.clear()
+        self._grid.clear()
+        self._bounds = None
+
+    def update(self, id: int, **props) -> WorldObject:
+        """Store properties of the object and mark it as fresh.
+
+        :param id: the object id
+        :param props: property values, `type`, `container`, `x`, `y` and `z`
+            are indexed
+        :return: the updated object
+        """
+        obj = self._objects.get(id)
+        if obj is None:
+            obj = self._objects[id] = WorldObject(id)
+        else:
+            self._unindex(obj)
+        for name, value in props.items():
+            if name in _INDEXED:
+                setattr(obj, name, value)
+            else:
+                obj.props[name] = value
+        obj.fresh = self._started
+        obj.updated = time.monotonic()
+        self._index(obj)
+        return obj
+
+    def remove(self, id: int) -> None:
+        """Forget the object if it is known."""
+        obj = self._objects.pop(id, None)
+        if obj is not None:
+            self._unindex(obj)
+
+    def invalidate(self, id: int) -> None:
+        """Mark the object as stale, it is refreshed on the next read."""
+        obj = self._objects.get(id)
+        if obj is not None:
+            obj.fresh = False
+
+    def get(self, id: int, refresh: bool = True) -> WorldObject | None:
+        """Return the object with the given id.
+
+        :param id: the object id
+        :param refresh: refresh the object if it is stale or unknown and
+            there is a refresh function
+        :return: the object or None if it is unknown
+        """
+        obj = self._objects.get(id)
+        if obj is not None and obj.fresh:
+            self.hits += 1
+            return obj
+        self.misses += 1
+        if refresh and self.refresh is not None:
+            return self._refresh(id)
+        return obj
+
+    def by_type(self, type: int) -> list[WorldObject]:
+        """Return the known objects of the given type."""
+        return self._select(self._by_type.get(type, ()))
+
+    def in_container(self, container: int,
+                     type: int | None = None) -> list[WorldObject]:
+        """Return the known objects in the given container.
+
+        :param container: the container id
+        :param type: return only objects of this type
+        """
+        return self._select(self._by_container.get(container, ()), type)
+
+    def in_range(self, x: int, y: int, distance: int,
+                 type: int | None = None) -> list[WorldObject]:
+        """Return the objects on the ground within the distance of the point,
+        the nearest first.
+
+        :param x: the point X coordinate
+        :param y: the point Y coordinate
+        :param distance: the max distance in tiles
+        :param type: return only objects of this type
+        """
+        found = []
+        for obj in self._cells_objects(x, y, distance // self.cell_size + 1):
+            d = max(abs(obj.x - x), abs(obj.y - y))
+            if d <= distance and (type is None or obj.type == type):
+                found.append((d, obj))
+        found.sort(key=lambda item: item[0])
+        return [obj for _, obj in found]
+
+    def nearest(self, x: int, y: int, type: int | None = None,
+                max_distance: int | None = None) -> WorldObject | None:
+        """Return the object on the ground nearest to the point.
+
+        :param x: the point X coordinate
+        :param y: the point Y coordinate
+        :param type: look only for objects of this type
+        :param max_distance: the max distance in tiles, None - no limit
+        :return: the object or None if there is no such object
+        """
+        if not self._grid:
+            return None
+        cx, cy = x // self.cell_size, y // self.cell_size
+        # the ring radius at which every occupied cell has been scanned
+        min_i, min_j, max_i, max_j = self._grid_bounds()
+        last_ring = max(cx - min_i, max_i - cx, cy - min_j, max_j - cy)
+        if max_distance is not None:
+            last_ring = min(last_ring, max_distance // self.cell_size + 1)
+
+        best, best_distance = None, None
+        for ring, cell in self._cells_by_ring(cx, cy, last_ring):
+            # objects in further rings are at least this far away
+            if best is not None and \
+                    best_distance <= (ring - 1) * self.cell_size:
+                break
+            for id in self._grid[cell]:
+                obj = self._objects[id]
+                if type is not None and obj.type != type:
+                    continue
+                d = max(abs(obj.x - x), abs(obj.y - y))
+                if max_distance is not None and d > max_distance:
+                    continue
+                if best is None or d < best_distance:
+                    best, best_distance = obj, d
+        return best
+
+    def stats(self) -> dict[str, int]:
+        """Return count of objects and reads."""
+        return {
+            'objects': len(self._objects),
+            'fresh': sum(obj.fresh for obj in self._objects.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def _refresh(self, id: int) -> WorldObject | None:
+        props = self.refresh(id)
+        if props is None:
+            self.remove(id)
+            return None
+        return self.update(id, **props)
+
+    def _select(self, ids, type: int | None = None) -> list[WorldObject]:
+        objects = [self._objects[id] for id in ids]
+        if type is not None:
+            objects = [obj for obj in objects if obj.type == type]
+        return objects
+
+    def _cell(self, obj: WorldObject) -> tuple[int, int]:
+        return obj.x // self.cell_size, obj.y // self.cell_size
+
+    def _cells_objects(self, x: int, y: int,
+                       radius: int) -> Iterator[WorldObject]:
+        """Yield the objects of the cells around the point."""
+        if not self._grid:
+            return
+        cx, cy = x // self.cell_size, y // self.cell_size
+        # the cells outside the occupied bounds are empty
+        min_i, min_j, max_i, max_j = self._grid_bounds()
+        min_i, max_i = max(min_i, cx - radius), min(max_i, cx + radius)
+        min_j, max_j = max(min_j, cy - radius), min(max_j, cy + radius)
+        if min_i > max_i or min_j > max_j:
+            return
+        if (max_i - min_i + 1) * (max_j - min_j + 1) > len(self._grid):
+            # checking the occupied cells is cheaper than walking empty ones
+            cells = [(i, j) for i, j in self._grid
+                     if min_i <= i <= max_i and min_j <= j <= max_j]
+        else:
+            cells = itertools.product(range(min_i, max_i + 1),
+                                      range(min_j, max_j + 1))
+        for cell in cells:
+            for id in self._grid.get(cell, ()):
+                yield self._objects[id]
+
+    def _cells_by_ring(self, cx: int, cy: int,
+                       last_ring: int) -> Iterator[tuple[int, _Cell]]:
+        """Yield the occupied cells up to `last_ring` cells away with their
+        ring radius, the nearest rings first."""
+        for ring in range(last_ring + 1):
+            if (2 * ring + 1) ** 2 > len(self._grid):
+                # the rest of the rings is sparse, sorting the occupied cells
+                # is cheaper than walking the empty ones
+                rest = []
+                for cell in self._grid:
+                    r = max(abs(cell[0] - cx), abs(cell[1] - cy))
+                    if ring <= r <= last_ring:
+                        rest.append((r, cell))
+                rest.sort()
+                yield from rest
+                return
+            if ring == 0:
+                cells = [(cx, cy)]
+            else:
+                cells = [(i, j) for i in range(cx - ring, cx + ring + 1)
+                         for j in (cy - ring, cy + ring)]
+                cells += [(i, j) for i in (cx - ring, cx + ring)
+                          for j in range(cy - ring + 1, cy + ring)]
+            for cell in cells:
+                if cell in self._grid:
+                    yield ring, cell
+
+    def _grid_bounds(self) -> tuple[int, int, int, int]:
+        """Return the min and max X and Y of the occupied cells."""
+        if self._bounds is None:
+            xs = [i for i, _ in self._grid]
+            ys = [j for _, j in self._grid]
+            self._bounds = min(xs), min(ys), max(xs), max(ys)
+        return self._bounds
+
+    def _index(self, obj: WorldObject) -> None:
+        if obj.type is not None:
+            self._by_type.setdefault(obj.type, set()).add(obj.id)
+        if obj.container:
+            self._by_container.setdefault(obj.container, set()).add(obj.id)
+        if obj.on_ground:
+            cell = self._cell(obj)
+            ids = self._grid.get(cell)
+            if ids is None:
+                ids = self._grid[cell] = set()
+                if self._bounds is not None:
+                    min_i, min_j, max_i, max_j = self._bounds
+                    i, j = cell
+                    self._bounds = (min(min_i, i), min(min_j, j),
+                                    max(max_i, i), max(max_j, j))
+            ids.add(obj.id)
+
+    def _unindex(self, obj: WorldObject) -> None:
+        if obj.type is not None:
+            self._discard(self._by_type, obj.type, obj.id)
+        if obj.container:
+            self._discard(self._by_container, obj.container, obj.id)
+        if obj.on_ground:
+            cell = self._cell(obj)
+            self._discard(self._grid, cell, obj.id)
+            if cell not in self._grid and self._bounds is not None:
+                min_i, min_j, max_i, max_j = self._bounds
+                if cell[0] in (min_i, max_i) or cell[1] in (min_j, max_j):
+                    # a boundary cell is empty, find the bounds when needed
+                    self._bounds = None
+
+    @staticmethod
+    def _discard(index: dict, key, id: int) -> None:
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del index[key]
+
+    def _on_item_info(self, event: ItemInfoEvent) -> None:
+        # the properties have changed, but the event does not carry them
+        self.invalidate(event.item_id)
+
+    def _on_item_deleted(self, event: ItemDeleted) -> None:
+        self.remove(event.item_id)
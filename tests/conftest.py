@@ -0,0 +1,113 @@
+"""Common fixtures: fake Stealth servers for connection tests."""
+
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from stealthapi.core import blocking, protocol
+from stealthapi.core.datatypes import DataTypeBase
+from stealthapi.core.eventdecoder import EVENT_ARG_TYPES
+
+_header_struct = struct.Struct('<I2H')  # size, command and request id
+
+
+def response_packet(request_id: int, data: bytes = b'') -> bytes:
+    """Form a method response packet sent by Stealth."""
+    payload = struct.pack('<2H', 1, request_id) + data
+    return struct.pack('<I', len(payload)) + payload
+
+
+def event_packet(index: int, *args: DataTypeBase) -> bytes:
+    """Form an event packet sent by Stealth."""
+    codes = {type_: code for code, type_ in EVENT_ARG_TYPES.items()}
+    data = bytes((index, len(args))) + b''.join(
+        bytes((codes[type(arg)],)) + arg.pack() for arg in args)
+    payload = struct.pack('<H', 3) + data
+    return struct.pack('<I', len(payload)) + payload
+
+
+class FakeStealth:
+    """A method server talking the Stealth protocol in the current loop.
+
+    Every received packet is stored as (command, request id, data) and passed
+    to `answer`, which returns the response packet or None.
+    """
+
+    def __init__(self) -> None:
+        self.answer = lambda cmd, request_id, data: None
+        self.received = []
+        self.connections = 0  # count of accepted connections
+        self.port = 0
+        self._server = None
+        self._writers = []
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1',
+                                                  self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """Stop accepting connections and drop the accepted ones."""
+        self._server.close()
+        await self._server.wait_closed()
+        self.drop()
+
+    def drop(self) -> None:
+        """Drop the accepted connections."""
+        for writer in self._writers:
+            writer.transport.abort()
+        self._writers.clear()
+
+    async def get_port(self) -> int:
+        return self.port
+
+    def write(self, data: bytes) -> None:
+        """Send the data through the last accepted connection."""
+        self._writers[-1].write(data)
+
+    async def wait_for(self, cmd: int, count: int = 1) -> list[tuple]:
+        """Wait until `count` packets of the command are received."""
+        while 42:
+            packets = [packet for packet in self.received if packet[0] == cmd]
+            if len(packets) >= count:
+                return packets
+            await asyncio.sleep(.005)
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.append(writer)
+        try:
+            while 42:
+                header = await reader.readexactly(_header_struct.size)
+                size, cmd, request_id = _header_struct.unpack(header)
+                data = await reader.readexactly(size - 4)
+                self.received.append((cmd, request_id, data))
+                answer = self.answer(cmd, request_id, data)
+                if answer is not None:
+                    writer.write(answer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+
+@pytest.fixture
+def stealth(monkeypatch) -> FakeStealth:
+    """A fake Stealth the connections made by the test connect to."""
+    fake = FakeStealth()
+    monkeypatch.setattr(protocol, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(protocol, 'get_connection_port', fake.get_port)
+    monkeypatch.setattr(protocol, 'RECONNECT_DELAY', .01)
+    return fake
+
+
+@pytest.fixture
+def server(monkeypatch) -> socket.socket:
+    """A listening socket the blocking connections connect to."""
+    with socket.create_server(('127.0.0.1', 0)) as sock:
+        port = sock.getsockname()[1]
+        monkeypatch.setattr(blocking, 'HOST', '127.0.0.1')
+        monkeypatch.setattr(blocking, 'get_connection_port_blocking',
+                            lambda: port)
+        yield sock
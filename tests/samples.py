@@ -0,0 +1,30 @@
+"""Random sample values and packed runs shared by the tests and the
+benchmarks."""
+
+import datetime
+import random
+
+from stealthapi.core.columns import _DELPHI_EPOCH, _count_struct
+from stealthapi.core.datatypes import DataTypeBase
+
+
+def random_datetime(rnd: random.Random) -> datetime.datetime:
+    """Return a date within 200 years after the Delphi epoch."""
+    seconds = rnd.uniform(0, 200 * 365 * 86400)
+    return _DELPHI_EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def same_datetime(a: datetime.datetime, b: datetime.datetime) -> bool:
+    """Compare dates with the precision of a Delphi double."""
+    # a double keeps days with ~15 significant digits: microseconds for the
+    # dates we need, allow a few of them
+    return abs(a - b) <= datetime.timedelta(microseconds=10)
+
+
+def pack_records(fields: tuple[type[DataTypeBase], ...],
+                 records: list[tuple]) -> bytes:
+    """Pack the records as Stealth sends them: the count, then the fields
+    of every record."""
+    return _count_struct.pack(len(records)) + b''.join(
+        type_(value).pack()
+        for record in records for type_, value in zip(fields, record))
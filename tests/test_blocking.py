@@ -0,0 +1,75 @@
+"""Tests of the blocking socket connection."""
+
+import socket
+import threading
+import time
+
+import pytest
+
+from stealthapi.core import blocking
+from stealthapi.core.blocking import BlockingConnection
+
+from conftest import event_packet, response_packet
+
+
+def test_receive_events(server):
+    connection = BlockingConnection()
+    client, _ = server.accept()
+    with client:
+        assert connection.receive_events() == []
+
+        client.sendall(event_packet(1) + event_packet(2))
+        assert connection.receive_events(.1) == [b'\x01\x00', b'\x02\x00']
+        assert connection.receive_events() == []
+    connection.close()
+
+
+def test_events_queue_limited(server):
+    connection = BlockingConnection()
+    client, _ = server.accept()
+    with client:
+        client.sendall(b''.join(event_packet(i % 256)
+                                for i in range(blocking._MAX_EVENTS + 10)))
+        events = connection.receive_events(.2)
+        assert len(events) == blocking._MAX_EVENTS
+        assert events[0] == b'\x0a\x00'
+    connection.close()
+
+
+def test_timeout_set_once(server, monkeypatch):
+    timeouts = []
+    settimeout = socket.socket.settimeout
+    monkeypatch.setattr(socket.socket, 'settimeout', lambda self, value:
+                        timeouts.append(value) or settimeout(self, value))
+    connection = BlockingConnection()
+    client, _ = server.accept()
+    with client:
+        for request_id in range(1, 11):
+            connection.send(b'request')
+            client.sendall(response_packet(request_id, b'x'))
+            deadline = time.monotonic() + 30
+            assert connection.wait_response(request_id, deadline) == b'x'
+    assert len(timeouts) == 1
+    connection.close()
+
+
+def test_deadline_kept(server):
+    connection = BlockingConnection()
+    client, _ = server.accept()
+    with client:
+        # a long timeout is cut for a close deadline
+        client.sendall(response_packet(1, b'x'))
+        connection.wait_response(1, time.monotonic() + 30)
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            connection.wait_response(2, start + .05)
+        assert time.monotonic() - start < 1
+
+        # a short timeout is extended for a far deadline
+        connection.receive_events()
+        timer = threading.Timer(.05, client.sendall,
+                                (response_packet(3, b'y'),))
+        timer.start()
+        assert connection.wait_response(3, time.monotonic() + 5) == b'y'
+        timer.join()
+    connection.close()
@@ -0,0 +1,112 @@
+"""Tests of the coalescing of outgoing packets."""
+
+import asyncio
+import socket
+
+from stealthapi.core import protocol
+from stealthapi.core.commands import ADD_TO_SYSTEM_JOURNAL
+from stealthapi.core.packet import pack_packet
+from stealthapi.core.protocol import StealthConnection
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def _connect(stealth) -> tuple[StealthConnection, list[int]]:
+    """Connect to Stealth and count the packets of every transport write."""
+    await stealth.start()
+    connection = StealthConnection()
+    await connection.connect()
+    writes = []
+    writelines = connection._transport.writelines
+    connection._transport.writelines = lambda data: \
+        writes.append(len(data)) or writelines(data)
+    return connection, writes
+
+
+def _send(connection: StealthConnection, count: int) -> None:
+    for i in range(count):
+        connection.send(pack_packet(ADD_TO_SYSTEM_JOURNAL, 0, bytes((i,))))
+
+
+def test_packets_sent_in_one_write(stealth):
+    async def main():
+        connection, writes = await _connect(stealth)
+        flushes = connection.flush_count
+        _send(connection, 10)
+        assert writes == []  # written at the end of the loop iteration
+
+        packets = await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL, 10)
+        assert [data for _, _, data in packets] == \
+            [bytes((i,)) for i in range(10)]
+        assert writes == [10]
+        assert connection.flush_count == flushes + 1
+        assert connection.flushed_packets >= 10
+        assert connection.packets_per_flush > 1
+        connection.close()
+
+    _run(main())
+
+
+def test_flushed_at_packets_threshold(stealth, monkeypatch):
+    monkeypatch.setattr(protocol, 'FLUSH_MAX_PACKETS', 4)
+
+    async def main():
+        connection, writes = await _connect(stealth)
+        _send(connection, 10)
+        assert writes == [4, 4]
+        await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL, 10)
+        assert writes == [4, 4, 2]
+        connection.close()
+
+    _run(main())
+
+
+def test_flushed_at_bytes_threshold(stealth, monkeypatch):
+    packet_size = len(pack_packet(ADD_TO_SYSTEM_JOURNAL, 0, b'\0'))
+    monkeypatch.setattr(protocol, 'FLUSH_MAX_BYTES', packet_size * 3)
+
+    async def main():
+        connection, writes = await _connect(stealth)
+        _send(connection, 7)
+        assert writes == [3, 3]
+        await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL, 7)
+        assert writes == [3, 3, 1]
+        connection.close()
+
+    _run(main())
+
+
+def test_tcp_nodelay(stealth, monkeypatch):
+    async def nodelay() -> int:
+        connection = StealthConnection()
+        await connection.connect()
+        sock = connection._transport.get_extra_info('socket')
+        value = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        connection.close()
+        return value
+
+    async def main():
+        await stealth.start()
+        monkeypatch.setattr(protocol, 'TCP_NODELAY', True)
+        assert await nodelay()
+        monkeypatch.setattr(protocol, 'TCP_NODELAY', False)
+        assert not await nodelay()
+
+    _run(main())
+
+
+def test_packets_not_formatted_without_debug(stealth, monkeypatch):
+    formatted = []
+    monkeypatch.setattr(protocol, 'DEBUG', False)
+    monkeypatch.setattr(protocol, 'format_packet', formatted.append)
+
+    async def main():
+        connection, _ = await _connect(stealth)
+        _send(connection, 3)
+        await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL, 3)
+        connection.close()
+
+    _run(main())
+    assert formatted == []
@@ -0,0 +1,79 @@
+"""Tests of the bulk column decoders and of DateTime packing."""
+
+import datetime
+import random
+import struct
+
+import pytest
+
+from stealthapi.config import ENDIAN
+from stealthapi.core.columns import _DELPHI_EPOCH, _count_struct, \
+    DateTimeColumn, unpack_column, unpack_records
+from stealthapi.core.datatypes import *
+
+from samples import pack_records, random_datetime, same_datetime
+
+COUNT = 1000  # count of random values per column
+
+_UNIX_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def test_unpack_records():
+    fields = (DateTime, UInt, Short)
+    rnd = random.Random(0)
+    records = [(random_datetime(rnd), rnd.randint(0, 2 ** 32 - 1),
+                rnd.randint(-2 ** 15, 2 ** 15 - 1)) for _ in range(COUNT)]
+    data = pack_records(fields, records)
+
+    columns = unpack_records(data, fields)
+    for i, record in enumerate(records):
+        assert same_datetime(columns[0][i], record[0])
+        assert (columns[1][i], columns[2][i]) == record[1:]
+
+    # an explicit count and an offset
+    columns = unpack_records(data, fields, _count_struct.size, 10)
+    assert list(columns[1]) == [record[1] for record in records[:10]]
+    assert all(len(column) == 0
+               for column in unpack_records(_count_struct.pack(0), fields))
+
+
+def test_unpack_column():
+    rnd = random.Random(0)
+    values = [rnd.randint(-2 ** 31, 2 ** 31 - 1) for _ in range(COUNT)]
+    data = pack_records((Int,), [(value,) for value in values])
+    column, end = unpack_column(Int, data)
+    assert list(column) == values
+    assert end == len(data)
+
+
+def test_unpack_column_errors():
+    with pytest.raises(ValueError):
+        unpack_column(UInt, _count_struct.pack(2) + UInt(1).pack())
+    with pytest.raises(TypeError):
+        unpack_column(Str, _count_struct.pack(0))
+
+
+def test_datetime_column():
+    rnd = random.Random(0)
+    dates = [random_datetime(rnd) for _ in range(COUNT)]
+    data = b''.join(DateTime(date).pack() for date in dates)
+    column, _ = unpack_column(DateTime, data, count=COUNT)
+    assert isinstance(column, DateTimeColumn)
+    assert len(column) == COUNT
+
+    assert all(same_datetime(a, b) for a, b in zip(column, dates))
+    assert all(same_datetime(a, b)
+               for a, b in zip(column.datetimes(), dates))
+    assert same_datetime(column[5], dates[5])
+    for timestamp, date in zip(column.epoch(), dates):
+        assert abs(timestamp - (date - _UNIX_EPOCH).total_seconds()) < 1e-4
+
+
+def test_datetime_pack():
+    # days are counted from the whole delta, without separately rounded
+    # parts
+    date = _DELPHI_EPOCH + datetime.timedelta(days=1, hours=6)
+    assert DateTime(date).pack() == struct.pack(ENDIAN + 'd', 1.25)
+    date = datetime.datetime(2024, 2, 29, 23, 59, 59, 999999)
+    assert same_datetime(DateTime.unpack_from(DateTime(date).pack()).value,
+                          date)
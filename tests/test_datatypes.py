@@ -0,0 +1,108 @@
+"""Round-trip tests of the datatype codecs on seeded random values.
+
+A packed value must be unpacked back to itself, or to what Stealth would
+store: unsigned values < 0 become the max value, floats lose precision and
+DateTime is exact up to the precision of a Delphi double.
+"""
+
+import random
+import struct
+
+import pytest
+
+from stealthapi.core.datatypes import *
+from stealthapi.core.scriptmethod import _compile_packer
+
+from samples import random_datetime, same_datetime
+
+COUNT = 1000  # count of random values checked per type
+
+
+
+def _int_range(fmt: str) -> tuple[int, int]:
+    bits = struct.calcsize(fmt) * 8
+    if fmt.isupper():
+        return 0, 2 ** bits - 1
+    return -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+
+def _random_int(rnd: random.Random, fmt: str) -> int:
+    low, high = _int_range(fmt)
+    # bounds and small values are more interesting than uniform ones
+    return rnd.choice((low, high, 0, 1, rnd.randint(low, high),
+                       rnd.randint(max(low, -1000), min(high, 1000))))
+
+
+def _random_unsigned(rnd: random.Random, fmt: str) -> int:
+    # negative values are allowed for unsigned types, they become max value
+    return rnd.choice((_random_int(rnd, fmt), -1, -rnd.randint(1, 1000)))
+
+
+def _random_float(rnd: random.Random) -> float:
+    return rnd.choice((0., -0., 1.5, rnd.uniform(-1e6, 1e6),
+                       rnd.uniform(-1, 1)))
+
+
+def _random_str(rnd: random.Random) -> str:
+    alphabet = 'abcXYZ 019_жыé中\U0001f600'
+    return ''.join(rnd.choice(alphabet)
+                   for _ in range(rnd.choice((0, 1, 5, 50, 300))))
+
+
+def _unsigned(fmt: str):
+    return lambda value: _int_range(fmt)[1] if value < 0 else value
+
+
+def _float32(value: float) -> float:
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+# type -> (random value factory, expected unpacked value)
+ROUNDTRIP_CASES = {
+    Bool: (lambda rnd: rnd.choice((True, False)), None),
+    Char: (lambda rnd: bytes([rnd.randint(0, 255)]), None),
+    Byte: (lambda rnd: _random_int(rnd, 'b'), None),
+    UByte: (lambda rnd: _random_unsigned(rnd, 'B'), _unsigned('B')),
+    Short: (lambda rnd: _random_int(rnd, 'h'), None),
+    UShort: (lambda rnd: _random_unsigned(rnd, 'H'), _unsigned('H')),
+    Int: (lambda rnd: _random_int(rnd, 'i'), None),
+    UInt: (lambda rnd: _random_unsigned(rnd, 'I'), _unsigned('I')),
+    Long: (lambda rnd: _random_int(rnd, 'q'), None),
+    ULong: (lambda rnd: _random_unsigned(rnd, 'Q'), _unsigned('Q')),
+    Float: (_random_float, _float32),
+    Double: (_random_float, None),
+    Str: (_random_str, None),
+    Buffer: (lambda rnd: rnd.randbytes(rnd.randint(0, 100)), None),
+    DateTime: (random_datetime, None),
+}
+
+
+@pytest.mark.parametrize('type_', ROUNDTRIP_CASES,
+                         ids=lambda type_: type_.__name__)
+def test_roundtrip(type_):
+    factory, expected = ROUNDTRIP_CASES[type_]
+    rnd = random.Random(type_.__name__)
+    for _ in range(COUNT):
+        value = factory(rnd)
+        want = expected(value) if expected else value
+        data = type_(value).pack()
+        assert len(data) == type_(value).size, value
+        # unpack with an offset to check offsets are respected
+        got = type_.unpack_from(b'\0\0\0' + data, 3).value
+        if type_ is DateTime:
+            assert same_datetime(got, want), value
+        else:
+            assert got == want, value
+
+
+def test_compiled_packer():
+    argtypes = (UShort, UShort, Byte, UInt)
+    packer = _compile_packer(argtypes)
+    rnd = random.Random(0)
+    for _ in range(COUNT):
+        args = (_random_unsigned(rnd, 'H'), _random_unsigned(rnd, 'H'),
+                _random_int(rnd, 'b'), _random_unsigned(rnd, 'I'))
+        assert packer(args) == b''.join(type_(value).pack()
+                                        for type_, value in zip(argtypes,
+                                                                args))
+
@@ -0,0 +1,144 @@
+"""Tests of event sinks, filters and the events of the socket engine."""
+
+import asyncio
+import logging
+import threading
+
+import pytest
+
+from stealthapi import events
+from stealthapi.core import eventdecoder
+from stealthapi.core.blocking import BlockingConnection
+from stealthapi.core.commands import SET_EVENT, UNSET_EVENT
+from stealthapi.core.connection_container import _disconnect, \
+    drop_blocking_connection, get_blocking_connection
+from stealthapi.core.datatypes import Str, UInt
+from stealthapi.core.eventdecoder import dispatch_event
+from stealthapi.core.packet import lang_version_packet, pack_packet
+
+from conftest import event_packet
+
+_logger = logging.getLogger(__name__)
+
+
+def _speech(sender_name: str) -> bytes:
+    packet = event_packet(events.Speech._index, Str('hi'), Str(sender_name),
+                          UInt(7))
+    return packet[6:]  # the event data after the size and the command
+
+
+def test_mapping_filter_checked_before_decoding(monkeypatch):
+    decoded = []
+    decode = eventdecoder.decode_event_args
+    monkeypatch.setattr(eventdecoder, 'decode_event_args',
+                        lambda *args: decoded.append(1) or decode(*args))
+    received = []
+    sink = events.Speech._sink(received.append, {'sender_name': 'Bob'})
+
+    dispatch_event(_speech('Alice'), (sink,), _logger)
+    assert received == [] and decoded == []
+
+    dispatch_event(_speech('Bob'), (sink,), _logger)
+    assert decoded == [1]
+    event, = received
+    assert (event.text, event.sender_name, event.sender_id) == \
+        ('hi', 'Bob', 7)
+
+
+def test_function_filter():
+    received = []
+    sink = events.Speech._sink(received.append,
+                               lambda text, name, id: name.startswith('B'))
+    for name in ('Alice', 'Bob', 'Ben'):
+        dispatch_event(_speech(name), (sink,), _logger)
+    assert [event.sender_name for event in received] == ['Bob', 'Ben']
+
+
+def test_socket_engine_handlers(server, monkeypatch):
+    monkeypatch.setattr(events, 'ENGINE', 'socket')
+    connection = BlockingConnection()
+    monkeypatch.setattr(events, 'get_blocking_connection', lambda: connection)
+    client, _ = server.accept()
+    with client:
+        received = []
+        events.Speech.set(received.append)
+        client.sendall(event_packet(events.Speech._index, Str('hi'),
+                                    Str('Bob'), UInt(7)))
+        assert connection.receive_events(.1) == []
+        assert [event.sender_name for event in received] == ['Bob']
+        events.Speech.unset(received.append)
+
+        index = bytes((events.Speech._index,))
+        expected = lang_version_packet + pack_packet(SET_EVENT, 0, index) \
+            + pack_packet(UNSET_EVENT, 0, index)
+        data = b''
+        while len(data) < len(expected):
+            data += client.recv(1024)
+        assert data == expected
+    connection.close()
+
+
+def test_socket_engine_has_no_streams(monkeypatch):
+    monkeypatch.setattr(events, 'ENGINE', 'socket')
+    with pytest.raises(RuntimeError):
+        asyncio.run(events.stream(events.Speech).open())
+
+
+def _receive(client, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        data += client.recv(1024)
+    return data
+
+
+def test_socket_engine_sinks_restored(server, monkeypatch):
+    monkeypatch.setattr(events, 'ENGINE', 'socket')
+    index = bytes((events.Speech._index,))
+    expected = lang_version_packet + pack_packet(SET_EVENT, 0, index)
+    received = []
+    events.Speech.set(received.append)
+    client, _ = server.accept()
+    with client:
+        assert _receive(client, len(expected)) == expected
+
+    # the next connection sets the event again and feeds the same handler
+    drop_blocking_connection()
+    connection = get_blocking_connection()
+    client, _ = server.accept()
+    with client:
+        assert _receive(client, len(expected)) == expected
+        client.sendall(event_packet(events.Speech._index, Str('hi'),
+                                    Str('Bob'), UInt(7)))
+        connection.receive_events(.1)
+        assert [event.sender_name for event in received] == ['Bob']
+    _disconnect(threading.get_ident())
+
+
+def test_set_in_coroutine(stealth):
+    received = []
+
+    async def main():
+        await stealth.start()
+        # the running loop can not wait for a new connection
+        with pytest.raises(RuntimeError):
+            events.Speech.set(received.append)
+
+        await events.Speech.set_async(received.append)
+        (_, _, data), = await stealth.wait_for(SET_EVENT)
+        assert data == bytes((events.Speech._index,))
+
+        # the connection of the running loop is used
+        events.ItemDeleted.set(received.append)
+        stealth.write(event_packet(events.Speech._index, Str('hi'),
+                                   Str('Bob'), UInt(7)))
+        await stealth.wait_for(SET_EVENT, 2)
+        while not received:
+            await asyncio.sleep(.005)
+        events.ItemDeleted.unset(received.append)
+        await events.Speech.unset_async(received.append)
+        await stealth.wait_for(UNSET_EVENT, 2)
+        assert [event.sender_name for event in received] == ['Bob']
+        _disconnect(threading.get_ident())
+        await stealth.stop()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
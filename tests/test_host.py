@@ -0,0 +1,152 @@
+"""Tests of the script host daemon and its client."""
+
+import asyncio
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+
+import pytest
+
+from stealthapi import config, host, submit
+from stealthapi.core.commands import GET_PROFILE_NAME
+from stealthapi.core.connection_container import _disconnect, \
+    drop_blocking_connection, get_connection
+from stealthapi.core.datatypes import Str
+from stealthapi.core.scriptmethod import ScriptMethod
+from stealthapi.core.utils import get_event_loop
+
+from conftest import response_packet
+
+
+@pytest.fixture
+def script_host(tmp_path, monkeypatch, server) -> host.ScriptHost:
+    """A host listening in a temporary runtime directory, its scripts use
+    the socket engine."""
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.setattr(config, 'ENGINE', 'socket')
+    script_host = host.ScriptHost(port=0)
+    yield script_host
+    script_host.close()
+
+
+def _handle(script_host: host.ScriptHost, count: int = 1) -> threading.Thread:
+    """Run the requests of `count` clients in a thread."""
+    def handle():
+        for _ in range(count):
+            client, _ = script_host._server.accept()
+            script_host._handle(client)
+        drop_blocking_connection()
+
+    thread = threading.Thread(target=handle)
+    thread.start()
+    return thread
+
+
+def _script(tmp_path, code: str) -> str:
+    path = tmp_path / 'script.py'
+    path.write_text(code)
+    return str(path)
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                    reason='requires Unix sockets')
+def test_unix_socket(script_host, tmp_path):
+    script_host._listen()
+    directory = submit._runtime_dir()
+    path = os.path.join(directory, submit._SOCKET_NAME)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    thread = _handle(script_host)
+    assert submit.submit(_script(tmp_path, 'raise SystemExit(3)')) == 3
+    thread.join()
+
+    script_host.close()
+    assert not os.path.exists(path)
+
+
+def test_tcp_token(script_host, tmp_path, monkeypatch):
+    monkeypatch.delattr(socket, 'AF_UNIX', raising=False)
+    script_host._listen()
+    path = os.path.join(submit._runtime_dir(), submit._ADDRESS_NAME)
+    if sys.platform != 'win32':
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    with open(path) as file:
+        port = json.load(file)['port']
+    script = _script(tmp_path, 'raise SystemExit(3)')
+
+    thread = _handle(script_host, 2)
+    with socket.create_connection(('127.0.0.1', port)) as sock, \
+            sock.makefile('rb') as file:
+        submit._send_message(sock, {'path': script, 'token': 'guess'})
+        assert submit._receive_message(file) == {
+            'stderr': 'Access denied.\n', 'exit': 2}
+    assert submit.submit(script) == 3
+    thread.join()
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='requires POSIX')
+def test_runtime_dir_of_others_refused(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    directory = submit._runtime_dir(create=True)
+    os.chmod(directory, 0o755)
+    with pytest.raises(PermissionError):
+        submit._runtime_dir()
+
+
+def test_reset_keeps_reconnection(stealth):
+    loop = get_event_loop()
+    loop.run_until_complete(stealth.start())
+    connection = loop.run_until_complete(get_connection())
+    loop.run_until_complete(connection.wait_connected())
+    tasks = host._tasks()
+
+    async def script():
+        # a task left running by the script and a lost connection
+        left = asyncio.ensure_future(asyncio.sleep(100))
+        await stealth.stop()
+        while not connection.tasks:
+            await asyncio.sleep(.005)
+        return left
+
+    left = loop.run_until_complete(script())
+    host._reset_connection(tasks)
+    assert left.cancelled()
+
+    # the connection is restored when Stealth is back
+    assert connection.tasks
+    loop.run_until_complete(stealth.start())
+    loop.run_until_complete(asyncio.wait_for(connection.wait_connected(), 5))
+    assert stealth.connections == 2
+    _disconnect(threading.get_ident())
+
+
+def test_script_with_own_event_loop(stealth):
+    method = ScriptMethod(GET_PROFILE_NAME, [], Str)
+    stealth.answer = lambda cmd, request_id, data: \
+        response_packet(request_id, Str('me').pack()) \
+        if cmd == GET_PROFILE_NAME else None
+
+    def worker() -> list[str]:
+        host._connect()
+        try:
+            # a script awaiting methods in event loops of its own
+            results = [asyncio.run(method.call(timeout=5)) for _ in range(2)]
+            # the connection of the worker loop is still usable
+            results.append(method(timeout=5))
+            return results
+        finally:
+            _disconnect(threading.get_ident())
+
+    async def main():
+        await stealth.start()
+        results = await asyncio.get_running_loop().run_in_executor(None,
+                                                                   worker)
+        assert results == ['me'] * 3
+        assert stealth.connections == 3
+        await stealth.stop()
+
+    asyncio.run(asyncio.wait_for(main(), 10))
@@ -0,0 +1,89 @@
+"""Tests of the AIMD rules of the concurrency limiter."""
+
+import asyncio
+import math
+
+import pytest
+
+from stealthapi.core.limiter import ConcurrencyLimiter
+
+_INDEX = 1  # the method index of the requests
+
+
+def _round(limiter: ConcurrencyLimiter, count: int, rtt: float | None = None,
+           dropped: bool = False) -> None:
+    """Send `count` requests at once and release them with the result."""
+    async def send():
+        for _ in range(count):
+            await limiter.acquire(_INDEX)
+        for _ in range(count):
+            limiter.release(rtt, dropped)
+
+    asyncio.run(send())
+
+
+def test_additive_increase_when_limit_used():
+    limiter = ConcurrencyLimiter(4, 100)
+    _round(limiter, 4, .001)
+    # the first release finds the limit used, the rest do not
+    assert limiter.limit == pytest.approx(4.25)
+
+    limiter = ConcurrencyLimiter(4, 100)
+    for _ in range(20):
+        _round(limiter, math.ceil(limiter.limit), .001)
+    # + 1 / limit per round, the limit stays below 8
+    assert 4 + 20 / 8 < limiter.limit < 4 + 20 / 4
+
+
+def test_no_increase_when_limit_not_used():
+    limiter = ConcurrencyLimiter(10, 100)
+    for _ in range(20):
+        _round(limiter, 2, .001)
+    assert limiter.limit == 10
+
+
+def test_increase_limited():
+    limiter = ConcurrencyLimiter(4, 5)
+    for _ in range(100):
+        _round(limiter, math.ceil(limiter.limit), .001)
+    assert limiter.limit == 5
+
+
+def test_cut_on_rising_latency_once_per_round_trip():
+    limiter = ConcurrencyLimiter(16, 100)
+    for _ in range(10):
+        _round(limiter, 1, .001)
+    for _ in range(20):
+        _round(limiter, 1, 1.)
+    # all the slow samples came within one round trip
+    assert limiter.limit == pytest.approx(16 * .9)
+
+
+def test_no_cut_on_single_slow_sample():
+    limiter = ConcurrencyLimiter(16, 100)
+    for _ in range(10):
+        _round(limiter, 1, .001)
+    _round(limiter, 1, .01)
+    assert limiter.limit == 16
+
+
+def test_no_cut_on_improving_latency():
+    limiter = ConcurrencyLimiter(16, 100)
+    # a cold first request, then the usual latency
+    for rtt in (.01, .001, .001):
+        _round(limiter, 1, rtt)
+    assert limiter.limit == 16
+    assert limiter.baseline_rtt == .001
+
+
+def test_cut_on_drop_once_per_round_trip():
+    limiter = ConcurrencyLimiter(10, 100)
+    _round(limiter, 1, .1)
+    _round(limiter, 3, dropped=True)
+    assert limiter.limit == pytest.approx(9)
+
+
+def test_cut_limited():
+    limiter = ConcurrencyLimiter(2, 100, min_limit=2)
+    _round(limiter, 1, dropped=True)
+    assert limiter.limit == 2
@@ -0,0 +1,154 @@
+"""Tests of the parsing of the data received from Stealth."""
+
+import asyncio
+import random
+import struct
+
+import pytest
+
+from stealthapi.core.commands import EVENT_PROC, PAUSE_SCRIPT, \
+    TERMINATE_SCRIPT
+from stealthapi.core.datatypes import Str, UInt
+from stealthapi.core.protocol import StealthConnection
+
+from conftest import event_packet, response_packet
+
+_EVENT_INDEX = 2
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def _command_packet(cmd: int, data: bytes = b'') -> bytes:
+    """Form a packet without a request id, e.g. a pause one."""
+    return struct.pack('<IH', 2 + len(data), cmd) + data
+
+
+def _connection() -> tuple[StealthConnection, list[bytes]]:
+    """Make a connection collecting the data of the received events."""
+    connection = StealthConnection()
+    events = []
+    connection.event_sinks[_EVENT_INDEX] = ()
+    connection._dispatch_event = events.append
+    return connection, events
+
+
+def _feed(connection: StealthConnection, data: bytes,
+          sizes: list[int]) -> None:
+    """Pass the data to the connection in chunks of the given sizes, the
+    rest in the last one."""
+    offset = 0
+    for size in sizes:
+        connection.data_received(data[offset:offset + size])
+        offset += size
+    connection.data_received(data[offset:])
+
+
+def test_packet_split_across_chunks():
+    async def main():
+        connection, _ = _connection()
+        request_id, future = connection.register_request()
+        packet = response_packet(request_id, b'result')
+        # split inside the size, the header and the data
+        _feed(connection, packet, [2, 3, 1, 4])
+        assert future.result() == b'result'
+        assert not connection._buffer
+
+        request_id, future = connection.register_request()
+        packet = response_packet(request_id, b'result')
+        for i in range(len(packet)):
+            assert not future.done()
+            connection.data_received(packet[i:i + 1])
+        assert future.result() == b'result'
+
+    _run(main())
+
+
+def test_packets_in_one_chunk():
+    async def main():
+        connection, events = _connection()
+        requests = [connection.register_request() for _ in range(3)]
+        event = event_packet(_EVENT_INDEX, Str('hi'), Str('Bob'), UInt(7))
+        data = b''.join(response_packet(request_id, bytes((i,)))
+                        for i, (request_id, _) in enumerate(requests))
+        data += event + _command_packet(0xFFFF)  # an unknown packet
+        # the first packet of the next chunk starts in this one
+        connection.data_received(data + event[:5])
+        assert [future.result() for _, future in requests] == \
+            [b'\0', b'\1', b'\2']
+        assert events == [event[6:]]
+        assert connection._buffer == event[:5]
+
+        connection.data_received(event[5:])
+        assert events == [event[6:]] * 2
+        assert not connection._buffer
+
+    _run(main())
+
+
+def test_event_without_sinks_ignored():
+    async def main():
+        connection, events = _connection()
+        connection.data_received(event_packet(_EVENT_INDEX + 1, UInt(1)))
+        assert events == []
+
+    _run(main())
+
+
+def test_pause_and_terminate():
+    async def main():
+        connection, _ = _connection()
+        pause = _command_packet(PAUSE_SCRIPT)
+        connection.data_received(pause)
+        assert connection.pause
+        connection.data_received(pause[:3])
+        assert connection.pause
+        connection.data_received(pause[3:])
+        assert not connection.pause
+
+        with pytest.raises(SystemExit):
+            connection.data_received(_command_packet(TERMINATE_SCRIPT))
+
+    _run(main())
+
+
+def test_fuzz_chunks():
+    """Random packet streams split at random give the same results."""
+    rnd = random.Random(0)
+
+    async def main():
+        for _ in range(200):
+            connection, events = _connection()
+            data = b''
+            responses, expected_events, pauses = {}, [], 0
+            for _ in range(rnd.randint(1, 30)):
+                kind = rnd.choice(('response', 'event', 'pause', 'other'))
+                payload = rnd.randbytes(rnd.choice((0, 1, 7, 300, 5000)))
+                if kind == 'response':
+                    request_id, future = connection.register_request()
+                    responses[request_id] = future, payload
+                    data += response_packet(request_id, payload)
+                elif kind == 'event':
+                    packet = _command_packet(
+                        EVENT_PROC, bytes((_EVENT_INDEX,)) + payload)
+                    expected_events.append(packet[6:])
+                    data += packet
+                elif kind == 'pause':
+                    pauses += 1
+                    data += _command_packet(PAUSE_SCRIPT)
+                else:
+                    data += _command_packet(0x7FFF, payload)
+
+            cuts = sorted(rnd.sample(range(1, len(data)),
+                                     min(len(data) - 1, rnd.randint(0, 20))))
+            sizes = [b - a for a, b in zip([0] + cuts, cuts)]
+            _feed(connection, data, sizes)
+
+            for future, payload in responses.values():
+                assert future.result() == payload
+            assert events == expected_events
+            assert connection.pause == bool(pauses % 2)
+            assert not connection._buffer
+
+    _run(main())
@@ -0,0 +1,35 @@
+"""Tests of the sampling profiler."""
+
+import asyncio
+import threading
+
+from stealthapi.core.commands import GET_PROFILE_NAME
+from stealthapi.core.connection_container import _disconnect
+from stealthapi.core.datatypes import Str
+from stealthapi.core.scriptmethod import ScriptMethod
+from stealthapi.profiler import SamplingProfiler
+
+from conftest import response_packet
+
+
+def test_async_call_attributed_to_await_line(stealth):
+    method = ScriptMethod(GET_PROFILE_NAME, [], Str)
+    profiler = SamplingProfiler()
+
+    async def script():
+        await stealth.start()
+        stealth.answer = lambda cmd, request_id, data: \
+            response_packet(request_id, Str('me').pack())
+        with profiler:
+            assert await method.call(timeout=5) == 'me'  # the sampled line
+        _disconnect(threading.get_ident())
+
+    asyncio.run(script())
+    assert profiler.calls == 1
+    stack, = profiler.stacks
+    frames = stack.split(';')
+    assert frames[-1] == 'get_profile_name'
+    assert frames[-2].startswith('script (test_profiler.py:')
+    line = int(frames[-2].rsplit(':', 1)[1][:-1])
+    with open(__file__) as file:
+        assert 'the sampled line' in file.readlines()[line - 1]
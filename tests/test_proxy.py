@@ -0,0 +1,292 @@
+"""Tests of the proxy daemon."""
+
+import asyncio
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import time
+
+import pytest
+
+from stealthapi import submit
+from stealthapi.core import blocking, protocol
+from stealthapi.core.blocking import BlockingConnection
+from stealthapi.core.commands import ADD_TO_SYSTEM_JOURNAL, EVENT_PROC, \
+    GET_PROFILE_NAME, METHOD_RESPONSE, PAUSE_SCRIPT, SET_EVENT, UNSET_EVENT
+from stealthapi.core.datatypes import UInt
+from stealthapi.core.packet import lang_version_packet, pack_packet
+from stealthapi.core.protocol import StealthConnection
+from stealthapi.core.utils import _PROXY_ADDRESS_NAME
+from stealthapi.proxy import StealthProxy, _Upstream
+
+from conftest import event_packet, response_packet
+
+
+class _Transport(asyncio.Transport):
+    def is_closing(self) -> bool:
+        return False
+
+
+def test_clients_bound_to_connected_upstreams():
+    async def main():
+        proxy = StealthProxy(upstreams=3)
+        proxy.upstreams = [_Upstream() for _ in range(3)]
+        # the first upstream connection would be chosen, but it is lost
+        for upstream in proxy.upstreams[1:]:
+            upstream._transport = _Transport()
+        for _ in range(4):
+            proxy._accept()
+        assert not proxy.upstreams[0].clients
+        assert [len(upstream.clients) for upstream in proxy.upstreams[1:]] \
+            == [2, 2]
+
+        # all of them are lost - bind to the least loaded one anyway
+        for upstream in proxy.upstreams:
+            upstream._transport = None
+        proxy._accept()
+        assert len(proxy.upstreams[0].clients) == 1
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def runtime_dir(tmp_path, monkeypatch) -> str:
+    """A temporary user runtime directory of the proxy."""
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    return str(tmp_path)
+
+
+class _Client:
+    """A script talking to the proxy."""
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, proxy: StealthProxy,
+                      token: bytes = b'') -> '_Client':
+        if proxy._token is None:
+            streams = await asyncio.open_unix_connection(proxy.path)
+        else:
+            streams = await asyncio.open_connection(
+                'localhost', proxy._server.sockets[0].getsockname()[1])
+        client = cls(*streams)
+        client.send(token + lang_version_packet)
+        return client
+
+    def send(self, data: bytes) -> None:
+        self.writer.write(data)
+
+    async def receive(self) -> tuple[int, bytes]:
+        """Return the command and the data of the next packet."""
+        size, = struct.unpack('<I', await self.reader.readexactly(4))
+        data = await self.reader.readexactly(size)
+        return struct.unpack_from('<H', data)[0], data[2:]
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+async def _start(stealth) -> StealthProxy:
+    await stealth.start()
+    # Stealth answers with the request id it has got
+    stealth.answer = lambda cmd, request_id, data: \
+        response_packet(request_id, struct.pack('<H', request_id)) \
+        if cmd == GET_PROFILE_NAME else None
+    proxy = StealthProxy(upstreams=1)
+    await proxy.start()
+    return proxy
+
+
+async def _sync(stealth, client: _Client) -> None:
+    """Wait until the packets sent by the client have reached Stealth."""
+    count = len(stealth.received) + 1
+    client.send(pack_packet(ADD_TO_SYSTEM_JOURNAL, 0, b'sync'))
+    while len(stealth.received) < count or \
+            stealth.received[-1][0] != ADD_TO_SYSTEM_JOURNAL:
+        await asyncio.sleep(.005)
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+unix_only = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'),
+                               reason='requires Unix sockets')
+
+
+@unix_only
+def test_unix_socket_private(stealth, runtime_dir):
+    async def main():
+        proxy = await _start(stealth)
+        assert os.path.dirname(proxy.path) == submit._runtime_dir()
+        assert stat.S_IMODE(os.stat(proxy.path).st_mode) == 0o600
+        proxy.close()
+        assert not os.path.exists(proxy.path)
+        await stealth.stop()
+
+    _run(main())
+
+
+@unix_only
+def test_request_ids_rewritten(stealth, runtime_dir):
+    async def main():
+        proxy = await _start(stealth)
+        clients = [await _Client.connect(proxy) for _ in range(2)]
+        for client in clients:
+            client.send(pack_packet(GET_PROFILE_NAME, 5))
+        upstream_ids = set()
+        for client in clients:
+            cmd, data = await client.receive()
+            request_id, upstream_id = struct.unpack('<2H', data)
+            assert (cmd, request_id) == (METHOD_RESPONSE, 5)
+            upstream_ids.add(upstream_id)
+        # the ids were unique within the upstream connection
+        assert upstream_ids == {request_id for cmd, request_id, _
+                                in stealth.received
+                                if cmd == GET_PROFILE_NAME}
+        assert len(upstream_ids) == 2
+        assert proxy.upstreams[0].pending_requests == 0
+
+        for client in clients:
+            client.close()
+        proxy.close()
+        await stealth.stop()
+
+    _run(main())
+
+
+@unix_only
+def test_event_subscriptions_counted(stealth, runtime_dir):
+    index = bytes((2,))
+
+    def count(cmd: int) -> int:
+        return sum(packet[0] == cmd for packet in stealth.received)
+
+    async def main():
+        proxy = await _start(stealth)
+        first, second = [await _Client.connect(proxy) for _ in range(2)]
+        for client in (first, second):
+            client.send(pack_packet(SET_EVENT, 0, index))
+            await _sync(stealth, client)
+        assert count(SET_EVENT) == 1
+
+        first.send(pack_packet(UNSET_EVENT, 0, index))
+        await _sync(stealth, first)
+        assert count(UNSET_EVENT) == 0
+        second.send(pack_packet(UNSET_EVENT, 0, index))
+        await _sync(stealth, second)
+        assert count(UNSET_EVENT) == 1
+
+        # a client leaving drops its subscriptions
+        first.send(pack_packet(SET_EVENT, 0, index))
+        await _sync(stealth, first)
+        first.close()
+        await stealth.wait_for(UNSET_EVENT, 2)
+        assert count(SET_EVENT) == 2
+
+        second.close()
+        proxy.close()
+        await stealth.stop()
+
+    _run(main())
+
+
+@unix_only
+def test_events_to_subscribers_and_pause_to_all(stealth, runtime_dir):
+    async def main():
+        proxy = await _start(stealth)
+        subscriber, other = [await _Client.connect(proxy) for _ in range(2)]
+        subscriber.send(pack_packet(SET_EVENT, 0, bytes((2,))))
+        await _sync(stealth, subscriber)
+
+        event = event_packet(2, UInt(7))
+        stealth.write(event)
+        stealth.write(struct.pack('<IH', 2, PAUSE_SCRIPT))
+        assert await subscriber.receive() == (EVENT_PROC, event[6:])
+        assert await subscriber.receive() == (PAUSE_SCRIPT, b'')
+        assert await other.receive() == (PAUSE_SCRIPT, b'')
+
+        # a client joining the paused connection is paused at once
+        late = await _Client.connect(proxy)
+        assert await late.receive() == (PAUSE_SCRIPT, b'')
+
+        for client in (subscriber, other, late):
+            client.close()
+        proxy.close()
+        await stealth.stop()
+
+    _run(main())
+
+
+@unix_only
+def test_clients_closed_on_upstream_loss(stealth, runtime_dir):
+    async def main():
+        proxy = await _start(stealth)
+        clients = [await _Client.connect(proxy) for _ in range(2)]
+        await _sync(stealth, clients[-1])
+        stealth.drop()
+        for client in clients:
+            assert await client.reader.read() == b''
+            client.close()
+        assert not proxy.upstreams[0].clients
+        proxy.close()
+        await stealth.stop()
+
+    _run(main())
+
+
+def test_tcp_token(stealth, runtime_dir, monkeypatch):
+    async def main():
+        # the loop is made already, it needs Unix sockets where there are
+        monkeypatch.delattr(socket, 'AF_UNIX', raising=False)
+        proxy = StealthProxy(port=0, upstreams=1)
+        await stealth.start()
+        stealth.answer = lambda cmd, request_id, data: \
+            response_packet(request_id, b'me')
+        await proxy.start()
+        path = os.path.join(submit._runtime_dir(), _PROXY_ADDRESS_NAME)
+        if sys.platform != 'win32':
+            assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+        intruder = await _Client.connect(proxy, b'0' * len(proxy._token))
+        intruder.send(pack_packet(GET_PROFILE_NAME, 5))
+        assert await intruder.reader.read() == b''
+        intruder.close()
+        assert GET_PROFILE_NAME not in [cmd for cmd, _, _ in stealth.received]
+
+        # a connection configured to use the proxy sends the token
+        with open(path) as file:
+            port = json.load(file)['port']
+        monkeypatch.setattr(protocol, 'PROXY_PORT', port)
+        connection = StealthConnection()
+        await connection.connect()
+        request_id, future = connection.register_request()
+        connection.send(pack_packet(GET_PROFILE_NAME, request_id),
+                        request_id)
+        assert await future == b'me'
+        connection.close()
+
+        monkeypatch.setattr(blocking, 'PROXY_PORT', port)
+
+        def call() -> bytes:
+            connection = BlockingConnection()
+            try:
+                connection.send(pack_packet(GET_PROFILE_NAME, 1))
+                return connection.wait_response(1, time.monotonic() + 5)
+            finally:
+                connection.close()
+
+        loop = asyncio.get_running_loop()
+        assert await loop.run_in_executor(None, call) == b'me'
+
+        proxy.close()
+        assert not os.path.exists(path)
+        await stealth.stop()
+
+    _run(main())
@@ -0,0 +1,181 @@
+"""Tests of the reconnection of StealthConnection."""
+
+import asyncio
+import threading
+
+import pytest
+
+from stealthapi.core import protocol, utils
+from stealthapi.core.commands import ADD_TO_SYSTEM_JOURNAL, \
+    GET_PROFILE_NAME, SET_EVENT
+from stealthapi.core.connection_container import _disconnect, get_connection
+from stealthapi.core.packet import pack_packet
+from stealthapi.core.protocol import StealthConnection
+
+from conftest import response_packet
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def _wait(condition) -> None:
+    while not condition():
+        await asyncio.sleep(.005)
+
+
+def _drop_first_request(stealth):
+    """Make Stealth drop the connection instead of the first answer."""
+    requests = []
+
+    def answer(cmd, request_id, data):
+        if cmd != GET_PROFILE_NAME:
+            return None
+        requests.append(request_id)
+        if len(requests) == 1:
+            asyncio.get_running_loop().call_soon(stealth.drop)
+            return None
+        return response_packet(request_id, b'profile')
+    stealth.answer = answer
+    return requests
+
+
+def test_idempotent_request_replayed(stealth):
+    async def main():
+        await stealth.start()
+        requests = _drop_first_request(stealth)
+        connection = StealthConnection()
+        await connection.connect()
+
+        request_id, future = connection.register_request(idempotent=True)
+        connection.send(pack_packet(GET_PROFILE_NAME, request_id), request_id)
+        assert await future == b'profile'
+        assert requests == [request_id, request_id]
+        assert stealth.connections == 2
+        connection.close()
+
+    _run(main())
+
+
+def test_not_idempotent_request_failed(stealth):
+    async def main():
+        await stealth.start()
+        requests = _drop_first_request(stealth)
+        connection = StealthConnection()
+        await connection.connect()
+
+        request_id, future = connection.register_request()
+        connection.send(pack_packet(GET_PROFILE_NAME, request_id), request_id)
+        with pytest.raises(ConnectionResetError):
+            await future
+        await connection.wait_connected()
+        assert requests == [request_id]
+        connection.close()
+
+    _run(main())
+
+
+def test_subscriptions_restored(stealth):
+    async def main():
+        await stealth.start()
+        connection = StealthConnection()
+        await connection.connect()
+
+        connection.subscribe_event(5)
+        await stealth.wait_for(SET_EVENT)
+        stealth.drop()
+        packets = await stealth.wait_for(SET_EVENT, 2)
+        assert [data for _, _, data in packets] == [b'\x05', b'\x05']
+        assert stealth.connections == 2
+        connection.close()
+
+    _run(main())
+
+
+def test_backlog_sent_after_reconnection(stealth):
+    async def main():
+        await stealth.start()
+        stealth.answer = lambda cmd, request_id, data: \
+            response_packet(request_id, data) \
+            if cmd == GET_PROFILE_NAME else None
+        connection = StealthConnection()
+        await connection.connect()
+
+        await stealth.stop()
+        await _wait(lambda: not connection.connected)
+        for text in (b'a', b'b'):
+            connection.send(pack_packet(ADD_TO_SYSTEM_JOURNAL, 0, text))
+        request_id, future = connection.register_request()
+        connection.send(pack_packet(GET_PROFILE_NAME, request_id, b'c'),
+                        request_id)
+
+        await stealth.start()
+        assert await future == b'c'
+        packets = await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL, 2)
+        assert [data for _, _, data in packets] == [b'a', b'b']
+        connection.close()
+
+    _run(main())
+
+
+def test_released_backlog_not_sent(stealth):
+    async def main():
+        await stealth.start()
+        connection = StealthConnection()
+        await connection.connect()
+
+        await stealth.stop()
+        await _wait(lambda: not connection.connected)
+        request_id, future = connection.register_request()
+        connection.send(pack_packet(GET_PROFILE_NAME, request_id, b'move'),
+                        request_id)
+        # the caller gives up, e.g. on timeout
+        connection.release_request(request_id)
+        connection.send(pack_packet(ADD_TO_SYSTEM_JOURNAL, 0, b'after'))
+
+        await stealth.start()
+        await stealth.wait_for(ADD_TO_SYSTEM_JOURNAL)
+        assert not [packet for packet in stealth.received
+                    if packet[0] == GET_PROFILE_NAME]
+        assert request_id not in connection._cancelled
+        connection.close()
+
+    _run(main())
+
+
+def test_failed_connection_replaced(stealth, monkeypatch):
+    monkeypatch.setattr(protocol, 'RECONNECT_ATTEMPTS', 1)
+
+    async def main():
+        await stealth.start()
+        connection = await get_connection()
+        await connection.wait_connected()
+
+        await stealth.stop()
+        await _wait(lambda: connection.closed)
+        with pytest.raises(ConnectionError):
+            await connection.wait_connected()
+
+        await stealth.start()
+        new_connection = await get_connection()
+        assert new_connection is not connection
+        await new_connection.wait_connected()
+        _disconnect(threading.get_ident())
+
+    _run(main())
+
+
+def test_port_provider_closed(monkeypatch):
+    async def main():
+        async def close(reader, writer):
+            await reader.read(100)  # the request, then no answer
+            writer.close()
+
+        server = await asyncio.start_server(close, '127.0.0.1', 0)
+        monkeypatch.setattr(utils, 'HOST', '127.0.0.1')
+        monkeypatch.setattr(utils, 'PORT', server.sockets[0].getsockname()[1])
+        async with server:
+            with pytest.raises(ConnectionResetError):
+                await utils.get_connection_port()
+
+    _run(main())
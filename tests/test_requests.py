@@ -0,0 +1,115 @@
+"""Tests of request deadlines, cancellation and late responses."""
+
+import asyncio
+import threading
+
+import pytest
+
+from stealthapi.core import protocol
+from stealthapi.core.commands import GET_PROFILE_NAME, LANG_VERSION
+from stealthapi.core.connection_container import _disconnect, get_connection
+from stealthapi.core.datatypes import Str
+from stealthapi.core.protocol import StealthConnection
+from stealthapi.core.scriptmethod import MethodTimeoutError, ScriptMethod
+
+from conftest import response_packet
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def _wait(condition) -> None:
+    while not condition():
+        await asyncio.sleep(.005)
+
+
+def test_timeout_and_late_response(stealth):
+    method = ScriptMethod(GET_PROFILE_NAME, [], Str)
+
+    async def main():
+        await stealth.start()  # Stealth does not answer
+        with pytest.raises(MethodTimeoutError):
+            await method.call(timeout=.05)
+        connection = await get_connection()
+        assert connection.pending_requests == 0
+        (_, request_id, _), = await stealth.wait_for(GET_PROFILE_NAME)
+
+        # the late response is dropped and its id may be used again
+        stealth.write(response_packet(request_id, Str('late').pack()))
+        await _wait(lambda: connection.dropped_responses)
+        assert request_id not in connection._cancelled
+
+        stealth.answer = lambda cmd, request_id, data: \
+            response_packet(request_id, Str('me').pack())
+        assert await method.call(timeout=5) == 'me'
+        assert connection.dropped_responses == 1
+        _disconnect(threading.get_ident())
+        await stealth.stop()
+
+    _run(main())
+
+
+def test_cancelled_call_released(stealth):
+    method = ScriptMethod(GET_PROFILE_NAME, [], Str)
+
+    async def main():
+        await stealth.start()
+        task = asyncio.ensure_future(method.call(timeout=0))
+        await stealth.wait_for(GET_PROFILE_NAME)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        connection = await get_connection()
+        assert connection.pending_requests == 0
+        assert len(connection._cancelled) == 1
+        _disconnect(threading.get_ident())
+        await stealth.stop()
+
+    _run(main())
+
+
+def test_unexpected_response_dropped(stealth):
+    async def main():
+        await stealth.start()
+        connection = StealthConnection()
+        await connection.connect()
+        await stealth.wait_for(LANG_VERSION)
+        stealth.write(response_packet(123, b'?'))
+        await _wait(lambda: connection.dropped_responses)
+        connection.close()
+        await stealth.stop()
+
+    _run(main())
+
+
+def test_released_ids_not_reused(stealth):
+    async def main():
+        connection = StealthConnection()
+        first, _ = connection.register_request()
+        connection.release_request(first)
+        ids = {connection.register_request()[0] for _ in range(100)}
+        assert first not in ids
+
+    _run(main())
+
+
+def test_oldest_released_ids_reused(stealth, monkeypatch):
+    monkeypatch.setattr(protocol, 'MAX_REQUEST_ID', 4)
+    monkeypatch.setattr(protocol, '_MAX_CANCELLED', 3)
+
+    async def main():
+        connection = StealthConnection()
+        ids = [connection.register_request()[0] for _ in range(4)]
+        for request_id in ids:
+            connection.release_request(request_id)
+        # only the latest released ids are kept
+        assert list(connection._cancelled) == ids[1:]
+
+        # the first id is free, then the oldest released ones are reused
+        assert [connection.register_request()[0] for _ in range(4)] == \
+            [ids[0]] + ids[1:]
+        with pytest.raises(RuntimeError):
+            connection.register_request()
+
+    _run(main())
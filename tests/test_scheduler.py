@@ -0,0 +1,135 @@
+"""Tests of the priority-aware admission of requests."""
+
+import asyncio
+
+from stealthapi.core.scheduler import Priority, SendScheduler
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def _acquire(scheduler: SendScheduler, priority: Priority,
+                   admitted: list, name: str) -> None:
+    await scheduler.acquire(priority)
+    admitted.append(name)
+
+
+async def _settle() -> None:
+    """Let the started tasks run until they wait."""
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_higher_priority_not_queued_behind_low():
+    async def main():
+        scheduler = SendScheduler(1)
+        admitted = []
+        await scheduler.acquire(Priority.LOW)
+        low = asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, 'low'))
+        await _settle()
+        # the low priority request waits, the urgent ones go first
+        await _acquire(scheduler, Priority.HIGH, admitted, 'high')
+        await _acquire(scheduler, Priority.NORMAL, admitted, 'normal')
+        assert admitted == ['high', 'normal']
+        assert scheduler.stats()['low']['waiting'] == 1
+
+        scheduler.release(Priority.LOW)
+        await low
+        assert admitted == ['high', 'normal', 'low']
+
+    _run(main())
+
+
+def test_low_in_flight_limited():
+    async def main():
+        scheduler = SendScheduler(2)
+        admitted = []
+        tasks = [asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, i))
+            for i in range(5)]
+        await _settle()
+        assert admitted == [0, 1]
+        assert scheduler.stats()['low']['in_flight'] == 2
+        assert scheduler.stats()['low']['waiting'] == 3
+
+        # releases of other priorities give no places
+        scheduler.release(Priority.NORMAL)
+        await _settle()
+        assert admitted == [0, 1]
+
+        for _ in range(3):
+            scheduler.release(Priority.LOW)
+            await _settle()
+            assert scheduler.stats()['low']['in_flight'] == 2
+        await asyncio.gather(*tasks)
+        assert admitted == [0, 1, 2, 3, 4]
+
+    _run(main())
+
+
+def test_place_passed_on_release_in_order():
+    async def main():
+        scheduler = SendScheduler(1)
+        admitted = []
+        await scheduler.acquire(Priority.LOW)
+        tasks = [asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, i))
+            for i in range(3)]
+        await _settle()
+        for i in range(3):
+            scheduler.release(Priority.LOW)
+            await _settle()
+            # one release admits exactly the next waiter
+            assert admitted == list(range(i + 1))
+        await asyncio.gather(*tasks)
+        scheduler.release(Priority.LOW)
+        assert scheduler.stats()['low']['in_flight'] == 0
+
+    _run(main())
+
+
+def test_cancelled_waiter_does_not_leak_place():
+    async def main():
+        scheduler = SendScheduler(1)
+        admitted = []
+        await scheduler.acquire(Priority.LOW)
+        cancelled = asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, 'cancelled'))
+        waiting = asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, 'waiting'))
+        await _settle()
+        cancelled.cancel()
+        await _settle()
+        assert scheduler.stats()['low']['waiting'] == 1
+
+        scheduler.release(Priority.LOW)
+        await waiting
+        assert admitted == ['waiting']
+        scheduler.release(Priority.LOW)
+        assert scheduler.stats()['low']['in_flight'] == 0
+
+    _run(main())
+
+
+def test_cancelled_after_admission_releases_place():
+    async def main():
+        scheduler = SendScheduler(1)
+        admitted = []
+        await scheduler.acquire(Priority.LOW)
+        first = asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, 'first'))
+        second = asyncio.ensure_future(
+            _acquire(scheduler, Priority.LOW, admitted, 'second'))
+        await _settle()
+        # the place is given, but the waiter is cancelled before it runs
+        scheduler.release(Priority.LOW)
+        first.cancel()
+        await second
+        assert admitted == ['second']
+        assert first.cancelled()
+        scheduler.release(Priority.LOW)
+        assert scheduler.stats()['low']['in_flight'] == 0
+
+    _run(main())
@@ -0,0 +1,104 @@
+"""Tests of the spatial queries of the world mirror."""
+
+import random
+
+from stealthapi.world import World
+
+COUNT = 300  # count of random queries
+
+
+def _nearest(world: World, x: int, y: int, type: int | None = None,
+             max_distance: int | None = None) -> int | None:
+    """Return the distance to the nearest object by scanning all of them."""
+    distances = [max(abs(obj.x - x), abs(obj.y - y)) for obj in world
+                 if obj.on_ground and (type is None or obj.type == type)]
+    distances = [d for d in distances
+                 if max_distance is None or d <= max_distance]
+    return min(distances, default=None)
+
+
+def _check(world: World, rnd: random.Random, size: int) -> None:
+    for _ in range(COUNT):
+        x, y = rnd.randint(-size, 2 * size), rnd.randint(-size, 2 * size)
+        type = rnd.choice((None, 1, 2))
+        max_distance = rnd.choice((None, 0, 5, 50, size))
+        obj = world.nearest(x, y, type, max_distance)
+        want = _nearest(world, x, y, type, max_distance)
+        if want is None:
+            assert obj is None
+        else:
+            assert max(abs(obj.x - x), abs(obj.y - y)) == want
+            assert type is None or obj.type == type
+
+
+def _in_range(world: World, x: int, y: int, distance: int,
+              type: int | None = None) -> list[int]:
+    """Return ids of the objects in range by scanning all of them."""
+    return sorted(obj.id for obj in world if obj.on_ground
+                  and max(abs(obj.x - x), abs(obj.y - y)) <= distance
+                  and (type is None or obj.type == type))
+
+
+def test_nearest():
+    rnd = random.Random(0)
+    world = World(cell_size=8)
+    for id in range(500):
+        world.update(id, type=rnd.choice((1, 2, 3)), container=0,
+                     x=rnd.randint(0, 1000), y=rnd.randint(0, 1000))
+    _check(world, rnd, 1000)
+
+    # moved and removed objects change the bounds of the grid
+    for id in rnd.sample(range(500), 200):
+        world.update(id, x=rnd.randint(0, 200), y=rnd.randint(0, 200))
+    for id in rnd.sample(range(500), 200):
+        world.remove(id)
+    _check(world, rnd, 1000)
+
+
+def test_nearest_sparse():
+    rnd = random.Random(0)
+    world = World(cell_size=1)
+    world.update(1, type=1, container=0, x=0, y=0)
+    world.update(2, type=2, container=0, x=5000, y=5000)
+    world.update(3, type=2, container=0, x=-3000, y=7000)
+    _check(world, rnd, 6000)
+
+    world.remove(2)
+    world.remove(3)
+    assert world.nearest(6000, 6000, type=2) is None
+    assert world.nearest(6000, 6000).id == 1
+
+
+def test_nearest_empty():
+    world = World()
+    assert world.nearest(0, 0) is None
+    world.update(1, container=1, x=0, y=0)
+    assert world.nearest(0, 0) is None
+
+
+def test_in_range():
+    rnd = random.Random(0)
+    world = World(cell_size=8)
+    for id in range(500):
+        world.update(id, type=rnd.choice((1, 2, 3)), container=0,
+                     x=rnd.randint(0, 1000), y=rnd.randint(0, 1000))
+    for _ in range(COUNT):
+        x, y = rnd.randint(-500, 1500), rnd.randint(-500, 1500)
+        distance = rnd.choice((0, 5, 50, 300, 3000))
+        type = rnd.choice((None, 1, 2))
+        found = world.in_range(x, y, distance, type)
+        assert sorted(obj.id for obj in found) == \
+            _in_range(world, x, y, distance, type)
+        distances = [max(abs(obj.x - x), abs(obj.y - y)) for obj in found]
+        assert distances == sorted(distances)
+
+
+def test_in_range_sparse():
+    world = World(cell_size=1)
+    world.update(1, type=1, container=0, x=0, y=0)
+    world.update(2, type=1, container=0, x=20000, y=-20000)
+    assert [obj.id for obj in world.in_range(0, 0, 20000)] == [1, 2]
+    assert [obj.id for obj in world.in_range(30000, 0, 5000)] == []
+    world.remove(1)
+    world.remove(2)
+    assert world.in_range(0, 0, 20000) == []